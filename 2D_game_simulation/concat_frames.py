@@ -1,7 +1,11 @@
+import numpy as np
 import pandas as pd
 import glob
 from datetime import datetime
 import stadium_projection
+import gps_store
+import gps_stream
+import time_parsing
 
 
 def concat_frames(csvs_files_path : str , stadium= None ,rows_to_load: int=None, time_begin: str=None, time_end: str=None,
@@ -34,30 +38,80 @@ def concat_frames(csvs_files_path : str , stadium= None ,rows_to_load: int=None,
         df_list.append(temp)
 
     df = pd.concat(df_list)
+    return _finalize_game_frame(df, stadium, output_path)
+
+
+def concat_store_frames(store_path: str, season: str, game_folder_name: str, stadium=None, columns: list = None,
+                        time_begin: str = None, time_end: str = None, output_path: str = 'output.csv'):
+    """
+    Same as concat_frames but reads the game from the columnar GPS store (see gps_store.py).
+    Only the requested columns and the rows inside the time range are read from disk, streamed one chunk at a time.
+
+    :param columns (list): Columns to load, 'Time', 'Lat' and 'Lon' are always loaded. Default is all the columns.
+
+    :param output_path (str): Saved as Parquet when ending with ".parquet", otherwise as CSV.
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys(['Time', 'Lat', 'Lon'] + list(columns)))
+    year, month, day = time_parsing.date_from_filename(game_folder_name)
+    # concat_frames is exclusive on both ends while the stream begin bound is inclusive
+    begin = time_parsing.clock_to_ns(time_begin, year, month, day) + 1 if time_begin is not None else None
+    end = time_parsing.clock_to_ns(time_end, year, month, day) if time_end is not None else None
+    df_list = []
+    for player_name in gps_store.list_players(store_path, season, game_folder_name):
+        chunks = gps_stream.iter_store_chunks(store_path, season, game_folder_name, player_name, columns, begin, end)
+        df_list.extend(_first_sample_per_second(chunks, player_name))
+    df = pd.concat(df_list) if df_list else pd.DataFrame(columns=(columns or []) + ['Player', 'RoundedTime'])
+    return _finalize_game_frame(df, stadium, output_path)
+
+
+def _finalize_game_frame(df, stadium, output_path):
     df.sort_values(by=['RoundedTime', 'Player'], inplace=True)
     if stadium:
-        df['xyCoords'] = df.apply(lambda row: stadium_projection.project_around_pitch_center(float(row['Lat']),float(row['Lon']),stadium),axis=1)
-    df.to_csv(output_path)
+        x, y = stadium_projection.project_around_pitch_center_arrays(df['Lat'].astype(float), df['Lon'].astype(float), stadium)
+        df['xyCoords'] = list(zip(x.tolist(), y.tolist()))
+    if output_path.endswith('.parquet'):
+        df.to_parquet(output_path)
+    else:
+        df.to_csv(output_path)
     return df
 
 
+def _first_sample_per_second(chunks, player_name):
+    """
+    Keep the first located sample of every second of a time sorted chunks stream, with its 'RoundedTime'.
+    Only the kept samples (1Hz) are held, a second spanning two chunks is kept once.
+    """
+    last_second = None
+    for chunk in chunks:
+        times = chunk['Time'].to_numpy().astype('datetime64[ns]').view('int64')
+        seconds = times - times % time_parsing.NS_PER_SECOND
+        keep = chunk['Lat'].to_numpy() != 0
+        seconds_kept = seconds[keep]
+        first = np.ones(len(seconds_kept), dtype=bool)
+        first[1:] = seconds_kept[1:] != seconds_kept[:-1]
+        if last_second is not None and len(seconds_kept):
+            first[0] = seconds_kept[0] != last_second
+        if len(seconds_kept):
+            last_second = seconds_kept[-1]
+        keep[keep] = first
+        if keep.any():
+            yield chunk[keep].assign(Player=player_name, RoundedTime=time_parsing.ns_to_datetime(seconds[keep]))
+
+
 def load_player_csv_by_time(file, rows_to_load, time_begin, time_end):
+    """
+    Load a player csv file streamed in chunks, peak memory is bounded by the chunk size and the 1Hz kept samples.
+    The file samples are expected in time order.
+    """
     playerName = file.split("-")[-3]
-    day = int(file.split("-")[-4])
-    month = int(file.split("-")[-5])
-    year = int(file.split('\\')[-1].split('-')[0])
-    temp = pd.read_csv(file, nrows=rows_to_load)
-    temp['Player'] = playerName
-    temp['Time'] = temp['Time'].apply(
-        lambda t: datetime.strptime(t, "%Y-%m-%d %H:%M:%S.%f").replace(year=year, month=month, day=day))
-    temp = temp[temp['Lat'] != 0]
-    if time_begin is not None:
-        start_hour, start_minute, start_second = map(int, time_begin.split(':'))
-        temp = temp[(temp['Time'] > datetime(year, month, day, int(start_hour), int(start_minute), int(start_second)))]
-    if time_end is not None:
-        end_hour, end_minute, end_second = map(int, time_end.split(':'))
-        temp = temp[(temp['Time'] < datetime(year, month, day, int(end_hour), int(end_minute), int(end_second)))]
-    temp['RoundedTime'] = temp['Time'].dt.floor('s')
-    temp = temp.sort_values('Time').drop_duplicates(subset='RoundedTime', keep='first')
-    return temp
+    year, month, day = time_parsing.date_from_filename(file)
+    # the original filter is exclusive on both ends while the stream begin bound is inclusive
+    begin = time_parsing.clock_to_ns(time_begin, year, month, day) + 1 if time_begin is not None else None
+    end = time_parsing.clock_to_ns(time_end, year, month, day) if time_end is not None else None
+    chunks = gps_stream.iter_csv_chunks(file, time_begin_ns=begin, time_end_ns=end, nrows=rows_to_load)
+    df_list = list(_first_sample_per_second(chunks, playerName))
+    if not df_list:
+        return pd.DataFrame(columns=['Time', 'Lat', 'Lon', 'Player', 'RoundedTime'])
+    return pd.concat(df_list)
 
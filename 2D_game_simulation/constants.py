@@ -19,4 +19,17 @@ POSITIONS_MAPPING = {
         'GK': 'goalkeeper'
  }
 ZONE_6_SPRINT_THRESHOLD = 6.94   # m/s
-ZONE_5_SPRINT_THRESHOLD = 5.41  # m/s
\ No newline at end of file
+ZONE_5_SPRINT_THRESHOLD = 5.41  # m/s
+NOMINAL_SAMPLE_RATE_HZ = 100  # Hz, rate of the STATSports extended exports
+MAX_SAMPLE_GAP_S = 0.5  # seconds, longer gaps between samples (drop outs, playing windows cuts) are clipped to it
+# Speed zones edges (m/s), zone k is [SPEED_ZONES[k-1], SPEED_ZONES[k]), zones 5 and 6 are the sprint zones above
+SPEED_ZONES = [0.0, 1.94, 3.89, 4.72, ZONE_5_SPRINT_THRESHOLD, ZONE_6_SPRINT_THRESHOLD, float('inf')]
+ACCELERATION_THRESHOLD = 3.0  # m/s² - acording to STATSports documentation
+# Acceleration magnitude bands edges (m/s²) of the banded accelerations / decelerations counts
+ACCELERATION_BANDS = [2.0, 3.0, 4.0, float('inf')]
+# Sprint bouts - runs over the sprint threshold, closer than the minimal gap are merged, shorter than the minimal duration dropped
+SPRINT_MIN_DURATION_S = 1.0  # seconds
+SPRINT_MIN_GAP_S = 1.0  # seconds
+# Repeated sprints sequence - at least REPEATED_SPRINT_MIN_BOUTS bouts with at most REPEATED_SPRINT_MAX_RECOVERY_S between them
+REPEATED_SPRINT_MIN_BOUTS = 3
+REPEATED_SPRINT_MAX_RECOVERY_S = 21.0  # seconds
@@ -0,0 +1,191 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import stadium_projection
+import gps_store
+import gps_stream
+import time_parsing
+
+"""
+Time aligned game tensor.
+All the players of a game are put on one shared time grid (grid_hz samples per second, aligned on the epoch) as a
+float64 array of shape (time, player, channel) and a boolean validity mask of shape (time, player).
+Every grid slot holds the first located sample ('Lat' != 0) of the player inside the slot, like concat_frames keeps
+the first located sample of every second, slots without such sample are NaN and not valid.
+Both arrays are saved as .npy files inside the game folder of the GPS store with a JSON sidecar, and are loaded back
+memory-mapped, so consumers slice them without copies (a time range is a contiguous block of the file):
+    tensor, mask, meta = load_game_tensor(store_path, season, game_folder_name)
+    speeds = tensor[tensor_time_slice(meta, begin_ns, end_ns), :, channel_index(meta, "Speed (m/s)")]
+Sidecar (JSON):
+{
+    "players": [player_name, ...], "channels": [channel, ...],
+    "t0_ns": time of the first grid slot, "step_ns": grid step, "n_steps": number of grid slots,
+    "grid_hz": ..., "stadium": the projection stadium or null ("x" and "y" are NaN without a stadium)
+}
+"""
+
+TENSOR_CHANNELS = ["Lat", "Lon", "x", "y", "Speed (m/s)", "Accl X", "Accl Y", "Accl Z"]
+SOURCE_COLUMNS = ["Lat", "Lon", "Speed (m/s)", "Accl X", "Accl Y", "Accl Z"]
+DEFAULT_GRID_HZ = 10
+
+
+def get_tensor_paths(store_path: str, season: str, game_folder_name: str, grid_hz: float = DEFAULT_GRID_HZ):
+    """(tensor .npy, mask .npy, sidecar .json) paths of a game tensor."""
+    prefix = os.path.join(gps_store.game_partition_path(store_path, season, game_folder_name), f"game_tensor_{grid_hz:g}hz")
+    return prefix + ".npy", prefix + "_mask.npy", prefix + ".json"
+
+
+def _session_time_span(store_path: str, season: str, game_folder_name: str, player_name: str):
+    """(first, last) sample time of a stored session from the Parquet 'Time' statistics, None if it has none."""
+    parquet_file = pq.ParquetFile(gps_store.player_session_path(store_path, season, game_folder_name, player_name))
+    time_index = parquet_file.schema_arrow.get_field_index('Time')
+    span = None
+    for i in range(parquet_file.metadata.num_row_groups):
+        statistics = parquet_file.metadata.row_group(i).column(time_index).statistics
+        if statistics is None or not statistics.has_min_max:
+            continue
+        first = pd.Timestamp(statistics.min).as_unit('ns').value
+        last = pd.Timestamp(statistics.max).as_unit('ns').value
+        span = (first, last) if span is None else (min(span[0], first), max(span[1], last))
+    return span
+
+
+def _game_time_span(store_path: str, season: str, game_folder_name: str, players: list):
+    """[begin, end) of the game samples, the playing windows span when the game has an index."""
+    players_windows = gps_store.read_playing_windows(store_path, season, game_folder_name)
+    if players_windows is not None:
+        windows = [window for player_name in players for window in players_windows.get(player_name, [])]
+        if windows:
+            return min(start for start, _ in windows), max(end for _, end in windows)
+    spans = [span for span in (_session_time_span(store_path, season, game_folder_name, player_name)
+                               for player_name in players) if span is not None]
+    if not spans:
+        return None
+    return min(first for first, _ in spans), max(last for _, last in spans) + 1
+
+
+def build_game_tensor(store_path: str, season: str, game_folder_name: str, stadium=None,
+                      grid_hz: float = DEFAULT_GRID_HZ, time_begin_ns: int = None, time_end_ns: int = None):
+    """
+    Build and save the time aligned tensor of a game, every player session streamed once straight into the
+    memory-mapped file.
+
+    :param stadium: A stadium tuple (see stadium_projection.py), fills the "x" and "y" channels.
+    :param time_begin_ns, time_end_ns: The grid range, default is the span of the players playing windows
+                                       (the span of the sessions when the game has no windows index).
+    :return: (tensor, mask, meta) like load_game_tensor.
+    """
+    players = gps_store.list_players(store_path, season, game_folder_name)
+    if time_begin_ns is None or time_end_ns is None:
+        span = _game_time_span(store_path, season, game_folder_name, players)
+        if span is None:
+            raise ValueError(f"No samples found for game {game_folder_name}")
+        time_begin_ns = span[0] if time_begin_ns is None else time_begin_ns
+        time_end_ns = span[1] if time_end_ns is None else time_end_ns
+    step_ns = int(round(time_parsing.NS_PER_SECOND / grid_hz))
+    t0_ns = time_begin_ns - time_begin_ns % step_ns
+    n_steps = int(-(-(time_end_ns - t0_ns) // step_ns))
+    tensor_path, mask_path, meta_path = get_tensor_paths(store_path, season, game_folder_name, grid_hz)
+    tensor = np.lib.format.open_memmap(tensor_path + ".tmp", mode='w+', dtype=np.float64,
+                                       shape=(n_steps, len(players), len(TENSOR_CHANNELS)))
+    mask = np.lib.format.open_memmap(mask_path + ".tmp", mode='w+', dtype=bool, shape=(n_steps, len(players)))
+    tensor[:] = np.nan
+    mask[:] = False
+    source_channels = [TENSOR_CHANNELS.index(column) for column in SOURCE_COLUMNS]
+    x_channel, y_channel = TENSOR_CHANNELS.index("x"), TENSOR_CHANNELS.index("y")
+
+    for p, player_name in enumerate(players):
+        print(f"Processing player: {player_name}")
+        for chunk in gps_stream.iter_store_chunks(store_path, season, game_folder_name, player_name,
+                                                  SOURCE_COLUMNS, time_begin_ns, time_end_ns):
+            times_ns = chunk['Time'].to_numpy().astype('datetime64[ns]').view(np.int64)
+            values = chunk[SOURCE_COLUMNS].to_numpy(dtype=np.float64)
+            located = values[:, 0] != 0
+            slots = (times_ns[located] - t0_ns) // step_ns
+            values = values[located]
+            # first sample of every slot, slots already filled by the previous chunk are kept
+            first = np.r_[True, slots[1:] != slots[:-1]]
+            slots, values = slots[first], values[first]
+            new = ~mask[slots, p]
+            slots, values = slots[new], values[new]
+            tensor[slots[:, None], p, source_channels] = values
+            if stadium:
+                x, y = stadium_projection.project_around_pitch_center_arrays(values[:, 0], values[:, 1], stadium)
+                tensor[slots, p, x_channel] = x
+                tensor[slots, p, y_channel] = y
+            mask[slots, p] = True
+    tensor.flush()
+    mask.flush()
+    del tensor, mask
+    os.replace(tensor_path + ".tmp", tensor_path)
+    os.replace(mask_path + ".tmp", mask_path)
+    meta = {'players': players, 'channels': TENSOR_CHANNELS, 't0_ns': int(t0_ns), 'step_ns': step_ns,
+            'n_steps': n_steps, 'grid_hz': grid_hz, 'stadium': list(stadium) if stadium else None}
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=4)
+    return load_game_tensor(store_path, season, game_folder_name, grid_hz)
+
+
+def load_game_tensor(store_path: str, season: str, game_folder_name: str, grid_hz: float = DEFAULT_GRID_HZ, mode: str = 'r'):
+    """
+    The saved tensor of a game, memory-mapped.
+
+    :param mode: numpy.load mmap_mode, 'r' (read only) or 'c' (copy on write, edits are not saved).
+    :return: (tensor, mask, meta).
+    """
+    tensor_path, mask_path, meta_path = get_tensor_paths(store_path, season, game_folder_name, grid_hz)
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    return np.load(tensor_path, mmap_mode=mode), np.load(mask_path, mmap_mode=mode), meta
+
+
+def tensor_time_slice(meta: dict, time_begin_ns: int = None, time_end_ns: int = None):
+    """The grid slots slice of [time_begin_ns, time_end_ns), slicing the tensor with it makes no copy."""
+    first = 0 if time_begin_ns is None else -(-(time_begin_ns - meta['t0_ns']) // meta['step_ns'])
+    end = meta['n_steps'] if time_end_ns is None else -(-(time_end_ns - meta['t0_ns']) // meta['step_ns'])
+    return slice(int(np.clip(first, 0, meta['n_steps'])), int(np.clip(end, 0, meta['n_steps'])))
+
+
+def channel_index(meta: dict, channel: str):
+    return meta['channels'].index(channel)
+
+
+def player_index(meta: dict, player_name: str):
+    return meta['players'].index(player_name)
+
+
+def tensor_times_ns(meta: dict, time_slice: slice = slice(None)):
+    """Grid times (int64 epoch ns) of the slots of a time slice."""
+    return meta['t0_ns'] + np.arange(meta['n_steps'])[time_slice] * meta['step_ns']
+
+
+def team_centroid(tensor: np.ndarray, mask: np.ndarray, meta: dict, time_slice: slice = slice(None)):
+    """
+    (x, y) of the team centroid at every grid slot, the mean over the valid players (NaN when none is valid).
+
+    :return: Array of shape (slots, 2).
+    """
+    xy = tensor[time_slice, :, channel_index(meta, "x"):channel_index(meta, "y") + 1]
+    valid = mask[time_slice][:, :, None]
+    counts = valid.sum(axis=1)
+    with np.errstate(invalid='ignore'):
+        return np.where(valid, xy, 0.0).sum(axis=1) / counts
+
+
+def tensor_to_frame(tensor: np.ndarray, mask: np.ndarray, meta: dict, time_slice: slice = slice(None)):
+    """
+    Long format DataFrame of the valid slots, same columns as the concat_frames output
+    ('Time', the channels, 'Player', 'RoundedTime' and 'xyCoords' when projected), sorted by 'RoundedTime' and 'Player'.
+    """
+    times_ns = tensor_times_ns(meta, time_slice)
+    slots, players = np.nonzero(mask[time_slice])
+    values = tensor[time_slice][slots, players]
+    df = pd.DataFrame(values, columns=meta['channels'])
+    df.insert(0, 'Time', time_parsing.ns_to_datetime(times_ns[slots]))
+    df['Player'] = np.asarray(meta['players'], dtype=object)[players]
+    df['RoundedTime'] = df['Time']
+    if meta['stadium']:
+        df['xyCoords'] = list(zip(df['x'].tolist(), df['y'].tolist()))
+    return df.sort_values(by=['RoundedTime', 'Player'], kind='stable')
@@ -0,0 +1,249 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import numpy as np
+import playing_windows
+
+"""
+Columnar store for the cleaned GPS sessions.
+The cleaner writes every player session once as a typed Parquet file and every downstream module
+reads it back with column projection and predicate pushdown on 'Time', instead of re-parsing CSV text.
+The store is hive-partitioned by season, game and player:
+GPS_store
+|- season=Season 1
+|   |- game=Game 1 folder
+|   |   |- player=Player 1
+|   |   |   |- session.parquet
+|   |   |- player=Player 2
+|   |   |- ...
+|   |   |- playing_windows.json
+|   |- game=Game 2 folder
+|   |- ...
+|- season=Season 2
+|...
+
+Game folders keep the same names as the GPS game folders, players are the encoded names ("CB_3", "DM_16"...).
+Sessions are stored whole, the readers keep only the samples inside the players playing windows (see playing_windows.py)
+unless asked otherwise.
+"""
+
+SESSION_FILE_NAME = "session.parquet"
+ROW_GROUP_SIZE = 60_000  # ~10 minutes of 100Hz samples per row group, lets time filters skip whole groups
+
+
+def game_partition_path(store_path: str, season: str, game_folder_name: str):
+    return os.path.join(store_path, f"season={season}", f"game={game_folder_name}")
+
+
+def player_partition_path(store_path: str, season: str, game_folder_name: str, player_name: str):
+    return os.path.join(game_partition_path(store_path, season, game_folder_name), f"player={player_name}")
+
+
+def player_session_path(store_path: str, season: str, game_folder_name: str, player_name: str):
+    return os.path.join(player_partition_path(store_path, season, game_folder_name, player_name), SESSION_FILE_NAME)
+
+
+def has_player_session(store_path: str, season: str, game_folder_name: str, player_name: str):
+    return os.path.exists(player_session_path(store_path, season, game_folder_name, player_name))
+
+
+def list_seasons(store_path: str):
+    if not os.path.isdir(store_path):
+        return []
+    return sorted(d.split('=', 1)[1] for d in os.listdir(store_path) if d.startswith("season="))
+
+
+def list_games(store_path: str, season: str):
+    season_path = os.path.join(store_path, f"season={season}")
+    if not os.path.isdir(season_path):
+        return []
+    return sorted(d.split('=', 1)[1] for d in os.listdir(season_path) if d.startswith("game="))
+
+
+def list_players(store_path: str, season: str, game_folder_name: str):
+    game_path = game_partition_path(store_path, season, game_folder_name)
+    if not os.path.isdir(game_path):
+        return []
+    return sorted(d.split('=', 1)[1] for d in os.listdir(game_path) if d.startswith("player="))
+
+
+def write_player_session(player_df: pd.DataFrame, store_path: str, season: str, game_folder_name: str, player_name: str):
+    """
+    Write (or replace) a single player session in the store.
+
+    :param player_df: The player GPS samples, 'Time' must be a datetime column.
+    :return: The path of the written Parquet file.
+    """
+    output_path = player_session_path(store_path, season, game_folder_name, player_name)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    player_df = player_df.sort_values('Time', kind='stable')
+    table = pa.Table.from_pandas(player_df, preserve_index=False)
+    # Write to a temporary file first so an interrupted run never leaves a half written session behind
+    tmp_path = output_path + ".tmp"
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def write_player_session_chunks(chunks, store_path: str, season: str, game_folder_name: str, player_name: str):
+    """
+    Same as write_player_session from a stream of DataFrame chunks (see gps_stream.py), written one chunk at a time.
+    The chunks are expected in time order, an out of order session is sorted once after the write.
+
+    :return: The number of rows written.
+    """
+    output_path = player_session_path(store_path, season, game_folder_name, player_name)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    writer = None
+    rows = 0
+    in_order = True
+    last_time = None
+    try:
+        for chunk in chunks:
+            times = chunk['Time'].to_numpy().astype('datetime64[ns]').view(np.int64)
+            if len(times):
+                if (last_time is not None and times[0] < last_time) or (np.diff(times) < 0).any():
+                    in_order = False
+                last_time = times[-1]
+            # integer columns of a chunk may turn float in the next one (missing values), keep them float from the start
+            chunk = chunk.astype({c: 'float64' for c in chunk.columns if pd.api.types.is_integer_dtype(chunk[c])})
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table.cast(writer.schema), row_group_size=ROW_GROUP_SIZE)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        return 0
+    if not in_order:
+        pq.write_table(pq.read_table(tmp_path).sort_by('Time'), tmp_path, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, output_path)
+    return rows
+
+
+def delete_player_session(store_path: str, season: str, game_folder_name: str, player_name: str):
+    session_path = player_session_path(store_path, season, game_folder_name, player_name)
+    if os.path.exists(session_path):
+        os.remove(session_path)
+        os.rmdir(os.path.dirname(session_path))
+
+
+def _time_filter(time_begin=None, time_end=None, include_end: bool = False):
+    """Build a pushdown filter on 'Time', bounds are datetime like objects (inclusive begin)."""
+    expression = None
+    if time_begin is not None:
+        expression = ds.field('Time') >= pa.scalar(pd.Timestamp(time_begin).as_unit('ns'), type=pa.timestamp('ns'))
+    if time_end is not None:
+        end_scalar = pa.scalar(pd.Timestamp(time_end).as_unit('ns'), type=pa.timestamp('ns'))
+        end_expression = ds.field('Time') <= end_scalar if include_end else ds.field('Time') < end_scalar
+        expression = end_expression if expression is None else expression & end_expression
+    return expression
+
+
+def read_playing_windows(store_path: str, season: str, game_folder_name: str):
+    """{player_name: windows} of a game, None if the game has no playing windows index."""
+    index = playing_windows.read_index(game_partition_path(store_path, season, game_folder_name))
+    return None if index is None else index['players']
+
+
+def _windows_time_bounds(windows, time_begin, time_end):
+    """Narrow the pushdown time bounds to the span of the playing windows."""
+    if not windows:
+        return time_begin, time_end
+    first = pd.Timestamp(windows[0][0])
+    last = pd.Timestamp(windows[-1][1])
+    time_begin = first if time_begin is None else max(pd.Timestamp(time_begin), first)
+    time_end = last if time_end is None else min(pd.Timestamp(time_end), last)
+    return time_begin, time_end
+
+
+def read_player_session(store_path: str, season: str, game_folder_name: str, player_name: str,
+                        columns: list = None, time_begin=None, time_end=None, include_end: bool = False,
+                        only_playing: bool = True):
+    """
+    Read a single player session from the store.
+
+    :param columns: Columns to load, default is all the columns.
+    :param time_begin: Load only samples from this time onward (datetime like).
+    :param time_end: Load only samples before this time (datetime like), inclusive when include_end is set.
+    :param only_playing: Keep only the samples inside the player playing windows, when the game has an index.
+    :return: DataFrame sorted by 'Time'.
+    """
+    windows = None
+    if only_playing:
+        players_windows = read_playing_windows(store_path, season, game_folder_name)
+        if players_windows is not None:
+            windows = players_windows.get(player_name, [])
+            if windows:
+                time_begin, time_end = _windows_time_bounds(windows, time_begin, time_end)
+    load_columns = columns
+    if windows is not None and columns is not None and 'Time' not in columns:
+        load_columns = list(columns) + ['Time']
+    session_path = player_session_path(store_path, season, game_folder_name, player_name)
+    dataset = ds.dataset(session_path, format="parquet")
+    if windows is not None and not windows:
+        # the player didn't play
+        df = dataset.schema.empty_table().to_pandas()
+        return df if columns is None else df[columns]
+    table = dataset.to_table(columns=load_columns, filter=_time_filter(time_begin, time_end, include_end))
+    df = table.to_pandas()
+    if windows is not None:
+        df = playing_windows.select_windows(df, windows)
+        if load_columns is not columns:
+            df = df[columns]
+    return df
+
+
+def read_game_sessions(store_path: str, season: str, game_folder_name: str, columns: list = None,
+                       time_begin=None, time_end=None, include_end: bool = False, only_playing: bool = True):
+    """
+    Read all the players sessions of a game as one long DataFrame with an additional 'Player' column.
+    Same parameters as read_player_session.
+    """
+    game_path = game_partition_path(store_path, season, game_folder_name)
+    session_files = [player_session_path(store_path, season, game_folder_name, player_name)
+                     for player_name in list_players(store_path, season, game_folder_name)]
+    dataset = ds.dataset(session_files, format="parquet", partitioning="hive", partition_base_dir=game_path)
+    if columns is not None:
+        columns = [c if c != 'Player' else 'player' for c in columns]
+        if 'player' not in columns:
+            columns = columns + ['player']
+    players_windows = read_playing_windows(store_path, season, game_folder_name) if only_playing else None
+    load_columns = columns
+    if players_windows is not None and columns is not None and 'Time' not in columns:
+        load_columns = columns + ['Time']
+    table = dataset.to_table(columns=load_columns, filter=_time_filter(time_begin, time_end, include_end))
+    df = table.to_pandas().rename(columns={'player': 'Player'})
+    df['Player'] = df['Player'].astype(str)
+    if players_windows is not None:
+        df = df.sort_values(['Player', 'Time'], kind='stable')
+        times_ns = df['Time'].to_numpy().astype('datetime64[ns]').view(np.int64)
+        players = df['Player'].to_numpy()
+        mask = np.zeros(len(df), dtype=bool)
+        boundaries = np.flatnonzero(players[1:] != players[:-1]) + 1
+        for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(df)]):
+            windows = players_windows.get(players[start], [])
+            mask[start:end] = playing_windows.windows_mask(times_ns[start:end], windows)
+        df = df[mask]
+        if load_columns is not columns:
+            df = df.drop(columns=['Time'])
+    return df
+
+
+def iter_game_sessions(store_path: str, season: str, game_folder_name: str, columns: list = None,
+                       time_begin=None, time_end=None, include_end: bool = False, only_playing: bool = True):
+    """
+    Yield (player_name, DataFrame) for every player of a game, one player in memory at a time.
+    Players without playing windows are skipped when only_playing is set.
+    """
+    players_windows = read_playing_windows(store_path, season, game_folder_name) if only_playing else None
+    for player_name in list_players(store_path, season, game_folder_name):
+        if players_windows is not None and not players_windows.get(player_name):
+            continue
+        yield player_name, read_player_session(store_path, season, game_folder_name, player_name,
+                                               columns, time_begin, time_end, include_end, only_playing)
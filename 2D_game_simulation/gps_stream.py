@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import gps_store
+import playing_windows
+import time_parsing
+
+"""
+Bounded memory streaming readers for the players sessions.
+A session is read as a sequence of DataFrame chunks of at most chunk_rows rows ('Time' parsed as datetime64[ns]),
+chunks entirely outside the requested time range are skipped (whole Parquet row groups are not even read)
+and the reading stops once the range end is passed. Peak memory is bounded by the chunk size, not the file size.
+All readers assume the session samples are sorted by time, as exported by STATSports and kept by the store.
+"""
+
+DEFAULT_CHUNK_ROWS = 2 * gps_store.ROW_GROUP_SIZE  # ~20 minutes of 100Hz samples
+
+
+def _times_ns(chunk: pd.DataFrame):
+    return chunk['Time'].to_numpy().astype('datetime64[ns]').view(np.int64)
+
+
+def iter_csv_chunks(path: str, columns: list = None, time_begin_ns: int = None, time_end_ns: int = None,
+                    chunk_rows: int = DEFAULT_CHUNK_ROWS, nrows: int = None):
+    """
+    Stream a player csv file (raw or cleaned) in chunks, keeping the samples in [time_begin_ns, time_end_ns).
+
+    :param columns: Columns to load (list or pd.read_csv usecols callable), 'Time' is always loaded. Default is all the columns.
+    :param nrows: Read only the first nrows rows of the file.
+    """
+    if callable(columns):
+        usecols = columns
+        columns = lambda column: column == 'Time' or usecols(column)
+    elif columns is not None and 'Time' not in columns:
+        columns = ['Time'] + list(columns)
+    year, month, day = time_parsing.date_from_filename(path)
+    for chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_rows, nrows=nrows):
+        times = time_parsing.parse_session_times_ns(chunk['Time'], year, month, day)
+        if time_end_ns is not None and len(times) and times[0] >= time_end_ns:
+            return
+        keep = np.ones(len(times), dtype=bool)
+        if time_begin_ns is not None:
+            keep &= times >= time_begin_ns
+        if time_end_ns is not None:
+            keep &= times < time_end_ns
+        if keep.any():
+            yield chunk[keep].assign(Time=time_parsing.ns_to_datetime(times[keep]))
+
+
+def _overlapping_row_groups(parquet_file: pq.ParquetFile, time_begin_ns: int, time_end_ns: int):
+    """Row groups whose 'Time' statistics overlap [time_begin_ns, time_end_ns)."""
+    time_index = parquet_file.schema_arrow.get_field_index('Time')
+    row_groups = []
+    for i in range(parquet_file.metadata.num_row_groups):
+        statistics = parquet_file.metadata.row_group(i).column(time_index).statistics
+        if statistics is not None and statistics.has_min_max:
+            if time_begin_ns is not None and pd.Timestamp(statistics.max).as_unit('ns').value < time_begin_ns:
+                continue
+            if time_end_ns is not None and pd.Timestamp(statistics.min).as_unit('ns').value >= time_end_ns:
+                continue
+        row_groups.append(i)
+    return row_groups
+
+
+def iter_store_chunks(store_path: str, season: str, game_folder_name: str, player_name: str, columns: list = None,
+                      time_begin_ns: int = None, time_end_ns: int = None, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                      only_playing: bool = True):
+    """
+    Stream a player session of the GPS store in chunks, keeping the samples in [time_begin_ns, time_end_ns)
+    and, when only_playing is set, inside the player playing windows.
+
+    :param columns: Columns to load, 'Time' is always loaded. Default is all the columns.
+    """
+    windows = None
+    if only_playing:
+        players_windows = gps_store.read_playing_windows(store_path, season, game_folder_name)
+        if players_windows is not None:
+            windows = players_windows.get(player_name, [])
+            if not windows:
+                return
+            time_begin_ns = windows[0][0] if time_begin_ns is None else max(time_begin_ns, windows[0][0])
+            time_end_ns = windows[-1][1] if time_end_ns is None else min(time_end_ns, windows[-1][1])
+    if columns is not None and 'Time' not in columns:
+        columns = ['Time'] + list(columns)
+    parquet_file = pq.ParquetFile(gps_store.player_session_path(store_path, season, game_folder_name, player_name))
+    row_groups = _overlapping_row_groups(parquet_file, time_begin_ns, time_end_ns)
+    if not row_groups:
+        return
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, row_groups=row_groups, columns=columns):
+        chunk = batch.to_pandas()
+        times = _times_ns(chunk)
+        if time_end_ns is not None and len(times) and times[0] >= time_end_ns:
+            return
+        keep = np.ones(len(times), dtype=bool) if windows is None else playing_windows.windows_mask(times, windows)
+        if time_begin_ns is not None:
+            keep &= times >= time_begin_ns
+        if time_end_ns is not None:
+            keep &= times < time_end_ns
+        if keep.all():
+            yield chunk
+        elif keep.any():
+            yield chunk[keep]
+
+
+def iter_interval_frames(chunks, starts_ns: np.ndarray, ends_ns: np.ndarray, columns: list = None):
+    """
+    Regroup a time sorted chunks stream into one DataFrame per interval [starts_ns[k], ends_ns[k]).
+    Intervals must be sorted and not overlapping, every interval is yielded (empty if it has no samples)
+    as soon as it is complete, so only one interval of samples is buffered at a time.
+
+    :param columns: Columns of the empty frames yielded when the stream has no chunks at all ('Time' and float columns).
+    :return: Generator of (interval index, DataFrame).
+    """
+    n_intervals = len(starts_ns)
+    k = 0
+    pending = []
+    empty = pd.DataFrame({c: pd.Series(dtype='datetime64[ns]' if c == 'Time' else 'float64') for c in (columns or ['Time'])})
+    for chunk in chunks:
+        empty = chunk.iloc[0:0]
+        times = _times_ns(chunk)
+        while k < n_intervals:
+            low = np.searchsorted(times, starts_ns[k], side='left')
+            high = np.searchsorted(times, ends_ns[k], side='left')
+            if high > low:
+                pending.append(chunk.iloc[low:high])
+            if high == len(times):
+                # the interval may continue in the next chunk
+                break
+            yield k, pd.concat(pending) if len(pending) > 1 else (pending[0] if pending else empty)
+            pending = []
+            k += 1
+        if k == n_intervals:
+            return
+    while k < n_intervals:
+        yield k, pd.concat(pending) if len(pending) > 1 else (pending[0] if pending else empty)
+        pending = []
+        k += 1
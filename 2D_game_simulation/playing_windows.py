@@ -0,0 +1,101 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+"""
+Playing windows index.
+Instead of deleting and truncating the GPS sessions, the cleaner stores the sessions untouched and writes beside
+them a tiny per game index holding, for every player, the time windows the player was actually on the pitch
+(sub in/out, half time gap, red card). Readers apply it on the sorted 'Time' column with a binary search,
+so a window is a plain row range of the session. Changing a cleaning rule only rebuilds the index.
+Windows are half-open [start, end) int64 epoch nanoseconds, a player who didn't play has no windows.
+Index file (JSON) inside the game folder of the store:
+{
+    "fingerprint": inputs fingerprint of the index (lineup, subs, metadata row),
+    "players": {player_name: [[start, end], ...]}
+}
+"""
+
+INDEX_FILE_NAME = "playing_windows.json"
+
+
+def merge_windows(windows):
+    """Sort and merge overlapping / touching windows, empty windows are dropped."""
+    merged = []
+    for start, end in sorted((int(s), int(e)) for s, e in windows if s < e):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def plan_windows(plan: dict):
+    """
+    Turn a player cleaning plan (see data_clean.plan_player) into playing windows.
+    Inclusive plan bounds become half-open by adding one nanosecond.
+    """
+    start = plan['window_start']
+    end = plan['window_end'] + (1 if plan['window_end_inclusive'] else 0)
+    if plan['red_card_cutoff'] is not None:
+        end = min(end, plan['red_card_cutoff'])
+    # half time gap - keep up to the first half end (inclusive) and from the second half start
+    first_half = (start, min(end, plan['first_half_end'] + 1))
+    second_half = (max(start, plan['second_half_start']), end)
+    return merge_windows([first_half, second_half])
+
+
+def windows_row_ranges(times_ns: np.ndarray, windows):
+    """
+    Row ranges [(first row, end row), ...] of the windows in a session sorted by time, found with binary search.
+    """
+    if len(windows) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    bounds = np.asarray(windows, dtype=np.int64)
+    starts = np.searchsorted(times_ns, bounds[:, 0], side='left')
+    ends = np.searchsorted(times_ns, bounds[:, 1], side='left')
+    return np.stack([starts, ends], axis=1)
+
+
+def windows_mask(times_ns: np.ndarray, windows):
+    """Boolean mask of the samples inside the windows, times must be sorted."""
+    mask = np.zeros(len(times_ns), dtype=bool)
+    for start, end in windows_row_ranges(times_ns, windows):
+        mask[start:end] = True
+    return mask
+
+
+def select_windows(df: pd.DataFrame, windows, time_column: str = 'Time'):
+    """
+    Rows of a time sorted session inside the windows. A single window is returned as a slice of df (no copy).
+    """
+    times_ns = df[time_column].to_numpy().astype('datetime64[ns]').view(np.int64)
+    ranges = [(start, end) for start, end in windows_row_ranges(times_ns, windows) if end > start]
+    if len(ranges) == 1:
+        return df.iloc[ranges[0][0]:ranges[0][1]]
+    if not ranges:
+        return df.iloc[0:0]
+    return pd.concat([df.iloc[start:end] for start, end in ranges])
+
+
+def index_path(game_path: str):
+    return os.path.join(game_path, INDEX_FILE_NAME)
+
+
+def read_index(game_path: str):
+    """The playing windows index of a game folder, None if the game has no index."""
+    path = index_path(game_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_index(game_path: str, players_windows: dict, fingerprint: str = None):
+    os.makedirs(game_path, exist_ok=True)
+    path = index_path(game_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'players': players_windows}, f, indent=4)
+    os.replace(tmp_path, path)
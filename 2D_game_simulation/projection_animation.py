@@ -15,6 +15,10 @@ def parse_coords(coord_str):
     return None, None
 
 def load_data(file_path):
+    if file_path.endswith('.parquet'):
+        df = pd.read_parquet(file_path)
+        df['x'], df['y'] = zip(*df['xyCoords'])
+        return df
     df = pd.read_csv(file_path)
     df['x'], df['y'] = zip(*df['xyCoords'].apply(parse_coords))
     return df
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 Teddy_stadium = (31.75123,35.19078,12)
 Sammy_Ofer_stadium_before_Nov = (32.783085,34.965336,0) 
@@ -66,3 +67,26 @@ def project_around_pitch_center(playerLat,playerLong,stadium):
     return x, y
 
 
+
+
+def project_around_pitch_center_arrays(playerLat, playerLong, stadium):
+    """
+    project_around_pitch_center over whole arrays of coordinates at once, same results sample for sample
+    (the rotated y is computed from the already rotated x, like there).
+
+    :return: (x, y) arrays.
+    """
+    lat0, lon0 = stadium[0:2]
+    R = 6371000  # Radius of Earth in meters
+    lat_rad = np.radians(np.asarray(playerLat, dtype=np.float64))
+    lon_rad = np.radians(np.asarray(playerLong, dtype=np.float64))
+    lat0_rad = math.radians(lat0)
+    lon0_rad = math.radians(lon0)
+
+    x = R * (lon_rad - lon0_rad) * np.cos((lat_rad + lat0_rad) / 2)
+    y = R * (lat_rad - lat0_rad)
+    if stadium[2] != 0:
+        rad = math.radians(stadium[2])
+        x = x * math.cos(rad) - y * math.sin(rad)
+        y = y * math.cos(rad) + x * math.sin(rad)
+    return x, y
@@ -0,0 +1,81 @@
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+"""
+Vectorized time parsing shared by the GPS ingest paths (data_clean, concat_frames...).
+Times are kept as int64 nanoseconds since the epoch and only turned into datetime64 values (zero-copy view)
+when a DataFrame is handed over to pandas code or written to disk.
+The raw STATSports files hold only the time of day ("HH:MM:SS.f"), the date is rebased from the file name.
+"""
+
+NS_PER_SECOND = 1_000_000_000
+NS_PER_DAY = 86_400 * NS_PER_SECOND
+
+
+def date_from_filename(path: str):
+    """Return (year, month, day) of a GPS game folder or player file, name pattern "year-month-day-...". """
+    year, month, day = os.path.basename(path).split('-')[:3]
+    return int(year), int(month), int(day)
+
+
+def date_epoch_ns(year: int, month: int, day: int):
+    """Nanoseconds since the epoch of the given date midnight."""
+    return int(np.datetime64(f"{year:04d}-{month:02d}-{day:02d}", 'ns').astype(np.int64))
+
+
+def clock_to_ns(clock: str, year: int, month: int, day: int):
+    """Convert a "HH:MM:SS" clock string (metadata times, sub times...) of the given date into epoch nanoseconds."""
+    hour, minute, second = map(int, clock.split(':'))
+    return date_epoch_ns(year, month, day) + ((hour * 60 + minute) * 60 + second) * NS_PER_SECOND
+
+
+def parse_clock_ns(times: pd.Series):
+    """
+    Parse "HH:MM:SS[.f]" strings (any number of fraction digits) into int64 nanoseconds since midnight.
+    The strings are parsed as a fixed width byte matrix, falling back to pd.to_timedelta for any other layout.
+    """
+    values = times.to_numpy(dtype=str)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    raw = values.astype(np.bytes_)
+    width = raw.dtype.itemsize
+    chars = np.frombuffer(raw.tobytes(), dtype=np.uint8).reshape(len(raw), width)
+    if width < 8 or not ((chars[:, 2] == ord(':')) & (chars[:, 5] == ord(':'))).all():
+        return pd.to_timedelta(times).to_numpy().astype('timedelta64[ns]').astype(np.int64)
+    digits = chars.astype(np.int64) - ord('0')
+    seconds = (digits[:, 0] * 10 + digits[:, 1]) * 3600 + (digits[:, 3] * 10 + digits[:, 4]) * 60 + digits[:, 6] * 10 + digits[:, 7]
+    fraction = np.zeros(len(raw), dtype=np.int64)
+    # fraction digits start after the '.', shorter strings are zero byte padded
+    for position in range(9, min(width, 18)):
+        present = chars[:, position] != 0
+        fraction += np.where(present, digits[:, position], 0) * 10 ** (17 - position)
+    return seconds * NS_PER_SECOND + fraction
+
+
+def parse_session_times_ns(times: pd.Series, year: int, month: int, day: int):
+    """
+    Parse a GPS 'Time' column into int64 epoch nanoseconds rebased on the given date.
+    Accepts the raw "HH:MM:SS.f" format, the full "YYYY-MM-DD HH:MM:SS.f" format and datetime columns.
+    A written date is replaced by the given one (same as datetime.replace(year=, month=, day=)).
+    """
+    if pd.api.types.is_datetime64_any_dtype(times):
+        times_ns = times.to_numpy().astype('datetime64[ns]').astype(np.int64)
+        return times_ns % NS_PER_DAY + date_epoch_ns(year, month, day)
+    times = times.astype(str)
+    if len(times) and ' ' in times.iloc[0]:
+        times = times.str.slice(times.iloc[0].index(' ') + 1)
+    return parse_clock_ns(times) + date_epoch_ns(year, month, day)
+
+
+def ns_to_datetime(times_ns: np.ndarray):
+    """Zero-copy view of int64 epoch nanoseconds as datetime64[ns]."""
+    return np.asarray(times_ns, dtype=np.int64).view('datetime64[ns]')
+
+
+def datetime_to_ns(times):
+    """int64 epoch nanoseconds of a datetime like scalar, or of a datetime like Series / array."""
+    if isinstance(times, (str, datetime, np.datetime64)):
+        return int(pd.Timestamp(times).as_unit('ns').value)
+    return np.asarray(times, dtype='datetime64[ns]').astype(np.int64)
@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+"""
+Content-hash incremental builds.
+Every build target (a cleaned game, a game features csv...) is recorded with the fingerprint of all its inputs,
+a target is rebuilt only when the fingerprint of its inputs changed or its outputs are missing.
+File digests are SHA-256 of the content, cached by (size, mtime) so unchanged files are not re-read on every run.
+The state is a single JSON file:
+{
+    "file_digests": {path: {"size": ..., "mtime_ns": ..., "sha256": ...}},
+    "targets": {target: fingerprint}
+}
+"""
+
+DIGEST_CHUNK_SIZE = 1 << 20
+
+
+def load_build_state(state_path: str):
+    if not os.path.exists(state_path):
+        return {'file_digests': {}, 'targets': {}}
+    with open(state_path, 'r') as f:
+        return json.load(f)
+
+
+def save_build_state(state: dict, state_path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_path, state_path)
+
+
+def file_digest(path: str, digests_cache: dict = None):
+    """
+    SHA-256 of a file content. When digests_cache (the state "file_digests") is given, a file whose size and
+    mtime didn't change since it was last hashed is not read again, and new digests are added to the cache.
+    """
+    stat = os.stat(path)
+    cached = None if digests_cache is None else digests_cache.get(path)
+    if cached is not None and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        return cached['sha256']
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DIGEST_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    if digests_cache is not None:
+        digests_cache[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    return digest
+
+
+def metadata_row_digest(game_metadata):
+    """Digest of a game metadata row (a one row DataFrame, a Series or a dict)."""
+    if isinstance(game_metadata, pd.DataFrame):
+        game_metadata = game_metadata.iloc[0] if not game_metadata.empty else {}
+    if isinstance(game_metadata, pd.Series):
+        game_metadata = game_metadata.to_dict()
+    row = {str(k): (None if pd.isna(v) else str(v)) for k, v in game_metadata.items()}
+    return hashlib.sha256(json.dumps(row, sort_keys=True).encode()).hexdigest()
+
+
+def fingerprint(files: list = (), values: dict = None, digests_cache: dict = None):
+    """
+    Combine the digests of input files (missing files count as such) and of plain values into one fingerprint.
+    Files are keyed by base name so moving the data folder doesn't invalidate the targets.
+    """
+    sha = hashlib.sha256()
+    for path in sorted(files, key=os.path.basename):
+        digest = file_digest(path, digests_cache) if os.path.exists(path) else 'missing'
+        sha.update(f"{os.path.basename(path)}={digest}\n".encode())
+    for key, value in sorted((values or {}).items()):
+        sha.update(f"{key}={value}\n".encode())
+    return sha.hexdigest()
+
+
+def is_up_to_date(state: dict, target: str, target_fingerprint: str, outputs: list = ()):
+    return state['targets'].get(target) == target_fingerprint and all(os.path.exists(output) for output in outputs)
+
+
+def record_build(state: dict, target: str, target_fingerprint: str):
+    state['targets'][target] = target_fingerprint
@@ -1,20 +1,94 @@
 from feature_extraction_from_clean_games_csv import *
+from concurrent.futures import ThreadPoolExecutor
+import feature_datasets
 import os
 import glob
 
 
 base_dir_path = r"data\GPS" # Change this to your base GPS directory path
-all_feature_csvs = []
 metadata_file_path = r"metadata.csv" # Path to your metadata CSV file
 
 
 # Recursively search for CSV files starting with 'features'
 def get_all_feature_csvs(base_dir_path):
+    all_feature_csvs = []
     for root, dirs, files in os.walk(base_dir_path):
         for file in files:
             if file.startswith("features") and file.endswith(".csv"):
                 all_feature_csvs.append(os.path.join(root, file))
+    return all_feature_csvs
 
+def _read_features_csv(file):
+    """A game features csv with its game folder name."""
+    df = pd.read_csv(file)
+    return os.path.basename(file)[len("features_"):-len(".csv")], df
+
+def _round_dataset(df):
+    numeric_cols = df.select_dtypes(include=['float64', 'float32']).columns
+    for col in numeric_cols:
+        if col == 'TotalxG':
+            df[col] = df[col].round(3)
+        else:
+            df[col] = df[col].round(4)
+    return df
+
+def create_datasets(base_dir_path: str, metadata_file_path: str, output_dir: str = None, n_workers: int = None,
+                    features_store_path: str = None, summation_interval: int = 5):
+    """
+    Build the intervals, halves and full games datasets of all the games features csv files in one run.
+    The files are read in parallel and concatenated once, the halves are a single grouped sum over all the
+    intervals (an interval starting before the first half end belongs to the first half) and the full games
+    a grouped sum of the halves. Nothing is kept between calls.
+
+    :param output_dir: Where to write "full_features_dataset.csv", "halves_features_dataset.csv" and
+                       "full_games_features_dataset.csv", default is base_dir_path.
+    :param n_workers: Number of threads reading the files, default is the ThreadPoolExecutor default.
+    :param features_store_path: Also write the datasets into this features store (see feature_datasets.py).
+    :param summation_interval: The interval length (minutes) of the features csv files, names the store partition.
+    :return: (intervals_df, halves_df, full_games_df), all None when no features csv was found.
+    """
+    output_dir = base_dir_path if output_dir is None else output_dir
+    all_feature_csvs = get_all_feature_csvs(base_dir_path)
+    if not all_feature_csvs:
+        print("No CSV files starting with 'features' were found.")
+        return None, None, None
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        games_dfs = list(executor.map(_read_features_csv, all_feature_csvs))
+    games = [game for game, _ in games_dfs]
+    intervals_df = pd.concat([df for _, df in games_dfs], ignore_index=True)
+    rows_game = np.repeat(games, [len(df) for _, df in games_dfs])
+
+    # the metadata is parsed once (see metadata_registry.py), every game is looked up once
+    half_times = {game: metadata_registry.get_half_times(metadata_file_path, game) for game in games}
+    first_half_end_ns = {game: metadata_registry.get_half_times_ns(metadata_file_path, game)[1] for game in games}
+    interval_start_ns = pd.to_datetime(intervals_df['interval_start']).to_numpy().astype('datetime64[ns]').view(np.int64)
+    half = np.where(interval_start_ns < pd.Series(rows_game).map(first_half_end_ns).to_numpy(), 1, 2)
+
+    feature_columns = list(intervals_df.columns[1:])
+    halves_df = intervals_df[feature_columns].groupby([rows_game, half], sort=False).sum(min_count=1)
+    # a half without intervals still gets its (zero) row
+    halves_df = halves_df.reindex(pd.MultiIndex.from_product([games, [1, 2]]), fill_value=0)
+    full_games_df = halves_df.groupby(level=0, sort=False).sum(min_count=1)
+
+    game_dates = {game: "{}-{:02d}-{:02d}".format(*time_parsing.date_from_filename(game)) for game in games}
+    halves_df = halves_df.reset_index(drop=True)
+    halves_df.insert(0, 'interval_start', [game_dates[game] + " " + str(half_times[game][0 if game_half == 1 else 2])
+                                           for game in games for game_half in (1, 2)])
+    halves_df.insert(1, 'half', np.tile([1, 2], len(games)))
+    full_games_df = full_games_df.reset_index(drop=True)
+    full_games_df.insert(0, 'game_date', [game_dates[game] + " " + str(half_times[game][0]) for game in games])
+
+    os.makedirs(output_dir, exist_ok=True)
+    intervals_df.to_csv(os.path.join(output_dir, "full_features_dataset.csv"), index=False)
+    _round_dataset(halves_df).to_csv(os.path.join(output_dir, "halves_features_dataset.csv"), index=False)
+    _round_dataset(full_games_df).to_csv(os.path.join(output_dir, "full_games_features_dataset.csv"), index=False)
+    if features_store_path is not None:
+        feature_datasets.write_features_dataset(intervals_df.assign(half=half), features_store_path, summation_interval)
+        feature_datasets.write_features_dataset(halves_df, features_store_path, "half")
+        feature_datasets.write_features_dataset(full_games_df, features_store_path, "game")
+    return intervals_df, halves_df, full_games_df
+
+# Deprecated functions, create_datasets builds all the datasets in one run. Kept for reference
 # Concatenate all CSVs along the row axis
 def concatenate_csv_files(csv_file_paths):
     if csv_file_paths:
@@ -28,7 +102,7 @@ def concatenate_csv_files(csv_file_paths):
         print("No CSV files starting with 'features' were found.")
 
 def create_half_time_dataset():
-    get_all_feature_csvs(base_dir_path)
+    all_feature_csvs = get_all_feature_csvs(base_dir_path)
     halves_df = None
     full_games_df = None
     for file in all_feature_csvs:
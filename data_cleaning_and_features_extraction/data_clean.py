@@ -2,6 +2,14 @@ import os
 import pandas as pd
 from datetime import datetime, timedelta
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import gps_store
+import gps_stream
+import time_parsing
+import build_state
+import metadata_registry
+import playing_windows
 
 """
 Use this module in order to pass raw data into a cleaner pipeline.
@@ -32,6 +40,8 @@ Data
 |   |- ...
 |- Metadata.csv
 
+Raw sessions are written once into the columnar GPS store (see gps_store.py) and the raw csv files are never modified,
+the cleaning itself is a per game playing windows index the store readers apply (see playing_windows.py).
 
 In addition, the module assumes GPS data folders holds the same name as the OPTA file for that match.
 Lineups and Subs files hold the same name with the addition of "-lineup" | "-subtitutes" at the end of the file name.
@@ -45,10 +55,10 @@ metadata_path = r"C:\Users\idota\AIproject\data\games_metadata.csv"
 base_OPTA_folder_path = r"C:\Users\idota\AIproject\data\OPTA"
 base_lineups_and_subs_folder_path = r"C:\Users\idota\AIproject\data\linups&subs"
 base_GPS_folder_path = r"C:\Users\idota\AIproject\data\GPS"
+base_GPS_store_path = r"C:\Users\idota\AIproject\data\GPS_store"
 
-metadata_df = pd.read_csv(metadata_path)
-game_metadata = None
-subs_df = None
+# Raw STATSports columns which are not used anywhere down the pipeline
+DROPPED_COLUMNS = ["Heart Rate (bpm)", "Hacc", "Hdop", "Quality of Signal", "No. of Satellites"]
 
 def minute_to_time(minute, first_half_start, second_half_start):
     if minute > 45:
@@ -59,178 +69,246 @@ def minute_to_time(minute, first_half_start, second_half_start):
         time = datetime.strptime(first_half_start, "%H:%M:%S") + timedelta(minutes=minute)
         return time.strftime("%H:%M:%S")
     
-def clean_player_file(player_data: str , lineup: list):
-    player_name = player_data.split("-")[-3]
-    day = int(player_data.split("-")[-4])
-    month = int(player_data.split("-")[-5])
-    year = int(player_data.split('\\')[-1].split('-')[0])
+def plan_player(player_name: str, date: tuple, lineup: list, subs_df: pd.DataFrame, game_metadata: pd.DataFrame):
+    """
+    Build the cleaning plan of a single player.
+    The plan holds the cleaning rules: the playing window (sub in/out), the half time cut and the red card cutoff.
+    All times are int64 epoch nanoseconds.
 
-    player_df = pd.read_csv(player_data)
-    if str(year) in player_df['Time'].values[0]:
-        print(f"File {player_data} already cleaned. Skipping...")
-        return
-    player_df['Time'] = player_df['Time'].apply(lambda t: datetime.strptime(t, "%H:%M:%S.%f").replace(year=year, month=month, day=day))
+    :param date: The game (year, month, day).
+    :return: None if the player didn't play, otherwise the plan dict.
+    """
+    year, month, day = date
+    first_half_start = game_metadata['start_csv_time'].values[0]
+    second_half_start = game_metadata['second_half_start_csv_time'].values[0]
+    second_half_finish = game_metadata['second_half_finish_csv_time'].values[0]
 
     starter = True if player_name in lineup else False 
     if not starter:
         if player_name not in subs_df['In Player'].unique():
             # player didn't play
-            os.remove(player_data)
-            return
-        else:
-            # player subbed in
-            sub_in_minute = int(subs_df.loc[subs_df['In Player'] == player_name, 'Minute'].values[0])
-            sub_out_minute = None
-            if player_name in subs_df['Out Player'].unique():
-                sub_out_minute = int(subs_df.loc[subs_df['Out Player'] == player_name, 'Minute'].values[0])
-            sub_in_time = minute_to_time(sub_in_minute,game_metadata['start_csv_time'].values[0],game_metadata['second_half_start_csv_time'].values[0])
-            start_hour, start_minute, start_second = map(int, sub_in_time.split(':'))
-            sub_out_time = game_metadata['second_half_finish_csv_time'].values[0]
-            end_hour, end_minute, end_second = map(int, sub_out_time.split(':'))
-            if sub_out_minute != None:
-                sub_out_time = minute_to_time(sub_out_minute,game_metadata['start_csv_time'].values[0],game_metadata['second_half_start_csv_time'].values[0])
-                end_hour, end_minute, end_second = map(int, sub_out_time.split(':'))
-            
-            player_df = player_df[(player_df['Time'] >= datetime(year,month,day, int(start_hour),int(start_minute),int(start_second)))]
-            player_df = player_df[(player_df['Time'] <= datetime(year,month,day, int(end_hour),int(end_minute),int(end_second)))]
-    else:
+            return None
+        # player subbed in
+        sub_in_minute = int(subs_df.loc[subs_df['In Player'] == player_name, 'Minute'].values[0])
+        window_start = minute_to_time(sub_in_minute, first_half_start, second_half_start)
+        window_end, window_end_inclusive = second_half_finish, True
         if player_name in subs_df['Out Player'].unique():
-            # player subbed out
             sub_out_minute = int(subs_df.loc[subs_df['Out Player'] == player_name, 'Minute'].values[0])
-            sub_out_time = minute_to_time(sub_out_minute,game_metadata['start_csv_time'].values[0],game_metadata['second_half_start_csv_time'].values[0])
-            start_hour, start_minute, start_second = map(int, game_metadata['start_csv_time'].values[0].split(':'))
-            end_hour, end_minute, end_second = map(int, sub_out_time.split(':'))
-            
-            player_df = player_df[ 
-            (player_df['Time'] >= datetime(year,month,day, int(start_hour),int(start_minute),int(start_second))) &
-            (player_df['Time'] < datetime(year,month,day, int(end_hour), int(end_minute), int(end_second))) 
-            ]
-        else:
-            # played all game
-            start_hour, start_minute, start_second = map(int, game_metadata['start_csv_time'].values[0].split(':'))
-            end_hour, end_minute, end_second = map(int, game_metadata['second_half_finish_csv_time'].values[0].split(':'))
-            player_df = player_df[ 
-            (player_df['Time'] >= datetime(year,month,day, int(start_hour),int(start_minute),int(start_second))) &
-            (player_df['Time'] <= datetime(year,month,day, int(end_hour), int(end_minute), int(end_second))) 
-            ]
-    
-    # clean half time
-    first_half_end_hour, first_half_end_minute, first_half_end_second = map(int, game_metadata['first_half_finish_csv_time'].values[0].split(':'))
-    second_half_start_hour, second_half_start_minute, second_half_start_second = map(int, game_metadata['second_half_start_csv_time'].values[0].split(':'))
-    player_df = player_df[ 
-        (player_df['Time'] >= datetime(year,month,day, int(second_half_start_hour),int(second_half_start_minute),int(second_half_start_second))) |
-        (player_df['Time'] <= datetime(year,month,day, int(first_half_end_hour), int(first_half_end_minute), int(first_half_end_second))) 
-    ]
-    player_df.to_csv(player_data, index=False)
+            window_end = minute_to_time(sub_out_minute, first_half_start, second_half_start)
+    elif player_name in subs_df['Out Player'].unique():
+        # player subbed out
+        sub_out_minute = int(subs_df.loc[subs_df['Out Player'] == player_name, 'Minute'].values[0])
+        window_start = first_half_start
+        window_end, window_end_inclusive = minute_to_time(sub_out_minute, first_half_start, second_half_start), False
+    else:
+        # played all game
+        window_start = first_half_start
+        window_end, window_end_inclusive = second_half_finish, True
 
-def clean_game_folder(game_folder_path: str, season: str):
-    lineup_path = os.path.join(base_lineups_and_subs_folder_path, season)
-    subs_path = os.path.join(base_lineups_and_subs_folder_path, season)
+    red_card_cutoff = None
+    red_cards = game_metadata['red cards'].values[0]
+    if not pd.isna(red_cards):
+        red_card_player, red_card_time = red_cards.split('|')
+        if red_card_player == player_name:
+            red_card_cutoff = time_parsing.clock_to_ns(red_card_time, year, month, day)
+
+    return {
+        'player_name': player_name,
+        'date': (year, month, day),
+        'window_start': time_parsing.clock_to_ns(window_start, year, month, day),
+        'window_end': time_parsing.clock_to_ns(window_end, year, month, day),
+        'window_end_inclusive': window_end_inclusive,
+        'first_half_end': time_parsing.clock_to_ns(game_metadata['first_half_finish_csv_time'].values[0], year, month, day),
+        'second_half_start': time_parsing.clock_to_ns(second_half_start, year, month, day),
+        'red_card_cutoff': red_card_cutoff,
+    }
+
+def ingest_player_file(player_data: str, season: str, store_path: str = None):
+    """
+    Convert a raw player file into a typed session in the GPS store with a single streamed read of the kept columns,
+    one chunk in memory at a time. All the samples are kept, the raw file is not touched.
+
+    :return: The number of rows ingested.
+    """
+    store_path = base_GPS_store_path if store_path is None else store_path
+    player_name = player_data.split("-")[-3]
+    game_folder_name = os.path.basename(os.path.dirname(player_data))
+    chunks = gps_stream.iter_csv_chunks(player_data, columns=lambda column: column not in DROPPED_COLUMNS)
+    return gps_store.write_player_session_chunks(chunks, store_path, season, game_folder_name, player_name)
+
+def build_game_windows(player_names: list, date: tuple, lineup: list, subs_df: pd.DataFrame, game_metadata: pd.DataFrame):
+    """{player_name: playing windows} of a game, players who didn't play get no windows."""
+    players_windows = {}
+    for player_name in player_names:
+        plan = plan_player(player_name, date, lineup, subs_df, game_metadata)
+        players_windows[player_name] = [] if plan is None else playing_windows.plan_windows(plan)
+    return players_windows
+
+def get_game_metadata(game_folder_name: str):
+    year, month, day = time_parsing.date_from_filename(game_folder_name)
+    return metadata_registry.get_game_frame(metadata_path, date=f"{year}-{month:02d}-{day:02d}")
+
+def game_ingest_fingerprint(game_folder_path: str, digests_cache: dict = None):
+    """Fingerprint of the raw GPS files of a game."""
+    raw_files = [os.path.join(game_folder_path, f) for f in os.listdir(game_folder_path) if f.endswith("-Entire-Session.csv")]
+    return build_state.fingerprint(raw_files, {'dropped_columns': ','.join(DROPPED_COLUMNS)}, digests_cache)
+
+def game_windows_fingerprint(lineup_file: str, subs_file: str, game_metadata: pd.DataFrame, digests_cache: dict = None):
+    """Fingerprint of everything the playing windows of a game depend on: lineup, subs and the metadata row."""
+    return build_state.fingerprint([lineup_file, subs_file],
+                                   {'metadata': build_state.metadata_row_digest(game_metadata)},
+                                   digests_cache)
+
+def clean_game(game_folder_path: str, season: str, game_metadata: pd.DataFrame, lineups_and_subs_folder_path: str,
+               store_path: str, previous_fingerprints: dict = None, digests_cache: dict = None):
+    """
+    Clean a single game in two independent steps. All the game state is passed explicitly so games can run
+    in separate processes.
+    1. Ingest - the raw players files are converted into whole typed sessions in the GPS store.
+       Done again only when the raw files changed.
+    2. Playing windows - the cleaning rules (sub in/out, half time, red card) are written as the game playing
+       windows index. Done again when the lineup, subs or metadata row changed, which costs no GPS rewrite.
+
+    :param previous_fingerprints: {'ingest': ..., 'windows': ...} of the last successful clean of the game.
+    :param digests_cache: File digests cache (see build_state.file_digest), updated in place.
+    :return: The game manifest entry - status, players and rows counts, timing and the inputs fingerprints.
+    """
+    started = time.perf_counter()
+    previous_fingerprints = {} if previous_fingerprints is None else previous_fingerprints
+    digests_cache = {} if digests_cache is None else digests_cache
     game_folder_name = os.path.basename(game_folder_path)
-    lineup_file = os.path.join(lineup_path, f"{game_folder_name}-lineup.json")
-    subs_file = os.path.join(subs_path, f"{game_folder_name}-substitutes.csv")
+    entry = {'game': game_folder_name, 'season': season, 'status': 'ok', 'ingest': None, 'windows': None,
+             'players_ingested': 0, 'players_played': 0, 'players_not_played': 0, 'rows_read': 0, 'rows_kept': 0,
+             'seconds': 0.0, 'error': None, 'fingerprints': {}}
+    lineup_file = os.path.join(lineups_and_subs_folder_path, season, f"{game_folder_name}-lineup.json")
+    subs_file = os.path.join(lineups_and_subs_folder_path, season, f"{game_folder_name}-substitutes.csv")
     if not os.path.exists(lineup_file) or not os.path.exists(subs_file):
         print(f"Lineup or subs file missing for game {game_folder_name}. Skipping...")
-        return
-    with open(lineup_file, 'r') as f:
-        lineup = json.load(f)
-    day = int(game_folder_path.split('\\')[-1].split('-')[2])
-    month = int(game_folder_path.split('\\')[-1].split('-')[1])
-    year = int(game_folder_path.split('\\')[-1].split('-')[0])
-    date_string = f"{year}-{month:02d}-{day:02d}-"
-    global subs_df
-    subs_df = pd.read_csv(subs_file)
-    global game_metadata
-    game_metadata = metadata_df[metadata_df['game_folder_name'].str.contains(date_string)]
-    for player_file in os.listdir(game_folder_path):
-        if player_file.endswith("-Entire-Session.csv"):
-            player_file_path = os.path.join(game_folder_path, player_file)
-            clean_player_file(player_file_path, lineup)
-
-def drop_irelevant_columns():
-    for dirpath, dirnames, filenames in os.walk(base_GPS_folder_path):
-        for filename in filenames:
-            if filename.endswith("-Entire-Session.csv"):
-                file_path = os.path.join(dirpath, filename)
-                df = pd.read_csv(file_path)
-                if "Heart Rate (bpm)" in df.columns:
-                    df = df.drop(columns=["Heart Rate (bpm)"])
-                if "Hacc" in df.columns:
-                    df = df.drop(columns=["Hacc"])
-                if "Hdop" in df.columns:
-                    df = df.drop(columns=["Hdop"])
-                if "Quality of Signal" in df.columns:
-                    df = df.drop(columns=["Quality of Signal"])
-                if "No. of Satellites" in df.columns:
-                    df = df.drop(columns=["No. of Satellites"])
-                df.to_csv(file_path, index=False)
-
-def clean_red_cards():
-    game_metadata = pd.read_csv(metadata_path)
-    for _, row in game_metadata.iterrows():
-        if pd.isna(row['red cards']):  
-            continue
-        player, time = row['red cards'].split('|')
-        game_name = row['game_folder_name']
-        day = int(game_name.split('-')[2])
-        month = int(game_name.split('-')[1])    
-        year = int(game_name.split('-')[0])
-        season = "ipl2324"
-        if year >= 2024 and month > 5 or year == 2025:
-            season = "ipl2425"
-        
-        game_folder_path = os.path.join(base_GPS_folder_path, season, game_name)
-        if not os.path.exists(game_folder_path):
-            print(f"Game folder {game_folder_path} does not exist. Skipping...")
-            continue
-        player_file = os.path.join(game_folder_path, f"{year}-{month:02d}-{day:02d}-{player}-Entire-Session.csv")
-        if not os.path.exists(player_file):
-            print(f"Player file {player_file} does not exist. Skipping...")
-            continue    
-        df = pd.read_csv(player_file)
-        df['Time'] = pd.to_datetime(df['Time'], format='%Y-%m-%d %H:%M:%S.%f')
-        time_hour, time_minute, time_second = map(int, time.split(':'))
-        df = df[df['Time'] < datetime(year,month,day, int(time_hour),int(time_minute),int(time_second))]
-        df.to_csv(player_file, index=False)
-
-# Deprecated function, kept for reference
-def clean_before_and_after():
-    for dirpath, dirnames, filenames in os.walk(base_GPS_folder_path):
-        for filename in filenames:
-            if filename.endswith("-Entire-Session.csv"):
-                file_path = os.path.join(dirpath, filename)
-                df = pd.read_csv(file_path)
-                day = int(file_path.split('\\')[-1].split('-')[2])
-                month = int(file_path.split('\\')[-1].split('-')[1])
-                year = int(file_path.split('\\')[-1].split('-')[0])
-                date_string = f"{year}-{month:02d}-{day:02d}-"
-                game_metadata = metadata_df[metadata_df['game_folder_name'].str.contains(date_string)]
-                if game_metadata.empty:
-                    print(f"No metadata found for file {file_path}. Skipping...")
+        entry['status'] = 'missing_lineup_or_subs'
+        return entry
+    if game_metadata.empty:
+        print(f"No metadata found for game {game_folder_name}. Skipping...")
+        entry['status'] = 'missing_metadata'
+        return entry
+    try:
+        game_path = gps_store.game_partition_path(store_path, season, game_folder_name)
+        ingest_fingerprint = game_ingest_fingerprint(game_folder_path, digests_cache)
+        if ingest_fingerprint == previous_fingerprints.get('ingest') and gps_store.list_players(store_path, season, game_folder_name):
+            entry['ingest'] = 'up_to_date'
+        else:
+            for player_name in gps_store.list_players(store_path, season, game_folder_name):
+                gps_store.delete_player_session(store_path, season, game_folder_name, player_name)
+            for player_file in os.listdir(game_folder_path):
+                if player_file.endswith("-Entire-Session.csv"):
+                    entry['rows_read'] += ingest_player_file(os.path.join(game_folder_path, player_file), season, store_path)
+                    entry['players_ingested'] += 1
+            entry['ingest'] = 'ok'
+        entry['fingerprints']['ingest'] = ingest_fingerprint
+
+        windows_fingerprint = game_windows_fingerprint(lineup_file, subs_file, game_metadata, digests_cache)
+        index = playing_windows.read_index(game_path)
+        if entry['ingest'] == 'up_to_date' and index is not None and index['fingerprint'] == windows_fingerprint:
+            entry['windows'] = 'up_to_date'
+        else:
+            with open(lineup_file, 'r') as f:
+                lineup = json.load(f)
+            subs_df = pd.read_csv(subs_file)
+            player_names = gps_store.list_players(store_path, season, game_folder_name)
+            players_windows = build_game_windows(player_names, time_parsing.date_from_filename(game_folder_name),
+                                                 lineup, subs_df, game_metadata)
+            playing_windows.write_index(game_path, players_windows, windows_fingerprint)
+            for player_name, windows in players_windows.items():
+                if not windows:
+                    entry['players_not_played'] += 1
                     continue
-                start_time_str = game_metadata['start_csv_time'].values[0]
-                finish_time_str = game_metadata['second_half_finish_csv_time'].values[0]
-                start_hour, start_minute, start_second = map(int, start_time_str.split(':'))
-                finish_hour, finish_minute, finish_second = map(int, finish_time_str.split(':'))
-                df['Time'] = pd.to_datetime(df['Time'], format='%Y-%m-%d %H:%M:%S.%f')                
-                df = df[ 
-                    (df['Time'] >= datetime(year,month,day, int(start_hour),int(start_minute),int(start_second))) &
-                    (df['Time'] <= datetime(year,month,day, int(finish_hour), int(finish_minute), int(finish_second))) 
-                ]
-                df.to_csv(file_path, index=False)
-
-def clean_pipeline():
+                entry['players_played'] += 1
+                entry['rows_kept'] += sum(len(chunk) for chunk in gps_stream.iter_store_chunks(
+                    store_path, season, game_folder_name, player_name, columns=['Time']))
+            entry['windows'] = 'ok'
+        entry['fingerprints']['windows'] = windows_fingerprint
+        if entry['ingest'] == 'up_to_date' and entry['windows'] == 'up_to_date':
+            print(f"Game {game_folder_name} is up to date. Skipping...")
+            entry['status'] = 'up_to_date'
+    except Exception as e:
+        print(f"Error cleaning game {game_folder_name}: {e}")
+        entry['status'] = 'failed'
+        entry['error'] = repr(e)
+    entry['seconds'] = round(time.perf_counter() - started, 3)
+    game_folder_prefix = os.path.join(game_folder_path, '')
+    entry['file_digests'] = {path: digest for path, digest in digests_cache.items()
+                             if path.startswith(game_folder_prefix) or path in (lineup_file, subs_file)}
+    return entry
+
+def clean_game_folder(game_folder_path: str, season: str):
+    game_folder_name = os.path.basename(game_folder_path)
+    entry = clean_game(game_folder_path, season, get_game_metadata(game_folder_name),
+                       base_lineups_and_subs_folder_path, base_GPS_store_path)
+    entry.pop('file_digests', None)
+    return entry
+
+def clean_pipeline(n_workers: int = 1, manifest_path: str = None, state_path: str = None, force: bool = False):
+    """
+    Clean all the games of all the seasons into the GPS store, only games whose inputs changed since the last
+    run are cleaned again.
+
+    :param n_workers: Number of processes cleaning games in parallel, 1 runs serially in this process.
+    :param manifest_path: Where to write the JSON run manifest, default is "clean_manifest.json" inside the GPS store.
+    :param state_path: The incremental build state file, default is "build_state.json" inside the GPS store.
+    :param force: Clean all the games regardless of the build state.
+    :return: The manifest dict.
+    """
+    manifest_path = os.path.join(base_GPS_store_path, "clean_manifest.json") if manifest_path is None else manifest_path
+    state_path = os.path.join(base_GPS_store_path, "build_state.json") if state_path is None else state_path
+    state = build_state.load_build_state(state_path)
+    started = time.perf_counter()
+    tasks = []
     for season in os.listdir(base_GPS_folder_path):
-        print(f"Processing season: {season}")
         season_path = os.path.join(base_GPS_folder_path, season)
         if os.path.isdir(season_path):
             for game_folder in os.listdir(season_path):
                 game_folder_path = os.path.join(season_path, game_folder)
                 if os.path.isdir(game_folder_path):
-                    print(f"Cleaning game folder: {game_folder_path}")
-                    clean_game_folder(game_folder_path, season)
-    drop_irelevant_columns()
-    clean_red_cards()
+                    previous_fingerprints = {} if force else {
+                        step: state['targets'].get(f"{step}/{season}/{game_folder}") for step in ('ingest', 'windows')}
+                    tasks.append((game_folder_path, season, get_game_metadata(game_folder),
+                                  base_lineups_and_subs_folder_path, base_GPS_store_path, previous_fingerprints))
 
+    games = []
+    if n_workers <= 1:
+        for task in tasks:
+            print(f"Cleaning game folder: {task[0]}")
+            games.append(clean_game(*task, digests_cache=state['file_digests']))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(clean_game, *task, digests_cache=state['file_digests']): task for task in tasks}
+            for future in as_completed(futures):
+                game_folder_path, season = futures[future][:2]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    # the worker process itself died, the game entry couldn't be built there
+                    entry = {'game': os.path.basename(game_folder_path), 'season': season, 'status': 'failed',
+                             'error': repr(e)}
+                print(f"Cleaned game folder: {game_folder_path} ({entry['status']})")
+                games.append(entry)
 
+    for entry in games:
+        state['file_digests'].update(entry.pop('file_digests', {}))
+        for step, step_fingerprint in entry.get('fingerprints', {}).items():
+            if entry[step] in ('ok', 'up_to_date'):
+                build_state.record_build(state, f"{step}/{entry['season']}/{entry['game']}", step_fingerprint)
+    build_state.save_build_state(state, state_path)
 
+    manifest = {
+        'n_workers': n_workers,
+        'seconds': round(time.perf_counter() - started, 3),
+        'games_ok': sum(entry['status'] == 'ok' for entry in games),
+        'games_up_to_date': sum(entry['status'] == 'up_to_date' for entry in games),
+        'games_failed': sum(entry['status'] == 'failed' for entry in games),
+        'rows_kept': sum(entry.get('rows_kept', 0) for entry in games),
+        'games': sorted(games, key=lambda entry: (entry['season'], entry['game'])),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    return manifest
@@ -3,6 +3,17 @@ import pandas as pd
 import glob
 import os
 import feature_extraction_from_clean_games_csv as fe
+import time_parsing
+import xpts_cache
+
+MODELS = ("Binomial", "Poisson")
+UPPER_PLAYOFF_TEAMS = 6  # the top teams of the regular season play the championship playoff, the others the relegation playoff
+RELEGATED_TEAMS = 2
+ADAPTIVE_TOLERANCE = 0.02  # xPts standard error the adaptive simulation stops at, about 4000 draws
+ADAPTIVE_CHUNK_SIZE = 2_000
+SIMULATION_SEED = 42
+
+
 def expected_points(team, home_team, p_home_win, p_draw, p_away_win):
     """Calculate expected points for given team given win/draw/loss probabilities."""
     if team == home_team:
@@ -11,25 +22,91 @@ def expected_points(team, home_team, p_home_win, p_draw, p_away_win):
         return 3 * p_away_win + 1 * p_draw
 
 
-def simulate_expected_points(game_opta_csv_path: str, team_of_interest: str, n_sim: int = 10_000):
-    """Simulate expected points (binomial & Poisson) for one team in one match."""
-    df = pd.read_csv(game_opta_csv_path)
-    df['xG'] = df['xG'].fillna(0)
+def possession_goal_probabilities(df: pd.DataFrame):
+    """
+    Goal probability of every possession of a match, 1 - prod(1 - xG) over the possession shots.
 
-    # Aggregate goal probability per possession
+    :param df: The match OPTA DataFrame.
+    :return: (home_team, away_team, p_home, p_away).
+    """
+    miss_probs = 1 - df['xG'].fillna(0)
     poss_goal_probs = (
-        df.groupby(['PossNum', 'Team'])['xG']
-        .apply(lambda x: 1 - np.prod(1 - x))
+        (1 - miss_probs.groupby([df['PossNum'], df['Team']]).prod())
         .reset_index(name='p_goal')
     )
-
     home_team = df['homeTeam'].iloc[0]
     away_team = df['awayTeam'].iloc[0]
-
     p_home = poss_goal_probs.loc[poss_goal_probs['Team'] == home_team, 'p_goal'].values
     p_away = poss_goal_probs.loc[poss_goal_probs['Team'] == away_team, 'p_goal'].values
+    return home_team, away_team, p_home, p_away
+
+
+def binomial_goals_distribution(p_goal: np.ndarray):
+    """
+    Exact distribution of the goals count of independent possessions (Poisson-binomial), by dynamic programming:
+    every possession moves p_goal of the probability of k goals to k + 1 goals.
+
+    :param p_goal: Possessions goal probabilities, or a (matches, possessions) matrix zero padded on the right.
+    :return: Array, the probability of 0, 1, ..., possessions goals (one row per match for a matrix).
+    """
+    p_goal = np.asarray(p_goal, dtype=np.float64)
+    distribution = np.zeros(p_goal.shape[:-1] + (p_goal.shape[-1] + 1,))
+    distribution[..., 0] = 1.0
+    for n in range(p_goal.shape[-1]):
+        _add_possession(distribution, n, p_goal[..., n:n + 1])
+    return distribution
+
+
+def _add_possession(distribution: np.ndarray, n: int, p):
+    """One dynamic programming step, in place: the goals distribution of n possessions becomes the distribution of
+    n + 1 possessions, the last one scoring with probability p."""
+    distribution[..., 1:n + 2] = distribution[..., 1:n + 2] * (1 - p) + distribution[..., :n + 1] * p
+    distribution[..., :1] *= 1 - p
+
+
+def poisson_goals_distribution(mean_goals, max_goals: int = None):
+    """
+    Poisson distribution of the goals count, up to max_goals (default is far enough for the tail to be negligible).
+
+    :param mean_goals: The mean goals count, or an array of means (one per match).
+    :return: Array, the probability of 0, 1, ..., max_goals goals (one row per mean for an array).
+    """
+    mean_goals = np.asarray(mean_goals, dtype=np.float64)
+    if max_goals is None:
+        max_goals = int(mean_goals.max(initial=0) + 12 * np.sqrt(mean_goals.max(initial=0)) + 20)
+    k = np.arange(1, max_goals + 1)
+    means = mean_goals[..., None]
+    # pmf(k) = pmf(k - 1) * mean / k, in log space so large means don't underflow exp(-mean)
+    with np.errstate(divide='ignore'):
+        log_ratios = np.log(means / k)
+    zeros = np.zeros(mean_goals.shape + (1,))
+    return np.exp(-means + np.concatenate([zeros, np.cumsum(log_ratios, axis=-1)], axis=-1))
+
+
+def outcome_probabilities(home_goals_distribution: np.ndarray, away_goals_distribution: np.ndarray):
+    """
+    (p_home_win, p_draw, p_away_win) of two independent goals count distributions, summed over the joint distribution.
+    Distributions may be matrices (one row per match), the probabilities are then arrays.
+    """
+    n = max(home_goals_distribution.shape[-1], away_goals_distribution.shape[-1])
+    home = _pad_last_axis(home_goals_distribution, n)
+    away = _pad_last_axis(away_goals_distribution, n)
+    zeros = np.zeros(home.shape[:-1] + (1,))
+    away_below = np.concatenate([zeros, np.cumsum(away, axis=-1)[..., :-1]], axis=-1)  # P(away goals < k)
+    home_below = np.concatenate([zeros, np.cumsum(home, axis=-1)[..., :-1]], axis=-1)
+    p_home_win = (home * away_below).sum(axis=-1)
+    p_away_win = (away * home_below).sum(axis=-1)
+    p_draw = (home * away).sum(axis=-1)
+    return p_home_win, p_draw, p_away_win
 
-    rng = np.random.default_rng(42)
+
+def _pad_last_axis(array: np.ndarray, n: int):
+    return np.pad(array, [(0, 0)] * (array.ndim - 1) + [(0, n - array.shape[-1])])
+
+
+def _simulate_outcomes(p_home: np.ndarray, p_away: np.ndarray, n_sim: int):
+    """Monte Carlo (p_home_win, p_draw, p_away_win) of the Binomial and the Poisson models."""
+    rng = np.random.default_rng(SIMULATION_SEED)
 
     #  Binomial (per possession) 
     home_goals_b = rng.binomial(1, p_home, size=(n_sim, len(p_home))).sum(axis=1)
@@ -44,35 +121,235 @@ def simulate_expected_points(game_opta_csv_path: str, team_of_interest: str, n_s
     home_win_p = (home_goals_p > away_goals_p).mean()
     away_win_p = (away_goals_p > home_goals_p).mean()
     draw_p = (home_goals_p == away_goals_p).mean()
+    return (home_win_b, draw_b, away_win_b), (home_win_p, draw_p, away_win_p)
 
-    # Compute expected points
-    exp_b = expected_points(team_of_interest, home_team, home_win_b, draw_b, away_win_b)
-    exp_p = expected_points(team_of_interest, home_team, home_win_p, draw_p, away_win_p)
 
-    return exp_b, exp_p
+def _adaptive_outcomes(p_home: np.ndarray, p_away: np.ndarray, tol: float, chunk_size: int, max_sim: int):
+    """
+    Monte Carlo (p_home_win, p_draw, p_away_win) of the Binomial and the Poisson models, drawn chunk_size matches
+    at a time until the standard error of both teams xPts under both models is at most tol, or max_sim matches
+    were drawn. Only the outcome counts and the points sums are kept between chunks.
 
+    :return: (binomial, poisson, n_sim) - n_sim is the number of matches drawn.
+    """
+    rng = np.random.default_rng(SIMULATION_SEED)
+    # per model: home wins, draws, away wins, home points squares sum, away points squares sum
+    totals = np.zeros((len(MODELS), 5))
+    n_sim = 0
+    while n_sim < max_sim:
+        n = min(chunk_size, max_sim - n_sim)
+        home_goals_b = (rng.random((n, len(p_home))) < p_home).sum(axis=1)
+        away_goals_b = (rng.random((n, len(p_away))) < p_away).sum(axis=1)
+        home_goals_p = rng.poisson(p_home.sum(), size=n)
+        away_goals_p = rng.poisson(p_away.sum(), size=n)
+        for m, (home_goals, away_goals) in enumerate(((home_goals_b, away_goals_b), (home_goals_p, away_goals_p))):
+            home_points = np.where(home_goals > away_goals, 3, np.where(home_goals == away_goals, 1, 0))
+            away_points = np.where(home_goals < away_goals, 3, np.where(home_goals == away_goals, 1, 0))
+            totals[m] += [(home_points == 3).sum(), (home_points == 1).sum(), (away_points == 3).sum(),
+                          (home_points ** 2).sum(), (away_points ** 2).sum()]
+        n_sim += n
+        home_win, draw, away_win = totals[:, 0] / n_sim, totals[:, 1] / n_sim, totals[:, 2] / n_sim
+        home_variance = totals[:, 3] / n_sim - (3 * home_win + draw) ** 2
+        away_variance = totals[:, 4] / n_sim - (3 * away_win + draw) ** 2
+        standard_error = np.sqrt(np.maximum(np.r_[home_variance, away_variance], 0) / max(n_sim - 1, 1))
+        if n_sim > 1 and standard_error.max() <= tol:
+            break
+    outcomes = totals[:, :3] / n_sim
+    return tuple(outcomes[0]), tuple(outcomes[1]), n_sim
 
 
-def season_simulation_all_teams(season_path_csv: str, actual_points_dict, actual_positions_dict):
-    """Compute expected points for all teams across the season, output separate tables for Binomial and Poisson."""
-    games_csv = glob.glob(os.path.join(season_path_csv, "*.csv"))
+def _exact_outcomes(p_home: np.ndarray, p_away: np.ndarray):
+    """Exact (p_home_win, p_draw, p_away_win) of the Binomial and the Poisson models."""
+    binomial = outcome_probabilities(binomial_goals_distribution(p_home), binomial_goals_distribution(p_away))
+    poisson = outcome_probabilities(poisson_goals_distribution(p_home.sum()), poisson_goals_distribution(p_away.sum()))
+    return binomial, poisson
 
-    results = []
 
-    for file in games_csv:
-        df = pd.read_csv(file)
-        home_team = df['homeTeam'].iloc[0]
-        away_team = df['awayTeam'].iloc[0]
+def _match_expected_points(home_team, away_team, outcomes_by_model):
+    """The match result dict of simulate_match from the (p_home_win, p_draw, p_away_win) of every model."""
+    match = {'home_team': home_team, 'away_team': away_team}
+    for model, (p_home_win, p_draw, p_away_win) in zip(MODELS, outcomes_by_model):
+        match[model] = {'p_home_win': p_home_win, 'p_draw': p_draw, 'p_away_win': p_away_win,
+                        'home_xPts': 3 * p_home_win + p_draw, 'away_xPts': 3 * p_away_win + p_draw}
+    return match
+
+
+def _match_outcomes(p_home: np.ndarray, p_away: np.ndarray, n_sim: int, method: str, tol: float, chunk_size: int):
+    """(binomial, poisson, n_sim) outcome probabilities of a match, n_sim is the number of simulated matches (0 when exact)."""
+    if method == "exact":
+        return _exact_outcomes(p_home, p_away) + (0,)
+    elif method == "simulation":
+        return _simulate_outcomes(p_home, p_away, n_sim) + (n_sim,)
+    elif method == "adaptive":
+        return _adaptive_outcomes(p_home, p_away, tol, chunk_size, n_sim)
+    raise ValueError(f"Unknown method: {method}")
+
+
+def simulate_match(game_opta, n_sim: int = 10_000, method: str = "exact", tol: float = ADAPTIVE_TOLERANCE,
+                   chunk_size: int = ADAPTIVE_CHUNK_SIZE, cache_dir: str = None):
+    """
+    Outcome probabilities and expected points of both teams of a match under the Binomial and the Poisson models,
+    the game is parsed and simulated once.
+
+    :param game_opta: The match OPTA csv path or DataFrame.
+    :param method: "exact", "simulation" or "adaptive" (see simulate_expected_points).
+    :param cache_dir: Serve the result from this xPts cache folder (see xpts_cache.py), and save it there on a miss.
+    :return: dict - {'home_team', 'away_team', 'n_sim', 'Binomial': {...}, 'Poisson': {...}}, every model dict has
+             'p_home_win', 'p_draw', 'p_away_win', 'home_xPts' and 'away_xPts', n_sim is the number of simulated
+             matches (0 for the exact method).
+    """
+    df = pd.read_csv(game_opta) if isinstance(game_opta, str) else game_opta
+    key = None
+    if cache_dir is not None:
+        key = xpts_cache.cache_key(xpts_cache.shots_digest(df), method, n_sim, SIMULATION_SEED, tol, chunk_size)
+        match = xpts_cache.get_entry(cache_dir, key)
+        if match is not None:
+            return match
+    home_team, away_team, p_home, p_away = possession_goal_probabilities(df)
+    *outcomes, n_drawn = _match_outcomes(p_home, p_away, n_sim, method, tol, chunk_size)
+    match = _match_expected_points(home_team, away_team, outcomes)
+    match['n_sim'] = n_drawn
+    if key is not None:
+        xpts_cache.put_entry(cache_dir, key, match)
+    return match
+
+
+def simulate_expected_points(game_opta_csv_path: str, team_of_interest: str, n_sim: int = 10_000, method: str = "exact",
+                             tol: float = ADAPTIVE_TOLERANCE, chunk_size: int = ADAPTIVE_CHUNK_SIZE, cache_dir: str = None):
+    """
+    Expected points (binomial & Poisson) for one team in one match.
+
+    :param method: "exact" computes the outcome probabilities from the exact goals count distributions,
+                   "simulation" estimates them with n_sim Monte Carlo draws (kept for validation),
+                   "adaptive" draws chunk_size matches at a time until the standard error of the xPts is at most
+                   tol, n_sim is then the maximum number of draws.
+    :param cache_dir: The xPts cache folder (see simulate_match).
+    """
+    match = simulate_match(game_opta_csv_path, n_sim, method, tol, chunk_size, cache_dir)
+    side = 'home_xPts' if team_of_interest == match['home_team'] else 'away_xPts'
+    # numpy scalars whatever the method or a cache hit (JSON floats), as callers round them with .round
+    return np.float64(match['Binomial'][side]), np.float64(match['Poisson'][side])
+
+
+def season_possession_matrices(season_path_csv: str, shots_digests: bool = False):
+    """
+    Possessions goal probabilities of all the matches of a season, every game csv read once and all the
+    possessions grouped at once.
+
+    :return: (matches, p_home, p_away) - matches is a DataFrame with the 'file', 'home_team' and 'away_team' of
+             every match, p_home and p_away are (matches, max possessions) matrices zero padded on the right
+             (a zero goal probability possession doesn't change the goals distributions) with the possessions
+             counts in matches 'home_possessions' and 'away_possessions'.
+             With shots_digests, matches also has the 'shots_digest' of every match (see xpts_cache.py).
+    """
+    games_csv = sorted(glob.glob(os.path.join(season_path_csv, "*.csv")))
+    games_dfs = [pd.read_csv(file, usecols=['PossNum', 'Team', 'xG', 'homeTeam', 'awayTeam']) for file in games_csv]
+    season_df = pd.concat(games_dfs, keys=range(len(games_csv)), names=['match', None])
+    season_df = season_df.reset_index(level=0)
+    miss_probs = 1 - season_df['xG'].fillna(0)
+    poss_goal_probs = (
+        (1 - miss_probs.groupby([season_df['match'], season_df['PossNum'], season_df['Team']]).prod())
+        .reset_index(name='p_goal')
+    )
+    teams = season_df.groupby('match')[['homeTeam', 'awayTeam']].first()
+    matches = pd.DataFrame({'file': games_csv, 'home_team': teams['homeTeam'].to_numpy(),
+                            'away_team': teams['awayTeam'].to_numpy()})
+    matrices = []
+    for side, team_column in (('home', 'home_team'), ('away', 'away_team')):
+        side_probs = poss_goal_probs[poss_goal_probs['Team'].to_numpy()
+                                     == matches[team_column].to_numpy()[poss_goal_probs['match']]]
+        columns = side_probs.groupby('match').cumcount().to_numpy()
+        rows = side_probs['match'].to_numpy()
+        matrix = np.zeros((len(matches), columns.max(initial=-1) + 1))
+        matrix[rows, columns] = side_probs['p_goal'].to_numpy()
+        matches[f'{side}_possessions'] = np.bincount(rows, minlength=len(matches))
+        matrices.append(matrix)
+    if shots_digests:
+        matches['shots_digest'] = [xpts_cache.shots_digest(df) for df in games_dfs]
+    return matches, matrices[0], matrices[1]
+
+
+def _season_outcomes(matches: pd.DataFrame, p_home: np.ndarray, p_away: np.ndarray, n_sim: int, method: str,
+                     tol: float, chunk_size: int):
+    """(models, 3, matches) array of the matches (p_home_win, p_draw, p_away_win) and the simulated matches counts."""
+    if method == "exact":
+        outcomes = np.array([
+            outcome_probabilities(binomial_goals_distribution(p_home), binomial_goals_distribution(p_away)),
+            outcome_probabilities(poisson_goals_distribution(p_home.sum(axis=1)),
+                                  poisson_goals_distribution(p_away.sum(axis=1))),
+        ]).reshape(len(MODELS), 3, len(matches))
+        return outcomes, np.zeros(len(matches), dtype=np.int64)
+    # the draws depend on the possessions counts, every match is drawn from its own unpadded possessions
+    per_match = [_match_outcomes(p_home[i, :match.home_possessions], p_away[i, :match.away_possessions],
+                                 n_sim, method, tol, chunk_size)
+                 for i, match in enumerate(matches.itertuples())]
+    outcomes = np.array([match_outcomes[:len(MODELS)] for match_outcomes in per_match]).reshape(len(matches), len(MODELS), 3)
+    return outcomes.transpose(1, 2, 0), np.array([match_outcomes[-1] for match_outcomes in per_match], dtype=np.int64)
+
+
+def simulate_season_matches(season_path_csv: str, n_sim: int = 10_000, method: str = "exact",
+                            tol: float = ADAPTIVE_TOLERANCE, chunk_size: int = ADAPTIVE_CHUNK_SIZE,
+                            cache_dir: str = None):
+    """
+    simulate_match for all the matches of a season. The exact method runs the goals distributions dynamic
+    programming of all the matches at once over the stacked possessions matrices.
+
+    :param cache_dir: The xPts cache folder (see simulate_match), only the matches missing from it are simulated.
+    :return: DataFrame, one row per match - 'file', 'home_team', 'away_team' and for every model
+             "{model}_p_home_win", "{model}_p_draw", "{model}_p_away_win", "{model}_home_xPts", "{model}_away_xPts".
+    """
+    if method not in ("exact", "simulation", "adaptive"):
+        raise ValueError(f"Unknown method: {method}")
+    matches, p_home, p_away = season_possession_matrices(season_path_csv, shots_digests=cache_dir is not None)
+    outcomes = np.zeros((len(MODELS), 3, len(matches)))
+    rows = np.arange(len(matches))
+    if cache_dir is not None:
+        keys = [xpts_cache.cache_key(digest, method, n_sim, SIMULATION_SEED, tol, chunk_size)
+                for digest in matches['shots_digest']]
+        missing = []
+        for i, key in enumerate(keys):
+            match = xpts_cache.get_entry(cache_dir, key)
+            if match is None:
+                missing.append(i)
+                continue
+            outcomes[:, :, i] = [[match[model]['p_home_win'], match[model]['p_draw'], match[model]['p_away_win']]
+                                 for model in MODELS]
+        rows = np.array(missing, dtype=np.int64)
+        print(f"{len(matches) - len(rows)} matches served from the xPts cache, {len(rows)} to simulate")
+    if len(rows):
+        outcomes[:, :, rows], n_drawn = _season_outcomes(matches.iloc[rows], p_home[rows], p_away[rows],
+                                                          n_sim, method, tol, chunk_size)
+        if cache_dir is not None:
+            for i, n in zip(rows, n_drawn):
+                match = _match_expected_points(matches.at[i, 'home_team'], matches.at[i, 'away_team'], outcomes[:, :, i])
+                match['n_sim'] = int(n)
+                xpts_cache.put_entry(cache_dir, keys[i], match, evict=False)
+            xpts_cache.evict_entries(cache_dir)
+    matches = matches.drop(columns=['home_possessions', 'away_possessions', 'shots_digest'], errors='ignore')
+    for model, (p_home_win, p_draw, p_away_win) in zip(MODELS, outcomes):
+        matches[f'{model}_p_home_win'] = p_home_win
+        matches[f'{model}_p_draw'] = p_draw
+        matches[f'{model}_p_away_win'] = p_away_win
+        matches[f'{model}_home_xPts'] = 3 * p_home_win + p_draw
+        matches[f'{model}_away_xPts'] = 3 * p_away_win + p_draw
+    return matches
 
-        b_home, p_home = simulate_expected_points(file, home_team)
-        b_away, p_away = simulate_expected_points(file, away_team)
 
-        results.append({'Team': home_team, 'Model': 'Binomial', 'xPts': b_home})
-        results.append({'Team': away_team, 'Model': 'Binomial', 'xPts': b_away})
-        results.append({'Team': home_team, 'Model': 'Poisson', 'xPts': p_home})
-        results.append({'Team': away_team, 'Model': 'Poisson', 'xPts': p_away})
+def season_simulation_all_teams(season_path_csv: str, actual_points_dict, actual_positions_dict,
+                                n_sim: int = 10_000, method: str = "exact", cache_dir: str = xpts_cache.XPTS_CACHE_DIR):
+    """
+    Compute expected points for all teams across the season, output separate tables for Binomial and Poisson.
 
-    df_res = pd.DataFrame(results)
+    :param cache_dir: The xPts cache folder (see simulate_match), None to simulate every match again.
+    """
+    matches = simulate_season_matches(season_path_csv, n_sim, method, cache_dir=cache_dir)
+
+    results = []
+    for model in MODELS:
+        results.append(pd.DataFrame({'Team': matches['home_team'], 'Model': model, 'xPts': matches[f'{model}_home_xPts']}))
+        results.append(pd.DataFrame({'Team': matches['away_team'], 'Model': model, 'xPts': matches[f'{model}_away_xPts']}))
+
+    df_res = pd.concat(results, ignore_index=True)
 
     # Aggregate per team per model
     table = (
@@ -110,17 +387,191 @@ def season_simulation_all_teams(season_path_csv: str, actual_points_dict, actual
 
     return binomial_table, poisson_table
 
-def xPts_feature_creation(opta_folder_path: str, full_games_df: pd.DataFrame):
+def simulate_season_table(season_path_csv: str, model: str = "Binomial", n_seasons: int = 100_000,
+                          chunk_size: int = 10_000, seed: int = SIMULATION_SEED, matches: pd.DataFrame = None):
+    """
+    Monte Carlo of the league table: every simulated season draws the result of all the matches jointly from their
+    outcome probabilities (simulate_season_matches) and sums the points of every team.
+    The regular season is the double round robin, the first teams * (teams - 1) matches by date (the date the OPTA
+    file names start with). Its ranking splits the teams into the upper (top UPPER_PLAYOFF_TEAMS) and lower playoffs,
+    the final table ranks the upper playoff teams first, each group by its total points over all the matches. The
+    playoff rounds are the played fixtures of the season folder, so a simulated split other than the real one keeps
+    the real playoff fixtures. Ties are broken at random. Seasons are simulated in chunks of chunk_size, only a
+    (chunk_size, matches) array is drawn at a time so the memory doesn't grow with n_seasons.
+
+    :param model: "Binomial" or "Poisson", the model of the matches outcome probabilities.
+    :param matches: The simulate_season_matches result, computed from season_path_csv when not given.
+    :return: DataFrame, one row per team sorted by mean points - 'Team', 'Mean_Pts', 'Std_Pts', 'Mean_Pos',
+             'P_Title', 'P_Upper_Playoff', 'P_Lower_Playoff' (the regular season split), 'P_Relegation' and
+             'P_Pos_{k}' for every final position k.
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown model: {model}")
+    matches = simulate_season_matches(season_path_csv) if matches is None else matches
+    teams = np.unique(np.r_[matches['home_team'].to_numpy(), matches['away_team'].to_numpy()])
+    n_teams = len(teams)
+    home = np.searchsorted(teams, matches['home_team'].to_numpy())
+    away = np.searchsorted(teams, matches['away_team'].to_numpy())
+    # (matches, teams) incidence matrices, a matmul sums the points of every team
+    home_incidence = np.zeros((len(matches), n_teams), dtype=np.float32)
+    home_incidence[np.arange(len(matches)), home] = 1
+    away_incidence = np.zeros((len(matches), n_teams), dtype=np.float32)
+    away_incidence[np.arange(len(matches)), away] = 1
+    p_home_win = matches[f'{model}_p_home_win'].to_numpy()
+    p_not_away_win = p_home_win + matches[f'{model}_p_draw'].to_numpy()
+    dates = matches['file'].map(lambda path: os.path.basename(path)[:10]).to_numpy()
+    regular_season = np.zeros(len(matches), dtype=bool)
+    regular_season[np.argsort(dates, kind='stable')[:n_teams * (n_teams - 1)]] = True
+    n_upper = min(UPPER_PLAYOFF_TEAMS, n_teams)
+
+    rng = np.random.default_rng(seed)
+    points_sum = np.zeros(n_teams)
+    points_squares_sum = np.zeros(n_teams)
+    position_counts = np.zeros(n_teams * n_teams, dtype=np.int64)
+    upper_counts = np.zeros(n_teams, dtype=np.int64)
+    for first in range(0, n_seasons, chunk_size):
+        n = min(chunk_size, n_seasons - first)
+        draws = rng.random((n, len(matches)))
+        home_win = draws < p_home_win
+        draw = ~home_win & (draws < p_not_away_win)
+        home_points = (3 * home_win + draw).astype(np.float32)
+        away_points = (3 * ~(home_win | draw) + draw).astype(np.float32)
+        regular_points = home_points[:, regular_season] @ home_incidence[regular_season] + \
+            away_points[:, regular_season] @ away_incidence[regular_season]
+        points = home_points @ home_incidence + away_points @ away_incidence
+        points_sum += points.sum(axis=0)
+        points_squares_sum += (points.astype(np.float64) ** 2).sum(axis=0)
+        # points are integers, a uniform jitter below 1 breaks the ties at random
+        jitter = rng.random((n, n_teams))
+        upper = np.zeros((n, n_teams), dtype=bool)
+        np.put_along_axis(upper, np.argsort(-(regular_points + jitter), axis=1)[:, :n_upper], True, axis=1)
+        upper_counts += upper.sum(axis=0)
+        # the upper playoff teams finish above all the lower playoff teams
+        order = np.argsort(-(points + jitter + upper * (3.0 * len(matches) + 1)), axis=1)
+        position_counts += np.bincount((order * n_teams + np.arange(n_teams)).ravel(), minlength=n_teams * n_teams)
+    position_probs = position_counts.reshape(n_teams, n_teams) / n_seasons  # (team, position)
+
+    mean_points = points_sum / n_seasons
+    table = pd.DataFrame({
+        'Team': teams,
+        'Mean_Pts': mean_points,
+        'Std_Pts': np.sqrt(np.maximum(points_squares_sum / n_seasons - mean_points ** 2, 0)),
+        'Mean_Pos': position_probs @ np.arange(1, n_teams + 1),
+        'P_Title': position_probs[:, 0],
+        'P_Upper_Playoff': upper_counts / n_seasons,
+        'P_Lower_Playoff': 1 - upper_counts / n_seasons,
+        'P_Relegation': position_probs[:, n_teams - RELEGATED_TEAMS:].sum(axis=1),
+    })
+    for position in range(n_teams):
+        table[f'P_Pos_{position + 1}'] = position_probs[:, position]
+    table = table.sort_values(by='Mean_Pts', ascending=False).reset_index(drop=True)
+
+    print(f"\n {model} Simulated League Table ({n_seasons} seasons) \n")
+    print(table[['Team', 'Mean_Pts', 'Std_Pts', 'Mean_Pos', 'P_Title', 'P_Upper_Playoff', 'P_Lower_Playoff',
+                 'P_Relegation']].round(4).to_string(index=False))
+    return table
+
+
+def xpts_timeline(game_opta, starts_ns: np.ndarray, ends_ns: np.ndarray):
+    """
+    In-game outcome probabilities and expected points of both teams at the end of every interval.
+    The possessions with shots are walked once in time order, a possession counts once it is complete (at its last
+    shot) and updates its team Binomial goals distribution by one dynamic programming step, so the cost is linear in
+    the possessions whatever the number of intervals. The Poisson model only needs the running xG sum.
+
+    :param game_opta: The match OPTA csv path or DataFrame.
+    :param starts_ns, ends_ns: The intervals bounds, int64 epoch ns (see get_intervals_bounds_ns).
+    :return: DataFrame, one row per interval - 'interval_start', 'home_team', 'away_team' and for every model
+             "{model}_p_home_win", "{model}_p_draw", "{model}_p_away_win", "{model}_home_xPts", "{model}_away_xPts"
+             given the possessions completed before the interval end.
+    """
+    df = pd.read_csv(game_opta) if isinstance(game_opta, str) else game_opta
+    home_team = df['homeTeam'].iloc[0]
+    away_team = df['awayTeam'].iloc[0]
+    shots = df[df['xG'].notna()]
+    possessions = (
+        pd.DataFrame({'PossNum': shots['PossNum'], 'Team': shots['Team'], 'miss_prob': 1 - shots['xG'],
+                      'time_ns': pd.to_datetime(shots['TimeStamp'], format='%Y-%m-%d %H:%M:%S')
+                     .to_numpy().astype('datetime64[ns]').view(np.int64)})
+        .groupby(['PossNum', 'Team'], as_index=False)
+        .agg(miss_prob=('miss_prob', 'prod'), time_ns=('time_ns', 'max'))
+        .sort_values('time_ns', kind='stable')
+    )
+
+    n_intervals = len(starts_ns)
+    distributions = []
+    running_xg = []
+    for team in (home_team, away_team):
+        team_possessions = possessions[possessions['Team'] == team]
+        p_goal = 1 - team_possessions['miss_prob'].to_numpy()
+        # number of the team possessions completed before every interval end
+        completed = np.searchsorted(team_possessions['time_ns'].to_numpy(), ends_ns, side='left')
+        distribution = np.zeros(len(p_goal) + 1)
+        distribution[0] = 1.0
+        snapshots = np.zeros((n_intervals, len(p_goal) + 1))
+        n = 0
+        for k, n_completed in enumerate(completed):
+            for n in range(n, n_completed):
+                _add_possession(distribution, n, p_goal[n])
+            n = n_completed
+            snapshots[k, :n + 1] = distribution[:n + 1]
+        distributions.append(snapshots)
+        running_xg.append(np.r_[0.0, np.cumsum(p_goal)][completed])
+
+    outcomes = (outcome_probabilities(distributions[0], distributions[1]),
+                outcome_probabilities(poisson_goals_distribution(running_xg[0]), poisson_goals_distribution(running_xg[1])))
+    timeline = pd.DataFrame({'interval_start': time_parsing.ns_to_datetime(starts_ns),
+                             'home_team': home_team, 'away_team': away_team})
+    for model, (p_home_win, p_draw, p_away_win) in zip(MODELS, outcomes):
+        timeline[f'{model}_p_home_win'] = p_home_win
+        timeline[f'{model}_p_draw'] = p_draw
+        timeline[f'{model}_p_away_win'] = p_away_win
+        timeline[f'{model}_home_xPts'] = 3 * p_home_win + p_draw
+        timeline[f'{model}_away_xPts'] = 3 * p_away_win + p_draw
+    return timeline
+
+
+def get_game_xpts_timeline(metadata_file_path: str, opta_folder_path: str, game_folder_name: str,
+                           summation_interval: int = 5):
+    """
+    xpts_timeline of a game on the summation intervals of its features csv, joins the features on 'interval_start'.
+    """
+    intervals = fe.get_game_intervals(metadata_file_path, game_folder_name, summation_interval)
+    starts_ns, ends_ns = fe.get_intervals_bounds_ns(intervals)
+    opta_file_path = os.path.join(opta_folder_path, fe.get_season(game_folder_name), game_folder_name + ".csv")
+    return xpts_timeline(opta_file_path, starts_ns, ends_ns)
+
+
+def opta_files_index(opta_folder_path: str):
+    """
+    Date ("YYYY-MM-DD") -> OPTA csv path of all the seasons folders, the OPTA files are named "{date}-....csv".
+    The folders are listed once, the first file (by name) of a date is kept.
+    """
+    index = {}
+    for path in sorted(glob.glob(os.path.join(opta_folder_path, "*", "*.csv"))):
+        file_name = os.path.basename(path)
+        if file_name[10:11] == '-':
+            index.setdefault(file_name[:10], path)
+    return index
+
+
+def xPts_feature_creation(opta_folder_path: str, full_games_df: pd.DataFrame, team_of_interest: str = 'Maccabi Haifa',
+                          n_sim: int = 10_000, method: str = "exact", cache_dir: str = xpts_cache.XPTS_CACHE_DIR):
+    """
+    Add the team of interest xPts of every game to full_games_df, saved as "full_games_features_dataset4.csv".
+
+    :param cache_dir: The xPts cache folder (see simulate_match), None to simulate every game again.
+    """
+    opta_files = opta_files_index(opta_folder_path)
     full_games_df['xPts'] = 0.000
     for idx, row in full_games_df.iterrows():
         game_date = row['game_date'].split(' ')[0]
-        season = fe.get_season(game_date.split(' ')[0])
-        opta_files = glob.glob(os.path.join(opta_folder_path, season, f"{game_date}-*.csv"))
-        if not opta_files:
+        opta_file = opta_files.get(game_date)
+        if opta_file is None:
             print(f"No OPTA file found for date {game_date}")
             continue
-        opta_file = opta_files[0]
-        full_games_df.at[idx, 'xPts'] = simulate_expected_points(opta_file, 'Maccabi Haifa')[0].round(3)
+        full_games_df.at[idx, 'xPts'] = round(simulate_expected_points(opta_file, team_of_interest, n_sim, method,
+                                                                       cache_dir=cache_dir)[0], 3)
     full_games_df.to_csv("full_games_features_dataset4.csv", index=False)
 
 
@@ -0,0 +1,168 @@
+from feature_engine import *
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+"""
+Multi resolution features of a game.
+The raw GPS sessions are read once per game by the feature engine (see feature_engine.py) into a per second,
+per role feature cube (zone distance and time, accelerations, decelerations and the selected extra features),
+saved beside the features csv as "feature_cube_{game folder name}.parquet".
+Any summation interval (5, 15, 3, 10 minutes...), the halves and the full game are then rolled up from the cube
+with cumulative sums, without reading the GPS data again.
+Cube rows are the seconds of the two halves ([half start, half end)), columns "second", "half" and one column
+per feature and role, named like the features csv ("zone_5_distance_defenders", "accelerations_midfielders"...).
+The cube file records the fingerprint of its inputs (sessions, metadata row, sample interval model and extractors
+with their parameters), a cube whose inputs changed since it was built is built again when loaded.
+The acceleration lookahead stays inside the half, so events near the edges of a summation interval may count
+slightly differently than in get_game_accel_decel_csv, where the lookahead stops at the interval end.
+"""
+
+
+def get_cube_path(game_folder_path: str):
+    return os.path.join(game_folder_path, "feature_cube_{}.parquet".format(os.path.basename(game_folder_path)))
+
+
+CUBE_FINGERPRINT_KEY = b"inputs_fingerprint"
+
+
+def game_cube_fingerprint(metadata_file_path: str, game_folder_path: str, store_path: str = None,
+                          extractors: list = None, max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None,
+                          digests_cache: dict = None):
+    """Fingerprint of everything a game feature cube depends on (the OPTA file and the intervals are not, see rollup)."""
+    game_metadata = metadata_registry.get_game_frame(metadata_file_path, os.path.basename(game_folder_path))
+    extractors = list(DEFAULT_FEATURE_EXTRACTORS) if extractors is None else extractors
+    return build_state.fingerprint(get_game_session_files(game_folder_path, store_path),
+                                   {'metadata': build_state.metadata_row_digest(game_metadata),
+                                    'max_gap': max_gap,
+                                    'resample_hz': resample_hz,
+                                    'extractors': extractors_fingerprint(extractors)},
+                                   digests_cache)
+
+
+def get_halves_bounds_ns(metadata_file_path: str, game_folder_name: str):
+    start, first_half_end, second_half_start, second_half_end = metadata_registry.get_half_times_ns(
+        metadata_file_path, game_folder_name)
+    return np.array([start, second_half_start], dtype=np.int64), np.array([first_half_end, second_half_end], dtype=np.int64)
+
+
+def _cube_rows(times_ns: np.ndarray, bins: np.ndarray, starts_ns: np.ndarray, rows_offsets: np.ndarray):
+    """Cube row (second of its half) of every sample, -1 for samples outside the halves."""
+    inside = bins >= 0
+    rows = np.full(len(times_ns), -1, dtype=np.int64)
+    rows[inside] = rows_offsets[bins[inside]] + (times_ns[inside] - starts_ns[bins[inside]]) // time_parsing.NS_PER_SECOND
+    return rows
+
+
+def build_game_feature_cube(metadata_file_path: str, game_folder_path: str, store_path: str = None,
+                            extractors: list = None, max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None,
+                            digests_cache: dict = None):
+    """
+    Compute and save the per second feature cube of a game, one read per player.
+
+    :param extractors: Names of the registered feature extractors to run, default is DEFAULT_FEATURE_EXTRACTORS.
+    :param max_gap, resample_hz: The sample interval model of the zones (see sample_intervals.py).
+    :param digests_cache: File digests cache (see build_state.file_digest), updated in place.
+    :return: The cube DataFrame.
+    """
+    inputs_fingerprint = game_cube_fingerprint(metadata_file_path, game_folder_path, store_path, extractors, max_gap,
+                                               resample_hz, digests_cache)
+    game_folder_name = os.path.basename(game_folder_path)
+    starts_ns, ends_ns = get_halves_bounds_ns(metadata_file_path, game_folder_name)
+    halves_seconds = -(-(ends_ns - starts_ns) // time_parsing.NS_PER_SECOND)
+    rows_offsets = np.r_[0, np.cumsum(halves_seconds)[:-1]]
+    context = {
+        'segments_starts_ns': starts_ns,
+        'segments_ends_ns': ends_ns,
+        'to_bins': lambda times_ns: _cube_rows(times_ns, get_interval_bins(times_ns, starts_ns, ends_ns), starts_ns, rows_offsets),
+        'n_bins': int(halves_seconds.sum()),
+        'max_gap': max_gap,
+        'resample_hz': resample_hz,
+    }
+    game_features = extract_game_role_features(game_folder_path, context, extractors, store_path)
+
+    seconds_ns = np.concatenate([start + np.arange(n) * time_parsing.NS_PER_SECOND for start, n in zip(starts_ns, halves_seconds)])
+    cube_df = pd.DataFrame({"second": time_parsing.ns_to_datetime(seconds_ns),
+                            "half": np.repeat(np.arange(1, len(starts_ns) + 1), halves_seconds)})
+    for features in game_features.values():
+        for column, values in features.items():
+            cube_df[column] = values
+    table = pa.Table.from_pandas(cube_df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), CUBE_FINGERPRINT_KEY: inputs_fingerprint.encode()})
+    pq.write_table(table, get_cube_path(game_folder_path))
+    return cube_df
+
+
+def load_game_feature_cube(metadata_file_path: str, game_folder_path: str, store_path: str = None,
+                           extractors: list = None, max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None,
+                           digests_cache: dict = None):
+    """The saved feature cube of a game, built first if the game has none or its inputs changed since it was built."""
+    cube_path = get_cube_path(game_folder_path)
+    if os.path.exists(cube_path):
+        inputs_fingerprint = game_cube_fingerprint(metadata_file_path, game_folder_path, store_path, extractors,
+                                                   max_gap, resample_hz, digests_cache)
+        if (pq.read_schema(cube_path).metadata or {}).get(CUBE_FINGERPRINT_KEY) == inputs_fingerprint.encode():
+            return pd.read_parquet(cube_path)
+        print(f"Feature cube of {os.path.basename(game_folder_path)} is out of date. Rebuilding...")
+    return build_game_feature_cube(metadata_file_path, game_folder_path, store_path, extractors, max_gap, resample_hz,
+                                   digests_cache)
+
+
+def rollup_feature_cube(cube_df: pd.DataFrame, summation_interval=5, opta_file_path: str = None):
+    """
+    Roll a feature cube up to a summation interval, same layout as the features csv.
+
+    :param summation_interval: Interval length in minutes (intervals restart at every half start like
+                               get_game_features_csv), "half" or "game".
+    :param opta_file_path: The game OPTA file, adds the "TotalxG" label - the xG of the shots in
+                           [interval_start, interval_start + summation_interval) for minutes intervals,
+                           up to the next half start for halves and of the whole file for the game.
+    :return: Features DataFrame indexed by "interval_start".
+    """
+    n_rows = len(cube_df)
+    halves = cube_df["half"].to_numpy()
+    half_first_rows = np.flatnonzero(np.r_[True, halves[1:] != halves[:-1]])
+    half_end_rows = np.r_[half_first_rows[1:], n_rows]
+    if summation_interval == "game":
+        first_rows = np.array([0])
+    elif summation_interval == "half":
+        first_rows = half_first_rows
+    else:
+        step = int(summation_interval * 60)
+        first_rows = np.concatenate([np.arange(first, end, step) for first, end in zip(half_first_rows, half_end_rows)])
+    end_rows = np.r_[first_rows[1:], n_rows]
+
+    feature_columns = [c for c in cube_df.columns if c not in ("second", "half")]
+    cumulative = np.vstack([np.zeros((1, len(feature_columns))),
+                            np.cumsum(cube_df[feature_columns].to_numpy(dtype=np.float64), axis=0)])
+    sums = cumulative[end_rows] - cumulative[first_rows]
+    seconds = cube_df["second"].to_numpy()
+    zone_columns = [c for c in feature_columns if any(c.startswith(feature + "_") for feature in ZONE_FEATURES)]
+    sums_df = pd.DataFrame(sums, columns=feature_columns)
+    game_features = {"zones": {column: sums_df[column].to_numpy() for column in zone_columns},
+                     "others": {column: sums_df[column].to_numpy() for column in feature_columns if column not in zone_columns}}
+    features_df = build_features_table(pd.DatetimeIndex(seconds[first_rows], name="interval_start"),
+                                       end_rows - first_rows, game_features)
+
+    if opta_file_path is not None:
+        starts_ns = seconds[first_rows].astype('datetime64[ns]').view(np.int64)
+        if summation_interval in ("half", "game"):
+            ends_ns = np.r_[starts_ns[1:], np.iinfo(np.int64).max]
+        else:
+            ends_ns = starts_ns + int(summation_interval * 60) * time_parsing.NS_PER_SECOND
+        if summation_interval == "game":
+            starts_ns = np.array([np.iinfo(np.int64).min])
+        features_df['TotalxG'] = get_intervals_xg(opta_file_path, starts_ns, ends_ns)
+    return features_df
+
+
+def get_game_features_from_cube(metadata_file_path: str, game_folder_path: str, opta_folder_path: str,
+                                summation_interval=5, store_path: str = None, extractors: list = None,
+                                max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None):
+    """
+    Features of a game at any summation interval ("half" and "game" too), rolled up from the game feature cube.
+    The cube is built on the first call, later calls don't read the GPS data while its inputs don't change.
+    """
+    game_folder_name = os.path.basename(game_folder_path)
+    cube_df = load_game_feature_cube(metadata_file_path, game_folder_path, store_path, extractors, max_gap, resample_hz)
+    opta_file_path = os.path.join(opta_folder_path, get_season(game_folder_name), game_folder_name + ".csv")
+    return rollup_feature_cube(cube_df, summation_interval, opta_file_path)
@@ -0,0 +1,123 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from constants import POSITIONS_MAPPING
+from feature_extraction_from_clean_games_csv import get_season
+
+"""
+Partitioned store of the features datasets and a cached query API over it.
+The datasets built by create_full_dataset.create_datasets are written once as Parquet, hive-partitioned by
+interval length and season:
+Features_store
+|- interval=5
+|   |- season=ipl2324
+|   |   |- part.parquet
+|   |- season=ipl2425
+|- interval=half
+|- interval=game
+Rows of the "half" and minutes intervals datasets have a "half" column (1 or 2).
+query_features reads only the partitions of the requested seasons and the requested columns, results are kept in
+memory and served again without reading while the partitions files don't change:
+    df = query_features(store_path, "half", seasons=["ipl2425"], half=2, roles=["defender"])
+"""
+
+PART_FILE_NAME = "part.parquet"
+TIME_COLUMNS = {"game": "game_date"}  # the time column of every interval length, "interval_start" by default
+ROLES = list(dict.fromkeys(POSITIONS_MAPPING.values()))
+
+_query_cache = {}  # query key -> (partitions files signature, DataFrame)
+
+
+def _interval_path(store_path: str, interval):
+    return os.path.join(store_path, f"interval={interval}")
+
+
+def write_features_dataset(df: pd.DataFrame, store_path: str, interval):
+    """
+    Write (or replace) the dataset of an interval length in the store, one partition per season.
+
+    :param interval: Interval length in minutes, "half" or "game".
+    """
+    time_column = TIME_COLUMNS.get(interval, "interval_start")
+    interval_path = _interval_path(store_path, interval)
+    if os.path.isdir(interval_path):
+        shutil.rmtree(interval_path)
+    df = df.copy()
+    df[time_column] = pd.to_datetime(df[time_column])
+    seasons = df[time_column].dt.strftime("%Y-%m-%d").map(get_season).to_numpy()
+    for season in np.unique(seasons):
+        partition_path = os.path.join(interval_path, f"season={season}")
+        os.makedirs(partition_path, exist_ok=True)
+        df[seasons == season].to_parquet(os.path.join(partition_path, PART_FILE_NAME), index=False)
+
+
+def list_intervals(store_path: str):
+    """The interval lengths in the store, as their partition names ("5", "15", "half", "game"...)."""
+    if not os.path.isdir(store_path):
+        return []
+    return sorted(d.split('=', 1)[1] for d in os.listdir(store_path) if d.startswith("interval="))
+
+
+def list_seasons(store_path: str, interval):
+    interval_path = _interval_path(store_path, interval)
+    if not os.path.isdir(interval_path):
+        return []
+    return sorted(d.split('=', 1)[1] for d in os.listdir(interval_path) if d.startswith("season="))
+
+
+def _select_columns(schema_names: list, roles: list, columns: list):
+    """The non role columns, the columns of the requested roles and the requested columns, in the dataset order."""
+    role_suffixes = {role: f"_{role}s" for role in ROLES}
+    selected = []
+    for name in schema_names:
+        name_roles = [role for role, suffix in role_suffixes.items() if name.endswith(suffix)]
+        if columns is not None and name not in columns:
+            continue
+        if roles is not None and name_roles and name_roles[0] not in roles:
+            continue
+        selected.append(name)
+    return selected
+
+
+def query_features(store_path: str, interval, seasons: list = None, half: int = None, roles: list = None,
+                   columns: list = None):
+    """
+    Query a features dataset of the store, reading only the needed partitions and columns.
+    Results are cached in memory, a cached result is served again as long as its partitions files didn't change.
+
+    :param interval: Interval length in minutes, "half" or "game".
+    :param seasons: Seasons to read ("ipl2324", "ipl2425"), default is all of them.
+    :param half: Keep only the rows of this half (1 or 2), not available for the "game" interval.
+    :param roles: Keep only the features of these roles ("defender", "midfielder", "attacker"), the features
+                  which are not per role (interval_duration, totals, TotalxG...) are always kept.
+    :param columns: Keep only these columns (the time column is always kept).
+    :return: A new DataFrame, changing it doesn't change the cache.
+    """
+    if half is not None and interval == "game":
+        raise ValueError("The full games dataset has no halves")
+    seasons = list_seasons(store_path, interval) if seasons is None else list(seasons)
+    files = [os.path.join(_interval_path(store_path, interval), f"season={season}", PART_FILE_NAME) for season in seasons]
+    files = [path for path in files if os.path.exists(path)]
+    if not files:
+        raise FileNotFoundError(f"No {interval} features dataset found in {store_path} for seasons {seasons}")
+    signature = tuple((path, os.stat(path).st_mtime_ns) for path in files)
+    key = (os.path.abspath(store_path), str(interval), tuple(seasons), half,
+           None if roles is None else tuple(roles), None if columns is None else tuple(columns))
+    cached = _query_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1].copy()
+
+    dataset = ds.dataset(files, format="parquet")
+    time_column = TIME_COLUMNS.get(interval, "interval_start")
+    read_columns = _select_columns(dataset.schema.names, roles,
+                                   None if columns is None else [time_column] + list(columns))
+    row_filter = None if half is None else ds.field('half') == half
+    df = dataset.to_table(columns=read_columns, filter=row_filter).to_pandas()
+    _query_cache[key] = (signature, df)
+    return df.copy()
+
+
+def clear_query_cache():
+    _query_cache.clear()
@@ -0,0 +1,342 @@
+from feature_extraction_from_clean_games_csv import *
+from itertools import tee, zip_longest
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import time
+import feature_registry
+import sprint_bouts
+
+"""
+Per game feature engine.
+Every player session is read once, with the union of the columns all the feature extractors need, and the chunks
+stream is shared by the extractors (itertools.tee) which are advanced together, so only a few chunks are buffered.
+The joined features table (zones, accelerations and any selected extra feature) is written once.
+
+A feature extractor is a generator function extractor(chunks, context) yielding partial {feature: per bin sums}
+dicts while it consumes the chunks (at least every few chunks, a generator holding all its results to the end would
+make the shared stream buffer the whole session). The engine sums the partial results per role, as "{feature}_{role}s",
+or keeps them per player, as "{feature}_{player name}".
+The built in zones and accelerations extractors are compiled from the declared features of feature_registry.py.
+context keys:
+    segments_starts_ns, segments_ends_ns - the game segments (summation intervals, or halves), sorted
+    to_bins - function(times_ns) returning the output bin of every sample, -1 outside the game
+    n_bins - number of output bins
+    max_gap, resample_hz - the sample interval model (see sample_intervals.py)
+"""
+
+ZONE_FEATURES = ["zone_5_distance", "zone_5_time", "zone_6_distance", "zone_6_time"]
+ACCEL_FEATURES = ["accelerations", "decelerations"]
+TOTAL_ROLES = ["defender", "midfielder", "attacker"]
+
+FEATURE_EXTRACTORS = {}  # name -> (columns, extractor, by), in registration order
+FEATURE_EXTRACTOR_PARAMS = {}  # name -> JSON-able parameters of the extractor, part of the features fingerprint
+DEFAULT_FEATURE_EXTRACTORS = []  # names run when no extractors are given, in registration order
+
+
+def register_feature_extractor(name: str, columns: list, extractor, by: str = 'role', params=None, default: bool = True):
+    """
+    Add a feature extractor to the engine.
+
+    :param columns: The session columns the extractor needs ('Time' is always read).
+    :param by: 'role' to sum the features per role ("{feature}_{role}s"), 'player' to keep them per player
+               ("{feature}_{player name}").
+    :param params: The extractor parameters (thresholds...), JSON-able. Games extracted with other parameters are
+                   extracted again by the incremental extraction.
+    :param default: Run it in every extraction after the built in ones, otherwise only when selected by name
+                    (extractors=[..., name]).
+    """
+    FEATURE_EXTRACTORS[name] = (list(columns), extractor, by)
+    FEATURE_EXTRACTOR_PARAMS[name] = params
+    if default and name not in DEFAULT_FEATURE_EXTRACTORS:
+        DEFAULT_FEATURE_EXTRACTORS.append(name)
+    elif not default and name in DEFAULT_FEATURE_EXTRACTORS:
+        DEFAULT_FEATURE_EXTRACTORS.remove(name)
+
+
+def register_feature_set(name: str, feature_names: list, default: bool = True):
+    """
+    Register the declared features (see feature_registry.py) as one extractor, evaluated together in a single pass.
+    A thresholds sweep is registered the same way, e.g.
+    register_feature_set("sprint_sweep", feature_registry.sweep_thresholds("distance", [5.0, 5.5, 6.0]))
+    """
+    plan, extractor = feature_registry.plan_extractor(feature_names)
+    # the declarations the plan was compiled from, a redeclared feature only changes the plans compiled after it
+    register_feature_extractor(name, plan['columns'], extractor, plan['by'], params=plan['features'], default=default)
+
+
+def extractors_fingerprint(extractors: list):
+    """Fingerprint of the extractors to run, in order, with their parameters (the compiled plans declarations...)."""
+    values = {'order': ','.join(extractors)}
+    for name in extractors:
+        values[f"extractor/{name}"] = json.dumps(FEATURE_EXTRACTOR_PARAMS.get(name), sort_keys=True)
+    return build_state.fingerprint(values=values)
+
+
+register_feature_set("zones", ZONE_FEATURES)
+register_feature_set("accelerations", ACCEL_FEATURES)
+# opt-in, its columns are not part of the features csv layout create_full_dataset and the models read
+register_feature_extractor("sprint_bouts", ["Speed (m/s)"], sprint_bouts.sprint_bouts_extractor, params={
+    'threshold': sprint_bouts.ZONE_6_SPRINT_THRESHOLD, 'min_duration_s': sprint_bouts.SPRINT_MIN_DURATION_S,
+    'min_gap_s': sprint_bouts.SPRINT_MIN_GAP_S, 'repeated_min_bouts': sprint_bouts.REPEATED_SPRINT_MIN_BOUTS,
+    'repeated_max_recovery_s': sprint_bouts.REPEATED_SPRINT_MAX_RECOVERY_S}, default=False)
+
+
+def extract_player_features(chunks, context: dict, extractors: dict):
+    """
+    Run the extractors over a single read of a player chunks stream.
+
+    :param extractors: {name: (columns, extractor, by)}.
+    :return: {extractor name: {feature: per bin sums}}.
+    """
+    streams = tee(chunks, len(extractors))
+    partials = [extractor(stream, context) for (_, extractor, _), stream in zip(extractors.values(), streams)]
+    features = {name: {} for name in extractors}
+    for results in zip_longest(*partials):
+        for name, result in zip(extractors, results):
+            for feature, values in (result or {}).items():
+                features[name][feature] = features[name].get(feature, 0) + values
+    return features
+
+
+def _count_rows(chunks, context: dict):
+    for chunk in chunks:
+        context['rows_read'] += len(chunk)
+        yield chunk
+
+
+def extract_game_role_features(game_folder_path: str, context: dict, extractors: list = None, store_path: str = None):
+    """
+    Run the extractors over every player of a game, one read per player.
+
+    :param extractors: Names of the registered extractors to run, default is DEFAULT_FEATURE_EXTRACTORS.
+    :param context: The engine context, its 'rows_read' is increased by the number of samples read.
+    :return: {extractor name: {"{feature}_{role}s" or "{feature}_{player name}": per bin sums}}, roles in the
+             positions mapping order, players in the game order.
+    """
+    extractors = {name: FEATURE_EXTRACTORS[name] for name in (DEFAULT_FEATURE_EXTRACTORS if extractors is None else extractors)}
+    columns = list(dict.fromkeys(["Time"] + [column for columns, _, _ in extractors.values() for column in columns]))
+    starts_ns, ends_ns = context['segments_starts_ns'], context['segments_ends_ns']
+    context.setdefault('rows_read', 0)
+    role_features = {}  # role -> {extractor name: {feature: per bin sums}}
+    game_features = {name: {} for name in extractors}
+    players_features = {name: {} for name in extractors}
+    for player_name, chunks in iter_game_player_chunks(game_folder_path, store_path, columns, starts_ns[0], ends_ns[-1]):
+        player_role = POSITIONS_MAPPING[player_name.split('_')[0]]
+        player_features = extract_player_features(_count_rows(chunks, context), context, extractors)
+        role_dict = role_features.setdefault(player_role, {name: {} for name in extractors})
+        for name, features in player_features.items():
+            for feature, values in features.items():
+                if extractors[name][2] == 'player':
+                    players_features[name]["{}_{}".format(feature, player_name)] = values
+                    continue
+                column = "{}_{}s".format(feature, player_role)
+                role_dict[name][column] = role_dict[name].get(column, 0) + values
+    for role in dict.fromkeys(POSITIONS_MAPPING.values()):
+        for name, features in role_features.get(role, {}).items():
+            game_features[name].update(features)
+    for name, features in players_features.items():
+        game_features[name].update(features)
+    return game_features
+
+
+def build_features_table(index: pd.DatetimeIndex, durations, game_features: dict):
+    """
+    The features table layout: interval_duration, the zones of every role, the zones totals, then the
+    other extractors features of every role.
+    """
+    features_df = pd.DataFrame({"interval_duration": np.asarray(durations, dtype=np.float64)}, index=index)
+    for name, features in game_features.items():
+        for column, values in features.items():
+            features_df[column] = values
+        if name == "zones":
+            for feature in ZONE_FEATURES:
+                role_columns = ["{}_{}s".format(feature, role) for role in TOTAL_ROLES
+                                if "{}_{}s".format(feature, role) in features_df]
+                features_df["total_{}".format(feature)] = features_df[role_columns].sum(axis=1)
+    return features_df
+
+
+def extract_game_features(metadata_file_path: str, game_folder_path: str, opta_folder_path: str,
+                          summation_interval: int = 5, store_path: str = None, extractors: list = None,
+                          max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None):
+    """
+    All the features of a game in one read per player, written once as the game features csv
+    (same layout as get_game_features_csv followed by get_game_accel_decel_csv).
+
+    :param extractors: Names of the registered extractors to run, default is DEFAULT_FEATURE_EXTRACTORS.
+    :return: The features DataFrame, the number of samples read is in its attrs['rows_read'].
+    """
+    game_folder_name = os.path.basename(game_folder_path)
+    intervals = get_game_intervals(metadata_file_path, game_folder_name, summation_interval)
+    starts_ns, ends_ns = get_intervals_bounds_ns(intervals)
+    context = {
+        'segments_starts_ns': starts_ns,
+        'segments_ends_ns': ends_ns,
+        'to_bins': lambda times_ns: get_interval_bins(times_ns, starts_ns, ends_ns),
+        'n_bins': len(intervals),
+        'max_gap': max_gap,
+        'resample_hz': resample_hz,
+    }
+    game_features = extract_game_role_features(game_folder_path, context, extractors, store_path)
+    features_df = build_features_table(pd.DatetimeIndex([start for start, _ in intervals], name="interval_start"),
+                                       [(end - start).total_seconds() for start, end in intervals], game_features)
+
+    # Label each row with OPTA data, the xG of the shots in [interval_start, interval_start + summation_interval)
+    opta_file_path = os.path.join(opta_folder_path, get_season(game_folder_name), game_folder_name + ".csv")
+    features_df['TotalxG'] = get_intervals_xg(opta_file_path, starts_ns,
+                                              starts_ns + summation_interval * 60 * time_parsing.NS_PER_SECOND)
+    output_path = os.path.join(game_folder_path, "features_{}.csv".format(game_folder_name))
+    features_df.to_csv(output_path, index=True)
+    features_df.attrs['rows_read'] = context['rows_read']
+    return features_df
+
+
+def extract_game_features_incremental(metadata_file_path: str, game_folder_path: str, opta_folder_path: str, state: dict,
+                                      summation_interval: int = 5, store_path: str = None, extractors: list = None,
+                                      max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None):
+    """
+    Same as extract_game_features, but only when the game inputs changed since the features csv was last built.
+
+    :param state: The build state (see build_state.py), updated in place.
+    :return: The features DataFrame, None if the features csv was up to date.
+    """
+    game_folder_name = os.path.basename(game_folder_path)
+    target, csv_target = get_features_targets(summation_interval, game_folder_name)
+    output_path = os.path.join(game_folder_path, "features_{}.csv".format(game_folder_name))
+    extractors = list(DEFAULT_FEATURE_EXTRACTORS) if extractors is None else extractors
+    inputs_fingerprint = build_state.fingerprint(values={
+        'inputs': game_features_fingerprint(metadata_file_path, game_folder_path, opta_folder_path, summation_interval,
+                                            store_path, state['file_digests'], max_gap, resample_hz),
+        'extractors': extractors_fingerprint(extractors)})
+    if build_state.is_up_to_date(state, target, inputs_fingerprint, [output_path]):
+        print(f"Features of {game_folder_name} are up to date. Skipping...")
+        return None
+    features_df = extract_game_features(metadata_file_path, game_folder_path, opta_folder_path, summation_interval,
+                                        store_path, extractors, max_gap, resample_hz)
+    build_state.record_build(state, target, inputs_fingerprint)
+    state['targets'].pop(csv_target, None)
+    return features_df
+
+
+def extract_game_features_task(metadata_file_path: str, game_folder_path: str, opta_folder_path: str,
+                               summation_interval: int = 5, store_path: str = None, extractors: list = None,
+                               max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None,
+                               previous_fingerprint: str = None, digests_cache: dict = None):
+    """
+    extract_game_features_incremental of a single game, with all the game state passed explicitly so games can run
+    in separate processes, any error is caught and reported in the entry.
+    Extractors registered outside of module imports are not known to the worker processes.
+
+    :param previous_fingerprint: Inputs fingerprint of the last successful extraction of the game.
+    :param digests_cache: File digests cache (see build_state.file_digest), updated in place.
+    :return: The game manifest entry - status, rows read, timing, the inputs fingerprint and the new file digests.
+    """
+    started = time.perf_counter()
+    digests_cache = {} if digests_cache is None else digests_cache
+    game_folder_name = os.path.basename(game_folder_path)
+    target, _ = get_features_targets(summation_interval, game_folder_name)
+    entry = {'game': game_folder_name, 'season': get_season(game_folder_name), 'status': 'ok', 'rows_read': 0,
+             'seconds': 0.0, 'error': None, 'fingerprint': None}
+    digests_before = set(digests_cache)
+    # the build state of this game only, recorded into the run state by the caller
+    state = {'file_digests': digests_cache, 'targets': {target: previous_fingerprint}}
+    try:
+        features_df = extract_game_features_incremental(metadata_file_path, game_folder_path, opta_folder_path, state,
+                                                        summation_interval, store_path, extractors, max_gap,
+                                                        resample_hz)
+        if features_df is None:
+            entry['status'] = 'up_to_date'
+        else:
+            entry['rows_read'] = features_df.attrs['rows_read']
+        entry['fingerprint'] = state['targets'][target]
+    except Exception as e:
+        print(f"Error processing {game_folder_name}: {e}")
+        entry['status'] = 'failed'
+        entry['error'] = repr(e)
+    entry['seconds'] = round(time.perf_counter() - started, 3)
+    entry['file_digests'] = {path: digest for path, digest in digests_cache.items() if path not in digests_before}
+    return entry
+
+
+def extract_seasons_features(metadata_file_path: str, gps_folder_path: str, opta_folder_path: str, seasons: list,
+                             state_path: str, summation_interval: int = 5, store_path: str = None,
+                             n_workers: int = None, manifest_path: str = None, extractors: list = None,
+                             max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None):
+    """
+    Extract the features of all the games of the given seasons, games are fanned out over a process pool.
+    The build state is saved after every finished game, so an interrupted run resumes where it stopped:
+    extracted games are skipped, failed and unfinished games are extracted again.
+
+    :param gps_folder_path: The GPS folder, one sub folder per season holding the games folders.
+    :param state_path: The build state file (see build_state.py), the persisted progress of the extraction.
+    :param n_workers: Number of processes extracting games in parallel, default is the number of cores,
+                      1 runs serially in this process.
+    :param manifest_path: Where to write the JSON run manifest, default is "features_manifest.json" beside the state.
+    :return: The manifest dict - games counts by status, throughput (games/min, rows/s) and the games entries.
+    """
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    manifest_path = os.path.join(os.path.dirname(os.path.abspath(state_path)), "features_manifest.json") \
+        if manifest_path is None else manifest_path
+    state = build_state.load_build_state(state_path)
+    started = time.perf_counter()
+    tasks = []
+    for season in seasons:
+        season_path = os.path.join(gps_folder_path, season)
+        for game_folder_name in sorted(os.listdir(season_path)):
+            game_folder_path = os.path.join(season_path, game_folder_name)
+            if os.path.isdir(game_folder_path):
+                tasks.append((metadata_file_path, game_folder_path, opta_folder_path, summation_interval, store_path,
+                              extractors, max_gap, resample_hz,
+                              state['targets'].get(get_features_targets(summation_interval, game_folder_name)[0])))
+
+    def record(entry):
+        state['file_digests'].update(entry.pop('file_digests', {}))
+        if entry['status'] in ('ok', 'up_to_date'):
+            target, csv_target = get_features_targets(summation_interval, entry['game'])
+            build_state.record_build(state, target, entry['fingerprint'])
+            state['targets'].pop(csv_target, None)
+        build_state.save_build_state(state, state_path)
+        games.append(entry)
+
+    games = []
+    if n_workers <= 1:
+        for task in tasks:
+            print(f"Extracting features of game folder: {task[1]}")
+            record(extract_game_features_task(*task, digests_cache=state['file_digests']))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(extract_game_features_task, *task, digests_cache=state['file_digests']): task
+                       for task in tasks}
+            for future in as_completed(futures):
+                game_folder_path = futures[future][1]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    # the worker process itself died, the game entry couldn't be built there
+                    game_folder_name = os.path.basename(game_folder_path)
+                    entry = {'game': game_folder_name, 'season': get_season(game_folder_name), 'status': 'failed',
+                             'rows_read': 0, 'error': repr(e)}
+                print(f"Extracted features of game folder: {game_folder_path} ({entry['status']})")
+                record(entry)
+
+    seconds = time.perf_counter() - started
+    games_ok = sum(entry['status'] == 'ok' for entry in games)
+    rows_read = sum(entry['rows_read'] for entry in games)
+    manifest = {
+        'n_workers': n_workers,
+        'seasons': list(seasons),
+        'seconds': round(seconds, 3),
+        'games_ok': games_ok,
+        'games_up_to_date': sum(entry['status'] == 'up_to_date' for entry in games),
+        'games_failed': sum(entry['status'] == 'failed' for entry in games),
+        'rows_read': rows_read,
+        'games_per_minute': round(games_ok / seconds * 60, 3) if seconds else 0.0,
+        'rows_per_second': round(rows_read / seconds, 1) if seconds else 0.0,
+        'games': sorted(games, key=lambda entry: (entry['season'], entry['game'])),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    print(f"Extracted {games_ok} games ({manifest['games_up_to_date']} up to date, {manifest['games_failed']} failed) "
+          f"in {seconds:.1f}s - {manifest['games_per_minute']} games/min, {manifest['rows_per_second']} rows/s")
+    return manifest
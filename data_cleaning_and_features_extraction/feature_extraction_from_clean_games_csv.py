@@ -1,12 +1,20 @@
 from datetime import timedelta
 from concat_frames import *
-from constants import ZONE_6_SPRINT_THRESHOLD, ZONE_5_SPRINT_THRESHOLD, POSITIONS_MAPPING
+from constants import ZONE_6_SPRINT_THRESHOLD, ZONE_5_SPRINT_THRESHOLD, POSITIONS_MAPPING, MAX_SAMPLE_GAP_S, ACCELERATION_THRESHOLD
 import glob
 import pandas as pd
 import os 
 import math
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import gps_store
+import gps_stream
+import sample_intervals
+import time_parsing
+import build_state
+import metadata_registry
 
-acceleration_threshold = 3.0  # m/s² - acording to STATSports documentation
+acceleration_threshold = ACCELERATION_THRESHOLD  # m/s² - acording to STATSports documentation
 
 def get_season(game_folder_name: str):
     year = int(game_folder_name.split('-')[0])
@@ -17,10 +25,84 @@ def get_season(game_folder_name: str):
         return "ipl2324"
 
 def get_half_times(metadata_file_path: str, game_folder_name: str):
-    metadata_df = pd.read_csv(metadata_file_path)
-    game_row = metadata_df[metadata_df['game_folder_name'] == game_folder_name].iloc[0]
-    return (game_row['start_csv_time'], game_row['first_half_finish_csv_time'],
-            game_row['second_half_start_csv_time'], game_row['second_half_finish_csv_time'])
+    return metadata_registry.get_half_times(metadata_file_path, game_folder_name)
+
+def iter_game_player_frames(game_folder_path: str, store_path: str = None, columns: list = None):
+    """
+    Yield (player_name, player DataFrame) for every player session of a game.
+    When store_path is given the sessions are read from the columnar GPS store (only the requested columns),
+    otherwise from the cleaned csv files inside game_folder_path.
+    """
+    game_folder_name = os.path.basename(game_folder_path)
+    if store_path is not None:
+        season = get_season(game_folder_name)
+        for player_name, player_data in gps_store.iter_game_sessions(store_path, season, game_folder_name, columns):
+            print(f"Processing player: {player_name}")
+            yield player_name, player_data
+        return
+    for file in glob.glob(os.path.join(game_folder_path, "*-Entire-Session.csv")):
+        print(f"Processing file: {file}")
+        player_data = pd.read_csv(file, usecols=columns)
+        times_ns = time_parsing.parse_session_times_ns(player_data['Time'], *time_parsing.date_from_filename(file))
+        player_data['Time'] = time_parsing.ns_to_datetime(times_ns)
+        yield os.path.basename(file).split('-')[3], player_data
+
+def iter_game_player_chunks(game_folder_path: str, store_path: str = None, columns: list = None,
+                            time_begin_ns: int = None, time_end_ns: int = None):
+    """
+    Same as iter_game_player_frames but every player session is a stream of DataFrame chunks (see gps_stream.py),
+    so only one chunk of a player is in memory at a time.
+    Yield (player_name, chunks iterator), the chunks of a player must be consumed before moving to the next one.
+    """
+    game_folder_name = os.path.basename(game_folder_path)
+    if store_path is not None:
+        season = get_season(game_folder_name)
+        players_windows = gps_store.read_playing_windows(store_path, season, game_folder_name)
+        for player_name in gps_store.list_players(store_path, season, game_folder_name):
+            if players_windows is not None and not players_windows.get(player_name):
+                continue
+            print(f"Processing player: {player_name}")
+            yield player_name, gps_stream.iter_store_chunks(store_path, season, game_folder_name, player_name,
+                                                            columns, time_begin_ns, time_end_ns)
+        return
+    for file in glob.glob(os.path.join(game_folder_path, "*-Entire-Session.csv")):
+        print(f"Processing file: {file}")
+        yield os.path.basename(file).split('-')[3], gps_stream.iter_csv_chunks(file, columns, time_begin_ns, time_end_ns)
+
+def get_game_intervals(metadata_file_path: str, game_folder_name: str, summation_interval: int = 5):
+    """The game summation intervals [(interval start, interval end), ...] of both halves, as Timestamps."""
+    year, month, day = time_parsing.date_from_filename(game_folder_name)
+    first_half_start, first_half_end, second_half_start, second_half_end = get_half_times(
+        metadata_file_path=metadata_file_path, game_folder_name=game_folder_name
+    )
+    intervals = []
+    for half_start, half_end in [(first_half_start, first_half_end), (second_half_start, second_half_end)]:
+        half_start = pd.to_datetime(half_start).replace(year=year,month=month,day=day)
+        half_end = pd.to_datetime(half_end).replace(year=year,month=month,day=day)
+        current_time = half_start
+        while current_time < half_end:
+            interval_end = min(current_time + timedelta(minutes=summation_interval), half_end)
+            intervals.append((current_time, interval_end))
+            current_time = interval_end
+    return intervals
+
+def get_interval_bins(times_ns: np.ndarray, starts_ns: np.ndarray, ends_ns: np.ndarray):
+    """Interval index of every sample, -1 for samples outside all the intervals (before / after the game, half time)."""
+    bins = np.searchsorted(starts_ns, times_ns, side='right') - 1
+    inside = bins >= 0
+    inside[inside] = times_ns[inside] < ends_ns[bins[inside]]
+    return np.where(inside, bins, -1)
+
+def get_intervals_bounds_ns(intervals: list):
+    starts_ns = np.array([start.value for start, _ in intervals], dtype=np.int64)
+    ends_ns = np.array([end.value for _, end in intervals], dtype=np.int64)
+    return starts_ns, ends_ns
+
+def iter_player_intervals(chunks, intervals: list, columns: list = None):
+    """Yield (interval start, interval end, interval DataFrame) of a player chunks stream, one interval in memory at a time."""
+    starts_ns, ends_ns = get_intervals_bounds_ns(intervals)
+    for k, interval_data in gps_stream.iter_interval_frames(chunks, starts_ns, ends_ns, columns):
+        yield intervals[k][0], intervals[k][1], interval_data
 
 def add_features_to_existing_csv(existing_csv_path: str, new_features_df: pd.DataFrame):
     existing_df = pd.read_csv(existing_csv_path, parse_dates=['interval_start'])
@@ -31,94 +113,135 @@ def add_features_to_existing_csv(existing_csv_path: str, new_features_df: pd.Dat
     combined_df['TotalxG'] = xgCol
     return combined_df
 
-def get_game_features_csv(metadata_file_path: str, game_folder_path: str,opta_folder_path: str, summation_interval: int = 5):
-    game_folder_name = game_folder_path.split('\\')[-1]
-    year = int(game_folder_name.split('-')[0])
-    month = int(game_folder_name.split('-')[1])
-    day = int(game_folder_name.split('-')[2])
-    first_half_start, first_half_end, second_half_start, second_half_end = get_half_times(
-        metadata_file_path=metadata_file_path, game_folder_name=game_folder_name
-    )
-    csv_files = glob.glob(game_folder_path + r"\*.csv")
-    role_features_dict = {role: [] for role in POSITIONS_MAPPING.values()}
-
-    for file in csv_files:
-        player_data = pd.read_csv(file)
-        print(f"Processing file: {file}")
-        position = file.split('\\')[-1].split('-')[3].split('_')[0]
+def get_intervals_xg(opta_file_path: str, starts_ns: np.ndarray, ends_ns: np.ndarray):
+    """Total xG (rounded to 3 digits) of the OPTA shots in every [starts_ns[k], ends_ns[k]) window."""
+    opta_df = pd.read_csv(opta_file_path)
+    opta_df['TimeStamp'] = pd.to_datetime(opta_df['TimeStamp'], format='%Y-%m-%d %H:%M:%S')
+    opta_df = opta_df.sort_values('TimeStamp', kind='stable')
+    opta_times_ns = opta_df['TimeStamp'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    xg = opta_df['xG'].fillna(0).to_numpy()
+    first = np.searchsorted(opta_times_ns, starts_ns, side='left')
+    last = np.searchsorted(opta_times_ns, ends_ns, side='left')
+    return [round(xg[i:j].sum(), 3) for i, j in zip(first, last)]
+
+def get_game_features_csv(metadata_file_path: str, game_folder_path: str,opta_folder_path: str, summation_interval: int = 5,
+                          store_path: str = None, max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None):
+    """
+    :param max_gap: Longest time (seconds) a single sample may stand for, longer gaps between samples are clipped.
+    :param resample_hz: Resample the sessions to this fixed rate before integrating, default is the sessions own timestamps.
+    """
+    game_folder_name = os.path.basename(game_folder_path)
+    intervals = get_game_intervals(metadata_file_path, game_folder_name, summation_interval)
+    starts_ns, ends_ns = get_intervals_bounds_ns(intervals)
+    n_intervals = len(intervals)
+    role_features = {}  # role -> {feature name: per interval sums}
+
+    for player_name, chunks in iter_game_player_chunks(game_folder_path, store_path, ["Time", "Speed (m/s)"],
+                                                       starts_ns[0], ends_ns[-1]):
+        position = player_name.split('_')[0]
         player_role = POSITIONS_MAPPING[position]
-        player_data["Time"] = pd.to_datetime(player_data["Time"])
-        player_data["TimeDiff"] = 0.01  # Time difference between rows in seconds
-
-        # Process each half
-        for half_start, half_end in [(first_half_start, first_half_end), (second_half_start, second_half_end)]:
-            half_start = pd.to_datetime(half_start).replace(year=year,month=month,day=day)
-            half_end = pd.to_datetime(half_end).replace(year=year,month=month,day=day)
-            current_time = half_start
-
-            while current_time < half_end:
-                interval_end = current_time + timedelta(minutes=summation_interval)
-                interval_end = min(interval_end, half_end)
-                interval_index = player_data.index[(player_data["Time"] >= current_time) &
-                                                   (player_data["Time"] < interval_end)]
-                interval_data = player_data.loc[interval_index]
-
-                # Sum features for the interval
-                interval_features = {
-                    "interval_start": current_time,
-                    "interval_duration": (interval_end - current_time).total_seconds(),
-                    "zone_5_distance_{}s".format(player_role): 0,
-                    "zone_5_time_{}s".format(player_role): 0,
-                    "zone_6_distance_{}s".format(player_role): 0,
-                    "zone_6_time_{}s".format(player_role): 0,
-                }
-
-                for _, row in interval_data.iterrows():
-                    speed = row["Speed (m/s)"]
-                    if ZONE_5_SPRINT_THRESHOLD <= speed < ZONE_6_SPRINT_THRESHOLD:
-                        interval_features["zone_5_distance_{}s".format(player_role)] += speed * row["TimeDiff"]
-                        interval_features["zone_5_time_{}s".format(player_role)] += row["TimeDiff"]
-                    elif speed >= ZONE_6_SPRINT_THRESHOLD:
-                        interval_features["zone_6_distance_{}s".format(player_role)] += speed * row["TimeDiff"]
-                        interval_features["zone_6_time_{}s".format(player_role)] += row["TimeDiff"]
-
-                role_features_dict[player_role].append(interval_features)
-                current_time = interval_end
-
-    # Save the results to a Parquet file
-    # Create a DataFrame for each role and concatenate them
-    features_df = pd.concat(
-        [pd.DataFrame(features) for features in role_features_dict.values()],
-        ignore_index=True
-    ).set_index("interval_start")
-
-    # Sum features by interval_start
-    features_df = features_df.groupby("interval_start").agg(
-        lambda x: x.iloc[0] if x.name == "interval_duration" else x.sum(numeric_only=True)
+        features = role_features.setdefault(player_role, {
+            feature.format(player_role): np.zeros(n_intervals)
+            for feature in ["zone_5_distance_{}s", "zone_5_time_{}s", "zone_6_distance_{}s", "zone_6_time_{}s"]})
+
+        # Bin every sample into its interval and speed zone, then sum the zones of all the intervals at once
+        for chunk in sample_intervals.iter_with_durations(chunks, max_gap, resample_hz):
+            times_ns = chunk["Time"].to_numpy().astype('datetime64[ns]').view(np.int64)
+            bins = get_interval_bins(times_ns, starts_ns, ends_ns)
+            speed = chunk["Speed (m/s)"].to_numpy()
+            time_diff = chunk["TimeDiff"].to_numpy()  # Time (seconds) every sample stands for
+            inside = bins >= 0
+            zone_5 = inside & (speed >= ZONE_5_SPRINT_THRESHOLD) & (speed < ZONE_6_SPRINT_THRESHOLD)
+            zone_6 = inside & (speed >= ZONE_6_SPRINT_THRESHOLD)
+            for zone, zone_mask in (("zone_5", zone_5), ("zone_6", zone_6)):
+                features["{}_distance_{}s".format(zone, player_role)] += np.bincount(
+                    bins[zone_mask], weights=speed[zone_mask] * time_diff[zone_mask], minlength=n_intervals)
+                features["{}_time_{}s".format(zone, player_role)] += np.bincount(
+                    bins[zone_mask], weights=time_diff[zone_mask], minlength=n_intervals)
+
+    features_df = pd.DataFrame(
+        {"interval_duration": [(end - start).total_seconds() for start, end in intervals]},
+        index=pd.DatetimeIndex([start for start, _ in intervals], name="interval_start")
     )
+    # One column per role and feature, roles in the positions mapping order
+    for role in dict.fromkeys(POSITIONS_MAPPING.values()):
+        for feature, values in role_features.get(role, {}).items():
+            features_df[feature] = values
 
     features_df['total_zone_5_distance'] = features_df['zone_5_distance_defenders'] + features_df['zone_5_distance_midfielders'] + features_df['zone_5_distance_attackers']
     features_df['total_zone_5_time'] = features_df['zone_5_time_defenders'] + features_df['zone_5_time_midfielders'] + features_df['zone_5_time_attackers']
     features_df['total_zone_6_distance'] = features_df['zone_6_distance_defenders'] + features_df['zone_6_distance_midfielders'] + features_df['zone_6_distance_attackers']
     features_df['total_zone_6_time'] = features_df['zone_6_time_defenders'] + features_df['zone_6_time_midfielders'] + features_df['zone_6_time_attackers']
 
-    # Label each row with OPTA data
+    # Label each row with OPTA data, the xG of the shots in [interval_start, interval_start + summation_interval)
     season = get_season(game_folder_name)
     opta_file_path = os.path.join(opta_folder_path,season, game_folder_name+".csv")
-    opta_df = pd.read_csv(opta_file_path)
-    opta_df['TimeStamp'] = pd.to_datetime(opta_df['TimeStamp'], format='%Y-%m-%d %H:%M:%S')
-    for idx, row in features_df.iterrows():
-        matching_opta = opta_df[(opta_df['TimeStamp'] >= idx) & (opta_df['TimeStamp'] < idx + timedelta(minutes=summation_interval))]
-        if not matching_opta.empty:
-            features_df.at[idx, 'TotalxG'] = round(matching_opta['xG'].sum(), 3)
-        else:
-            features_df.at[idx, 'TotalxG'] = 0.000
+    features_df['TotalxG'] = get_intervals_xg(opta_file_path, starts_ns,
+                                              starts_ns + summation_interval * 60 * time_parsing.NS_PER_SECOND)
 
     # Save the results to a csv file
     output_path = os.path.join(game_folder_path, "features_{}.csv".format(game_folder_name))
     features_df.to_csv(output_path, index=True)
     return features_df
 
+def get_game_session_files(game_folder_path: str, store_path: str = None):
+    """The cleaned session files of a game, in the GPS store when store_path is given, else the game folder csv files."""
+    game_folder_name = os.path.basename(game_folder_path)
+    if store_path is not None:
+        season = get_season(game_folder_name)
+        return [gps_store.player_session_path(store_path, season, game_folder_name, player_name)
+                for player_name in gps_store.list_players(store_path, season, game_folder_name)]
+    return glob.glob(os.path.join(game_folder_path, "*-Entire-Session.csv"))
+
+def game_features_fingerprint(metadata_file_path: str, game_folder_path: str, opta_folder_path: str,
+                              summation_interval: int = 5, store_path: str = None, digests_cache: dict = None,
+                              max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None):
+    """Fingerprint of everything a game features csv depends on: cleaned GPS sessions, metadata row, OPTA file and interval."""
+    game_folder_name = os.path.basename(game_folder_path)
+    season = get_season(game_folder_name)
+    session_files = get_game_session_files(game_folder_path, store_path)
+    opta_file_path = os.path.join(opta_folder_path, season, game_folder_name + ".csv")
+    game_metadata = metadata_registry.get_game_frame(metadata_file_path, game_folder_name)
+    return build_state.fingerprint(session_files + [opta_file_path],
+                                   {'metadata': build_state.metadata_row_digest(game_metadata),
+                                    'summation_interval': summation_interval,
+                                    'max_gap': max_gap,
+                                    'resample_hz': resample_hz},
+                                   digests_cache)
+
+def get_features_targets(summation_interval: int, game_folder_name: str):
+    """
+    (feature engine target, get_game_features_csv target) of a game features csv in the build state.
+    Both write the same csv with different layouts, building it with one drops the record of the other.
+    """
+    return (f"features/{summation_interval}/{game_folder_name}",
+            f"features_csv/{summation_interval}/{game_folder_name}")
+
+def get_game_features_csv_incremental(metadata_file_path: str, game_folder_path: str, opta_folder_path: str, state: dict,
+                                      summation_interval: int = 5, store_path: str = None,
+                                      max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None):
+    """
+    Same as get_game_features_csv, but only when the game inputs changed since the features csv was last built.
+
+    :param state: The build state (see build_state.py), updated in place.
+    :return: The features DataFrame, None if the features csv was up to date.
+    """
+    game_folder_name = os.path.basename(game_folder_path)
+    engine_target, target = get_features_targets(summation_interval, game_folder_name)
+    output_path = os.path.join(game_folder_path, "features_{}.csv".format(game_folder_name))
+    inputs_fingerprint = game_features_fingerprint(metadata_file_path, game_folder_path, opta_folder_path,
+                                                   summation_interval, store_path, state['file_digests'],
+                                                   max_gap, resample_hz)
+    if build_state.is_up_to_date(state, target, inputs_fingerprint, [output_path]):
+        print(f"Features of {game_folder_name} are up to date. Skipping...")
+        return None
+    features_df = get_game_features_csv(metadata_file_path, game_folder_path, opta_folder_path, summation_interval, store_path,
+                                        max_gap, resample_hz)
+    build_state.record_build(state, target, inputs_fingerprint)
+    state['targets'].pop(engine_target, None)
+    return features_df
+
+# Deprecated function, the detection runs over whole streamed sessions in detect_accelerations_decelerations. Kept for reference
 def count_accelerations_decelerations(df):
     accelerations, decelerations = 0, 0
     aggregated_df = df.groupby('Time').agg(lambda x: x.mean() if x.dtype.kind in 'biufc' else x.iloc[0])
@@ -132,10 +255,8 @@ def count_accelerations_decelerations(df):
 
     for i, row in enumerate(aggregated_df.itertuples()):
         if row.acceleration >= acceleration_threshold:
-            current_speed = row._4 if "Speed (m/s)" not in aggregated_df.columns else row._asdict().get("Speed (m/s)", None)
-            # If column names are not preserved, _4 is likely "Speed (m/s)"
-            if current_speed is None:
-                current_speed = row._4
+            # Read the speed by column rather than by tuple position, the column set depends on the projection
+            current_speed = speeds[i]
 
             next_speeds = speeds[i+1:i+6]
             if len(next_speeds) == 0:
@@ -150,57 +271,117 @@ def count_accelerations_decelerations(df):
                 decelerations += 1
     return accelerations, decelerations
 
-def get_game_accel_decel_csv(metadata_file_path:str, game_folder_path: str,summation_interval: int = 5):
-    game_folder_name = game_folder_path.split('\\')[-1]
-    year = int(game_folder_name.split('-')[0])
-    month = int(game_folder_name.split('-')[1])
-    day = int(game_folder_name.split('-')[2])
-    first_half_start, first_half_end, second_half_start, second_half_end = get_half_times(
-        metadata_file_path=metadata_file_path, game_folder_name=game_folder_name
-    )
-    csv_files = glob.glob(game_folder_path + r"\*.csv")
-    role_features_dict = {role: [] for role in POSITIONS_MAPPING.values()}
-    features_file = None
-    for file in csv_files:
-        if not file.endswith("Entire-Session.csv"):
-            features_file = file    
-            continue
-        print(f"Processing file: {file}")
-        player_data = pd.read_csv(file,parse_dates=['Time'])
-        player_data['Time'] = player_data['Time'].dt.floor('ms')
-        position = file.split('\\')[-1].split('-')[3].split('_')[0]
+def _aggregate_by_time(times_ns: np.ndarray, bins: np.ndarray, values: np.ndarray):
+    """Mean of the values of the samples sharing the same (sorted) time, NaNs skipped like pandas mean."""
+    group_starts = np.flatnonzero(np.r_[True, times_ns[1:] != times_ns[:-1]])
+    not_nan = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(not_nan, values, 0.0), group_starts, axis=0)
+    counts = np.add.reduceat(not_nan, group_starts, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return group_starts, bins[group_starts], means
+
+def _detect_events(group_bins: np.ndarray, means: np.ndarray, n_resolved: int, lookahead: int,
+                   threshold: float = acceleration_threshold):
+    """
+    Events (+1 acceleration, -1 deceleration, 0 none) and acceleration magnitudes of the first n_resolved aggregated samples.
+    A sample with an acceleration magnitude over the threshold is compared to the next lookahead speeds of its interval,
+    more higher speeds is an acceleration and more lower speeds a deceleration.
+    """
+    speeds = means[:, 0]
+    acceleration = np.linalg.norm(means[:, 1:4], axis=1)
+    padded_speeds = np.r_[speeds, np.full(lookahead, np.nan)]
+    padded_bins = np.r_[group_bins, np.full(lookahead, -1)]
+    next_speeds = sliding_window_view(padded_speeds[1:], lookahead)[:n_resolved]
+    same_interval = sliding_window_view(padded_bins[1:], lookahead)[:n_resolved] == group_bins[:n_resolved, None]
+    current_speeds = speeds[:n_resolved, None]
+    higher = ((next_speeds > current_speeds) & same_interval).sum(axis=1)
+    lower = ((next_speeds < current_speeds) & same_interval).sum(axis=1)
+    over_threshold = acceleration[:n_resolved] >= threshold
+    events = np.where(over_threshold & (higher > lower), 1, np.where(over_threshold & (lower > higher), -1, 0))
+    return events, acceleration[:n_resolved]
+
+def iter_acceleration_events(chunks, starts_ns: np.ndarray, ends_ns: np.ndarray, lookahead: int = 5,
+                             threshold: float = acceleration_threshold):
+    """
+    Detect the accelerations and decelerations of a player session in one pass over the streamed session
+    (same events as count_accelerations_decelerations on every interval).
+    Samples are aggregated by their time floored to the millisecond, the lookahead speeds of a sample are taken
+    inside its own interval. The last aggregated samples of a chunk are carried to the next one, until their
+    lookahead speeds are known.
+
+    :param chunks: The player chunks stream with "Time", "Speed (m/s)", "Accl X", "Accl Y" and "Accl Z".
+    :param threshold: Minimal acceleration magnitude (m/s²) of an event.
+    :return: Generator of (times_ns, interval bins, events, acceleration magnitudes) arrays of the aggregated samples,
+             events are +1 acceleration, -1 deceleration and 0 none.
+    """
+    carry_times, carry_bins, carry_values = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, 4))
+    chunks = iter(chunks)
+    while True:
+        chunk = next(chunks, None)
+        if chunk is not None:
+            times_ns = chunk["Time"].to_numpy().astype('datetime64[ns]').view(np.int64)
+            times_ns = times_ns - times_ns % 1_000_000
+            bins = get_interval_bins(times_ns, starts_ns, ends_ns)
+            inside = bins >= 0
+            values = chunk[["Speed (m/s)", "Accl X", "Accl Y", "Accl Z"]].to_numpy(dtype=np.float64)[inside]
+            carry_times = np.r_[carry_times, times_ns[inside]]
+            carry_bins = np.r_[carry_bins, bins[inside]]
+            carry_values = np.concatenate([carry_values, values])
+        if len(carry_times):
+            group_starts, group_bins, means = _aggregate_by_time(carry_times, carry_bins, carry_values)
+            # the last group may go on in the next chunk and the lookahead of the groups before it is not complete
+            n_resolved = len(group_starts) if chunk is None else max(len(group_starts) - lookahead - 1, 0)
+            if n_resolved:
+                events, magnitudes = _detect_events(group_bins, means, n_resolved, lookahead, threshold)
+                yield carry_times[group_starts[:n_resolved]], group_bins[:n_resolved], events, magnitudes
+                first_carried = group_starts[n_resolved] if n_resolved < len(group_starts) else len(carry_times)
+                carry_times = carry_times[first_carried:]
+                carry_bins = carry_bins[first_carried:]
+                carry_values = carry_values[first_carried:]
+        if chunk is None:
+            return
+
+def detect_accelerations_decelerations(chunks, starts_ns: np.ndarray, ends_ns: np.ndarray, lookahead: int = 5):
+    """
+    Count the accelerations and decelerations of a player session in every interval (see iter_acceleration_events).
+
+    :return: (accelerations, decelerations) arrays with a count per interval.
+    """
+    n_intervals = len(starts_ns)
+    accelerations = np.zeros(n_intervals, dtype=np.int64)
+    decelerations = np.zeros(n_intervals, dtype=np.int64)
+    for _, bins, events, _ in iter_acceleration_events(chunks, starts_ns, ends_ns, lookahead):
+        accelerations += np.bincount(bins[events == 1], minlength=n_intervals)
+        decelerations += np.bincount(bins[events == -1], minlength=n_intervals)
+    return accelerations, decelerations
+
+# Deprecated function, the accelerations are computed with the zones in one read by feature_engine.extract_game_features. Kept for reference
+def get_game_accel_decel_csv(metadata_file_path:str, game_folder_path: str,summation_interval: int = 5,
+                             store_path: str = None):
+    game_folder_name = os.path.basename(game_folder_path)
+    intervals = get_game_intervals(metadata_file_path, game_folder_name, summation_interval)
+    starts_ns, ends_ns = get_intervals_bounds_ns(intervals)
+    role_features = {}  # role -> {feature name: per interval counts}
+    features_file = os.path.join(game_folder_path, "features_{}.csv".format(game_folder_name))
+    accel_columns = ["Time", "Speed (m/s)", "Accl X", "Accl Y", "Accl Z"]
+    for player_name, chunks in iter_game_player_chunks(game_folder_path, store_path, accel_columns,
+                                                       starts_ns[0], ends_ns[-1]):
+        position = player_name.split('_')[0]
         player_role = POSITIONS_MAPPING[position]
-        # Process each half
-        for half_start, half_end in [(first_half_start, first_half_end), (second_half_start, second_half_end)]:
-            half_start = pd.to_datetime(half_start).replace(year=year,month=month,day=day)
-            half_end = pd.to_datetime(half_end).replace(year=year,month=month,day=day)
-            current_time = half_start
-
-            while current_time < half_end:
-                interval_end = current_time + timedelta(minutes=summation_interval)
-                interval_end = min(interval_end, half_end)
-                interval_index = player_data.index[(player_data["Time"] >= current_time) &
-                                                   (player_data["Time"] < interval_end)]
-                interval_data = player_data.loc[interval_index]
-                accelerations, decelerations = count_accelerations_decelerations(interval_data)
-                interval_features = {
-                    "interval_start": current_time,
-                    "accelerations_{}s".format(player_role): accelerations,
-                    "decelerations_{}s".format(player_role): decelerations
-                    }
-                role_features_dict[player_role].append(interval_features)
-                current_time = interval_end
-
-    
-    features_df = pd.concat(
-        [pd.DataFrame(features) for features in role_features_dict.values()],
-        ignore_index=True
-    ).set_index("interval_start")
-
-    # Sum features by interval_start
-    features_df = features_df.groupby("interval_start").agg(
-        lambda x: x.iloc[0] if x.name == "interval_duration" else x.sum(numeric_only=True)
-    )
+        accelerations, decelerations = detect_accelerations_decelerations(chunks, starts_ns, ends_ns)
+        features = role_features.setdefault(player_role, {
+            "accelerations_{}s".format(player_role): np.zeros(len(intervals), dtype=np.int64),
+            "decelerations_{}s".format(player_role): np.zeros(len(intervals), dtype=np.int64)})
+        features["accelerations_{}s".format(player_role)] += accelerations
+        features["decelerations_{}s".format(player_role)] += decelerations
+
+    features_df = pd.DataFrame(index=pd.DatetimeIndex([start for start, _ in intervals], name="interval_start"))
+    # One column per role and feature, roles in the positions mapping order. Counts are written as floats
+    # like the existing datasets
+    for role in dict.fromkeys(POSITIONS_MAPPING.values()):
+        for feature, values in role_features.get(role, {}).items():
+            features_df[feature] = values.astype(np.float64)
     features_df = add_features_to_existing_csv(features_file, features_df)    
     output_path = os.path.join(game_folder_path, "features_{}.csv".format(game_folder_name))
     features_df.to_csv(output_path, index=True)
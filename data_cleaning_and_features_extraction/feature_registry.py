@@ -0,0 +1,154 @@
+import numpy as np
+from itertools import tee, zip_longest
+import sample_intervals
+from feature_extraction_from_clean_games_csv import iter_acceleration_events
+from constants import SPEED_ZONES, ACCELERATION_THRESHOLD, ACCELERATION_BANDS
+
+"""
+Declarative features registry.
+Every feature is declared once with its kind and thresholds, a set of features is compiled into a plan whose
+extractor (see feature_engine.py) evaluates all of them together in a single pass: one mask per distinct speed band
+over the shared speed / sample duration arrays of a chunk, one acceleration detection for all the acceleration bands.
+A thresholds sweep is a set of features declared with the swept thresholds, extracted in the same single read.
+Feature kinds:
+    distance - distance (m) covered while the speed is in [low, high) m/s
+    time - time (s) spent with the speed in [low, high) m/s
+    entries - number of entries into the [low, high) m/s speed band (sprints counts)
+    accelerations / decelerations - events (see iter_acceleration_events) with a magnitude in [low, high) m/s²
+Features are summed per role ("{feature}_{role}s") or per player ("{feature}_{player name}").
+"""
+
+SPEED_KINDS = ("distance", "time", "entries")
+ACCEL_KINDS = ("accelerations", "decelerations")
+
+FEATURE_REGISTRY = {}  # feature name -> declaration
+
+
+def declare_feature(name: str, kind: str, low: float, high: float = float('inf'), by: str = 'role'):
+    """
+    Declare (or redeclare) a feature.
+
+    :param by: 'role' or 'player', what the feature is summed by.
+    :return: The feature declaration dict.
+    """
+    if kind not in SPEED_KINDS + ACCEL_KINDS:
+        raise ValueError(f"Unknown feature kind: {kind}")
+    if by not in ('role', 'player'):
+        raise ValueError(f"Features are summed by 'role' or 'player', not {by}")
+    FEATURE_REGISTRY[name] = {'name': name, 'kind': kind, 'low': float(low), 'high': float(high), 'by': by}
+    return FEATURE_REGISTRY[name]
+
+
+def _band_name(low: float, high: float):
+    return f"{low:g}_{high:g}" if high != float('inf') else f"over_{low:g}"
+
+
+def sweep_thresholds(kind: str, thresholds: list, by: str = 'role'):
+    """
+    Declare one "{kind}_over_{threshold}" feature per threshold (speed in m/s, acceleration in m/s²).
+
+    :return: The declared features names.
+    """
+    return [declare_feature(f"{kind}_{_band_name(threshold, float('inf'))}", kind, threshold, by=by)['name']
+            for threshold in thresholds]
+
+
+# Speed zones 1-6 distance and time, sprints are entries into zone 6
+for _zone, (_low, _high) in enumerate(zip(SPEED_ZONES[:-1], SPEED_ZONES[1:]), start=1):
+    declare_feature(f"zone_{_zone}_distance", "distance", _low, _high)
+    declare_feature(f"zone_{_zone}_time", "time", _low, _high)
+declare_feature("sprints", "entries", SPEED_ZONES[5])
+# Accelerations over the STATSports threshold, and by magnitude bands
+declare_feature("accelerations", "accelerations", ACCELERATION_THRESHOLD)
+declare_feature("decelerations", "decelerations", ACCELERATION_THRESHOLD)
+for _low, _high in zip(ACCELERATION_BANDS[:-1], ACCELERATION_BANDS[1:]):
+    declare_feature(f"accelerations_{_band_name(_low, _high)}", "accelerations", _low, _high)
+    declare_feature(f"decelerations_{_band_name(_low, _high)}", "decelerations", _low, _high)
+
+
+def compile_plan(feature_names: list):
+    """
+    Compile a set of declared features into an evaluation plan.
+
+    :return: Plan dict - the speed and acceleration features, the distinct speed bands, the minimal acceleration
+             threshold, the session columns needed and what the features are summed by.
+    """
+    features = [FEATURE_REGISTRY[name] for name in feature_names]
+    by = {feature['by'] for feature in features}
+    if len(by) > 1:
+        raise ValueError("A plan sums all its features the same way, declare per role and per player features in separate plans")
+    speed_features = [feature for feature in features if feature['kind'] in SPEED_KINDS]
+    accel_features = [feature for feature in features if feature['kind'] in ACCEL_KINDS]
+    columns = ["Speed (m/s)"] + (["Accl X", "Accl Y", "Accl Z"] if accel_features else [])
+    return {
+        'features': features,
+        'speed_features': speed_features,
+        'accel_features': accel_features,
+        'speed_bands': sorted({(feature['low'], feature['high']) for feature in speed_features}),
+        'accel_threshold': min(feature['low'] for feature in accel_features) if accel_features else None,
+        'columns': columns,
+        'by': by.pop() if by else 'role',
+    }
+
+
+def _speed_features(chunks, context: dict, plan: dict):
+    n_bins = context['n_bins']
+    previous_in_band = {band: False for band in plan['speed_bands']}
+    for chunk in sample_intervals.iter_with_durations(chunks, context['max_gap'], context['resample_hz']):
+        times_ns = chunk["Time"].to_numpy().astype('datetime64[ns]').view(np.int64)
+        bins = context['to_bins'](times_ns)
+        speed = chunk["Speed (m/s)"].to_numpy()
+        time_diff = chunk["TimeDiff"].to_numpy()
+        inside = bins >= 0
+        # One mask per distinct band, shared by all the features of the band
+        in_band = {(low, high): (speed >= low) & (speed < high) for low, high in plan['speed_bands']}
+        partial = {}
+        for feature in plan['speed_features']:
+            band = (feature['low'], feature['high'])
+            mask = in_band[band] & inside
+            if feature['kind'] == 'distance':
+                partial[feature['name']] = np.bincount(bins[mask], weights=speed[mask] * time_diff[mask], minlength=n_bins)
+            elif feature['kind'] == 'time':
+                partial[feature['name']] = np.bincount(bins[mask], weights=time_diff[mask], minlength=n_bins)
+            else:
+                entering = mask & ~np.r_[previous_in_band[band], in_band[band][:-1]]
+                partial[feature['name']] = np.bincount(bins[entering], minlength=n_bins)
+        for band, band_mask in in_band.items():
+            previous_in_band[band] = bool(band_mask[-1])
+        yield partial
+
+
+def _accel_features(chunks, context: dict, plan: dict):
+    n_bins = context['n_bins']
+    for times_ns, _, events, magnitudes in iter_acceleration_events(chunks, context['segments_starts_ns'],
+                                                                    context['segments_ends_ns'],
+                                                                    threshold=plan['accel_threshold']):
+        bins = context['to_bins'](times_ns)
+        partial = {}
+        for feature in plan['accel_features']:
+            direction = 1 if feature['kind'] == 'accelerations' else -1
+            mask = (events == direction) & (magnitudes >= feature['low']) & (magnitudes < feature['high']) & (bins >= 0)
+            partial[feature['name']] = np.bincount(bins[mask], minlength=n_bins)
+        yield partial
+
+
+def plan_extractor(feature_names: list):
+    """
+    A feature extractor (see feature_engine.py) evaluating the compiled plan of the given features.
+
+    :return: (plan, extractor).
+    """
+    plan = compile_plan(feature_names)
+
+    def extractor(chunks, context: dict):
+        yield {feature['name']: np.zeros(context['n_bins']) for feature in plan['features']}
+        parts = [part for part, features in ((_speed_features, plan['speed_features']), (_accel_features, plan['accel_features']))
+                 if features]
+        streams = tee(chunks, len(parts))
+        for results in zip_longest(*[part(stream, context, plan) for part, stream in zip(parts, streams)]):
+            partial = {}
+            for result in results:
+                partial.update(result or {})
+            yield partial
+
+    return plan, extractor
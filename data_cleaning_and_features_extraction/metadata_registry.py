@@ -0,0 +1,90 @@
+import os
+import pandas as pd
+import time_parsing
+
+"""
+Games metadata registry shared by all the modules.
+The metadata csv is parsed once per process (and again only if the file changed on disk), games are keyed
+by their folder name and by their date ("YYYY-MM-DD"), so every lookup is a dict access instead of a csv parse or a full column regex scan.
+The halves times of a game are parsed into epoch nanoseconds on its first get_half_times_ns call and kept on its
+record, a malformed or missing time only fails the lookups of its own game.
+"""
+
+HALF_TIME_COLUMNS = ['start_csv_time', 'first_half_finish_csv_time', 'second_half_start_csv_time', 'second_half_finish_csv_time']
+
+_registries = {}  # metadata path -> (mtime_ns, registry)
+
+
+def _build_registry(metadata_path: str):
+    metadata_df = pd.read_csv(metadata_path)
+    by_folder = {}
+    by_date = {}
+    for record in metadata_df.to_dict(orient='records'):
+        game_folder_name = record['game_folder_name']
+        year, month, day = time_parsing.date_from_filename(game_folder_name)
+        record['date'] = (year, month, day)
+        by_folder.setdefault(game_folder_name, record)
+        by_date.setdefault(f"{year}-{month:02d}-{day:02d}", record)
+    return {'metadata_df': metadata_df, 'by_folder': by_folder, 'by_date': by_date}
+
+
+def get_registry(metadata_path: str):
+    mtime_ns = os.stat(metadata_path).st_mtime_ns
+    cached = _registries.get(metadata_path)
+    if cached is None or cached[0] != mtime_ns:
+        cached = (mtime_ns, _build_registry(metadata_path))
+        _registries[metadata_path] = cached
+    return cached[1]
+
+
+def get_game(metadata_path: str, game_folder_name: str = None, date: str = None):
+    """
+    Metadata record (dict) of a game, looked up by its folder name or by its date ("YYYY-MM-DD").
+    A folder name that is not in the metadata falls back to its date. Returns None if the game is unknown.
+    """
+    registry = get_registry(metadata_path)
+    if game_folder_name is not None:
+        record = registry['by_folder'].get(game_folder_name)
+        if record is not None:
+            return record
+        year, month, day = time_parsing.date_from_filename(game_folder_name)
+        date = f"{year}-{month:02d}-{day:02d}"
+    return registry['by_date'].get(date)
+
+
+def get_game_frame(metadata_path: str, game_folder_name: str = None, date: str = None):
+    """Same as get_game but as a one row DataFrame of the original metadata columns (empty if the game is unknown)."""
+    record = get_game(metadata_path, game_folder_name, date)
+    columns = get_registry(metadata_path)['metadata_df'].columns
+    if record is None:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame([{column: record[column] for column in columns}])
+
+
+def _get_known_game(metadata_path: str, game_folder_name: str):
+    record = get_game(metadata_path, game_folder_name)
+    if record is None:
+        raise KeyError(f"Game {game_folder_name} is not in the metadata file {metadata_path}")
+    return record
+
+
+def get_half_times(metadata_path: str, game_folder_name: str):
+    """
+    (start, first half finish, second half start, second half finish) as "HH:MM:SS" strings.
+    Raises KeyError if the game is unknown.
+    """
+    record = _get_known_game(metadata_path, game_folder_name)
+    return tuple(record[column] for column in HALF_TIME_COLUMNS)
+
+
+def get_half_times_ns(metadata_path: str, game_folder_name: str):
+    """Same as get_half_times, as int64 epoch nanoseconds of the game date."""
+    record = _get_known_game(metadata_path, game_folder_name)
+    if 'half_times_ns' not in record:
+        year, month, day = record['date']
+        try:
+            record['half_times_ns'] = tuple(time_parsing.clock_to_ns(record[column], year, month, day)
+                                            for column in HALF_TIME_COLUMNS)
+        except (AttributeError, ValueError) as e:
+            raise ValueError(f"Malformed half times of game {game_folder_name} in {metadata_path}: {e}") from e
+    return record['half_times_ns']
@@ -1,28 +1,49 @@
-from feature_extraction_from_clean_games_csv import *
+from feature_engine import *
+import argparse
 import os
-import glob
 
-game_folder_path = r"C:\Users\Afek\Documents\Technion studies\semester 6\bina_project_utils\clean_data\GPS\ipl2425\2025-03-16-March 16, 2025-RawDataExtended"
-game_features_df = get_game_features_csv(
-    metadata_file_path=r"C:\Users\Afek\Documents\Technion studies\semester 6\bina_project_utils\games_metadata.csv",
-    game_folder_path=game_folder_path,
-opta_folder_path = r"C:\Users\Afek\Documents\Technion studies\semester 6\bina_project_utils\clean_data\OPTA"
-)
+base_data_path = r"C:\Users\Afek\Documents\Technion studies\semester 6\bina_project_utils"
 
 
-base_dir_path = r"C:\Users\Afek\Documents\Technion studies\semester 6\bina_project_utils\clean_data\GPS\ipl2425\feature extraction done"
-for game_folder_name in os.listdir(base_dir_path):
-    game_folder_path = os.path.join(base_dir_path, game_folder_name)
-    if os.path.isdir(game_folder_path):  # Ensure it's a directory
-        try:
-            game_features_df = get_game_features_csv(
-                metadata_file_path=r"C:\Users\Afek\Documents\Technion studies\semester 6\bina_project_utils\games_metadata.csv"
-                , game_folder_path=game_folder_path
-            , opta_folder_path=r"C:\Users\Afek\Documents\Technion studies\semester 6\bina_project_utils\clean_data\OPTA"
-            )
-        except Exception as e:
-            print(f"Error processing {game_folder_name}: {e}")
-            continue
-        print(f"Created CSV for game: {game_folder_name}")
-        print(game_features_df.head())
-        print(game_features_df.describe())
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract the features of all the games of the given seasons.")
+    parser.add_argument("--base-data-path", default=base_data_path,
+                        help="Folder holding games_metadata.csv and clean_data/GPS, clean_data/OPTA.")
+    parser.add_argument("--metadata", help="Games metadata csv, default is {base}/games_metadata.csv.")
+    parser.add_argument("--gps", help="Cleaned GPS folder, default is {base}/clean_data/GPS.")
+    parser.add_argument("--opta", help="OPTA folder, default is {base}/clean_data/OPTA.")
+    parser.add_argument("--store", help="Read the sessions from this GPS store instead of the GPS folder csv files.")
+    parser.add_argument("--seasons", nargs="+", default=["ipl2324", "ipl2425"])
+    parser.add_argument("--interval", type=int, default=5, help="Summation interval in minutes.")
+    parser.add_argument("--extractors", nargs="+", default=None,
+                        help="Feature extractors to run, default is DEFAULT_FEATURE_EXTRACTORS (add sprint_bouts to opt in).")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, default is all the cores.")
+    parser.add_argument("--state", help="Build state file, default is {gps}/features_build_state.json.")
+    parser.add_argument("--manifest", help="Run manifest file, default is beside the build state.")
+    args = parser.parse_args()
+    args.metadata = args.metadata or os.path.join(args.base_data_path, "games_metadata.csv")
+    args.gps = args.gps or os.path.join(args.base_data_path, "clean_data", "GPS")
+    args.opta = args.opta or os.path.join(args.base_data_path, "clean_data", "OPTA")
+    args.state = args.state or os.path.join(args.gps, "features_build_state.json")
+    return args
+
+
+if __name__ == "__main__":
+    # All the games of the seasons over all the cores. The build state is the persisted progress, games whose
+    # inputs didn't change since the last run are skipped and failed games are retried, see build_state.py
+    args = parse_args()
+    manifest = extract_seasons_features(
+        metadata_file_path=args.metadata,
+        gps_folder_path=args.gps,
+        opta_folder_path=args.opta,
+        seasons=args.seasons,
+        state_path=args.state,
+        summation_interval=args.interval,
+        store_path=args.store,
+        n_workers=args.workers,
+        manifest_path=args.manifest,
+        extractors=args.extractors,
+    )
+    for entry in manifest['games']:
+        if entry['status'] == 'failed':
+            print(f"Error processing {entry['game']}: {entry['error']}")
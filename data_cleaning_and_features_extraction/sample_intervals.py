@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import time_parsing
+from constants import NOMINAL_SAMPLE_RATE_HZ, MAX_SAMPLE_GAP_S
+
+"""
+Sample interval model shared by every time integrated feature (zone distance and time...).
+Every sample stands for the time until the next sample (forward difference of 'Time'), so dropped samples,
+duplicated timestamps (0 seconds) and lower rate exports (10Hz) are integrated correctly. Gaps longer than
+max_gap_s (drop outs, the playing windows cuts) are clipped to it.
+The sessions may also be resampled to a fixed rate in the same pass, numeric columns linearly interpolated.
+Works on the chunks streams of gps_stream.py, the last sample of a chunk is closed by the first sample of the next one.
+"""
+
+
+def nominal_sample_duration(durations: np.ndarray):
+    """Typical sample duration (seconds) of a session part, the median of the positive durations."""
+    positive = durations[durations > 0]
+    return float(np.median(positive)) if len(positive) else 1 / NOMINAL_SAMPLE_RATE_HZ
+
+
+def sample_durations(times_ns: np.ndarray, next_time_ns: int = None, max_gap_s: float = MAX_SAMPLE_GAP_S):
+    """
+    Seconds every sample of a time sorted session stands for.
+
+    :param next_time_ns: Time of the sample following the last one, when unknown the last sample gets the nominal duration.
+    :return: Float array, same length as times_ns.
+    """
+    durations = np.empty(len(times_ns))
+    if len(times_ns) == 0:
+        return durations
+    durations[:-1] = np.diff(times_ns) / time_parsing.NS_PER_SECOND
+    if next_time_ns is not None:
+        durations[-1] = (next_time_ns - times_ns[-1]) / time_parsing.NS_PER_SECOND
+    else:
+        durations[-1] = nominal_sample_duration(durations[:-1])
+    return np.clip(durations, 0.0, max_gap_s)
+
+
+def resample_chunk(chunk: pd.DataFrame, next_row: pd.DataFrame = None, resample_hz: float = NOMINAL_SAMPLE_RATE_HZ,
+                   max_gap_s: float = MAX_SAMPLE_GAP_S):
+    """
+    Resample a chunk to a fixed rate grid aligned on the epoch, so consecutive chunks continue the same grid.
+    Numeric columns are linearly interpolated, grid points further than max_gap_s from the previous sample are dropped.
+
+    :param next_row: First sample of the next chunk, closes the last interval of this chunk.
+    :return: DataFrame with 'Time', the numeric columns and 'TimeDiff' (the grid step in seconds).
+    """
+    step_ns = int(round(time_parsing.NS_PER_SECOND / resample_hz))
+    times_ns = chunk['Time'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    columns = [c for c in chunk.columns if c != 'Time' and pd.api.types.is_numeric_dtype(chunk[c])]
+    values = chunk[columns].to_numpy(dtype=np.float64)
+    if next_row is not None and len(next_row):
+        end_ns = int(next_row['Time'].to_numpy().astype('datetime64[ns]').view(np.int64)[0])
+        times_ns = np.r_[times_ns, end_ns]
+        values = np.concatenate([values, next_row[columns].to_numpy(dtype=np.float64)[:1]])
+    else:
+        end_ns = int(times_ns[-1]) + 1
+    first_ns = -(-int(times_ns[0]) // step_ns) * step_ns
+    grid_ns = np.arange(first_ns, end_ns, step_ns, dtype=np.int64)
+    previous = np.searchsorted(times_ns, grid_ns, side='right') - 1
+    grid_ns = grid_ns[grid_ns - times_ns[previous] < max_gap_s * time_parsing.NS_PER_SECOND]
+    resampled = {'Time': time_parsing.ns_to_datetime(grid_ns)}
+    for i, column in enumerate(columns):
+        resampled[column] = np.interp(grid_ns, times_ns, values[:, i])
+    resampled['TimeDiff'] = np.full(len(grid_ns), step_ns / time_parsing.NS_PER_SECOND)
+    return pd.DataFrame(resampled)
+
+
+def iter_with_durations(chunks, max_gap_s: float = MAX_SAMPLE_GAP_S, resample_hz: float = None):
+    """
+    Add the 'TimeDiff' (seconds) sample durations to a time sorted chunks stream, optionally resampled to resample_hz.
+    Every chunk is held until the first sample of the next one is known, so two chunks are in memory at most.
+    """
+    previous = None
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        if previous is not None:
+            yield _close_chunk(previous, chunk.iloc[:1], max_gap_s, resample_hz)
+        previous = chunk
+    if previous is not None:
+        yield _close_chunk(previous, None, max_gap_s, resample_hz)
+
+
+def _close_chunk(chunk: pd.DataFrame, next_row: pd.DataFrame, max_gap_s: float, resample_hz: float):
+    if resample_hz is not None:
+        return resample_chunk(chunk, next_row, resample_hz, max_gap_s)
+    times_ns = chunk['Time'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    next_time_ns = None
+    if next_row is not None:
+        next_time_ns = int(next_row['Time'].to_numpy().astype('datetime64[ns]').view(np.int64)[0])
+    return chunk.assign(TimeDiff=sample_durations(times_ns, next_time_ns, max_gap_s))
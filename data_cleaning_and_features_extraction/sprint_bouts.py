@@ -0,0 +1,199 @@
+import os
+import numpy as np
+import pandas as pd
+import sample_intervals
+import time_parsing
+from feature_extraction_from_clean_games_csv import get_game_intervals, get_intervals_bounds_ns, get_interval_bins, \
+    iter_game_player_chunks
+from constants import ZONE_6_SPRINT_THRESHOLD, POSITIONS_MAPPING, MAX_SAMPLE_GAP_S, SPRINT_MIN_DURATION_S, \
+    SPRINT_MIN_GAP_S, REPEATED_SPRINT_MIN_BOUTS, REPEATED_SPRINT_MAX_RECOVERY_S
+
+"""
+Sprint bouts of the players sessions.
+The speed channel is thresholded and run-length encoded into raw runs (a gap longer than max_gap in the samples
+ends a run), runs closer than min_gap are merged into one bout and bouts shorter than min_duration are dropped.
+A bout lasts from its first sample to the end of its last sample (see sample_intervals.py).
+Repeated sprints sequences are at least REPEATED_SPRINT_MIN_BOUTS bouts with at most REPEATED_SPRINT_MAX_RECOVERY_S
+seconds of recovery between them, found with the same run-length encoding over the recoveries.
+Works on the chunks streams of gps_stream.py, only the samples of a bout still open at a chunk end are carried over.
+"""
+
+BOUT_COLUMNS = ["start_ns", "end_ns", "distance", "max_speed"]
+
+
+def true_runs(mask: np.ndarray, breaks: np.ndarray = None):
+    """
+    Run-length encoding of the True runs of a boolean mask.
+
+    :param breaks: Boolean mask, True where a sample starts a new run even when the previous sample is True too.
+    :return: (starts, ends) indices of the runs, ends exclusive.
+    """
+    edges = np.diff(np.r_[0, mask.astype(np.int8), 0])
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if breaks is not None:
+        splits = np.flatnonzero(mask & breaks & np.r_[False, mask[:-1]])
+        starts = np.sort(np.r_[starts, splits])
+        ends = np.sort(np.r_[ends, splits])
+    return starts, ends
+
+
+def _empty_bouts():
+    return {"start_ns": np.zeros(0, dtype=np.int64), "end_ns": np.zeros(0, dtype=np.int64),
+            "distance": np.zeros(0), "max_speed": np.zeros(0)}
+
+
+def _raw_runs(times_ns: np.ndarray, speed: np.ndarray, durations: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+    if len(starts) == 0:
+        return _empty_bouts()
+    # runs are disjoint and sorted, reduceat over the runs starts sums every run (the samples between two runs
+    # land in the previous run sum, so they are masked out first)
+    inside = np.zeros(len(times_ns) + 1, dtype=np.int64)
+    np.add.at(inside, starts, 1)
+    np.add.at(inside, ends, -1)
+    inside = np.cumsum(inside[:-1]) > 0
+    last = ends - 1
+    return {"start_ns": times_ns[starts],
+            "end_ns": times_ns[last] + np.round(durations[last] * time_parsing.NS_PER_SECOND).astype(np.int64),
+            "distance": np.add.reduceat(np.where(inside, speed * durations, 0.0), starts),
+            "max_speed": np.maximum.reduceat(np.where(inside, speed, -np.inf), starts)}
+
+
+def _merge_runs(runs: dict, min_gap_s: float):
+    """Merge the runs closer than min_gap_s, returns the bouts and the first raw run index of every bout."""
+    if len(runs["start_ns"]) == 0:
+        return runs, np.zeros(0, dtype=np.int64)
+    gaps_ns = runs["start_ns"][1:] - runs["end_ns"][:-1]
+    firsts = np.flatnonzero(np.r_[True, gaps_ns >= min_gap_s * time_parsing.NS_PER_SECOND])
+    lasts = np.r_[firsts[1:], len(gaps_ns) + 1] - 1
+    return {"start_ns": runs["start_ns"][firsts],
+            "end_ns": runs["end_ns"][lasts],
+            "distance": np.add.reduceat(runs["distance"], firsts),
+            "max_speed": np.maximum.reduceat(runs["max_speed"], firsts)}, firsts
+
+
+def _select(bouts: dict, mask):
+    return {column: values[mask] for column, values in bouts.items()}
+
+
+def _concat(first: dict, second: dict):
+    return {column: np.concatenate([first[column], second[column]]) for column in BOUT_COLUMNS}
+
+
+def iter_sprint_bouts(chunks, threshold: float = ZONE_6_SPRINT_THRESHOLD, min_duration_s: float = SPRINT_MIN_DURATION_S,
+                      min_gap_s: float = SPRINT_MIN_GAP_S, max_gap_s: float = MAX_SAMPLE_GAP_S, resample_hz: float = None):
+    """
+    Detect the sprint bouts of a player session in one pass over the streamed session.
+
+    :param chunks: The player chunks stream with "Time" and "Speed (m/s)".
+    :param threshold: Sprint speed (m/s).
+    :return: Generator of the bouts closed by every chunk (possibly none), dicts of arrays
+             "start_ns", "end_ns", "distance" (m) and "max_speed" (m/s).
+    """
+    carry = None  # samples of the run still open at the end of the previous chunk
+    pending = _empty_bouts()  # raw runs which may still merge with the runs of the next chunks
+    for chunk in sample_intervals.iter_with_durations(chunks, max_gap_s, resample_hz):
+        times_ns = chunk["Time"].to_numpy().astype('datetime64[ns]').view(np.int64)
+        speed = chunk["Speed (m/s)"].to_numpy(dtype=np.float64)
+        durations = chunk["TimeDiff"].to_numpy()
+        if carry is not None:
+            times_ns, speed, durations = (np.r_[carried, current] for carried, current in zip(carry, (times_ns, speed, durations)))
+        above = speed >= threshold
+        breaks = np.r_[False, np.diff(times_ns) > max_gap_s * time_parsing.NS_PER_SECOND]
+        starts, ends = true_runs(above, breaks)
+        carry = None
+        if len(starts) and ends[-1] == len(times_ns):
+            carry = (times_ns[starts[-1]:], speed[starts[-1]:], durations[starts[-1]:])
+            starts, ends = starts[:-1], ends[:-1]
+        pending = _concat(pending, _raw_runs(times_ns, speed, durations, starts, ends))
+        # the next run starts at the carried run start or after the last sample, bouts ending min_gap before are closed
+        horizon_ns = carry[0][0] if carry is not None else times_ns[-1]
+        bouts, firsts = _merge_runs(pending, min_gap_s)
+        closed = bouts["end_ns"] + int(min_gap_s * time_parsing.NS_PER_SECOND) <= horizon_ns
+        n_closed = len(closed) if closed.all() else int(np.argmin(closed))
+        pending = _select(pending, slice(firsts[n_closed] if n_closed < len(firsts) else len(pending["start_ns"]), None))
+        yield _drop_short(_select(bouts, slice(0, n_closed)), min_duration_s)
+    if carry is not None:
+        times_ns, speed, durations = carry
+        pending = _concat(pending, _raw_runs(times_ns, speed, durations, np.array([0]), np.array([len(times_ns)])))
+    yield _drop_short(_merge_runs(pending, min_gap_s)[0], min_duration_s)
+
+
+def _drop_short(bouts: dict, min_duration_s: float):
+    return _select(bouts, bouts["end_ns"] - bouts["start_ns"] >= min_duration_s * time_parsing.NS_PER_SECOND)
+
+
+def repeated_sprint_sequences(starts_ns: np.ndarray, ends_ns: np.ndarray, min_bouts: int = REPEATED_SPRINT_MIN_BOUTS,
+                              max_recovery_s: float = REPEATED_SPRINT_MAX_RECOVERY_S):
+    """
+    Repeated sprints sequences of a player time sorted bouts.
+
+    :return: Sequence number (0, 1, ...) of every bout, -1 for the bouts outside any sequence.
+    """
+    sequences = np.full(len(starts_ns), -1, dtype=np.int64)
+    linked = starts_ns[1:] - ends_ns[:-1] <= max_recovery_s * time_parsing.NS_PER_SECOND
+    starts, ends = true_runs(linked)
+    # a run of k links is a sequence of k + 1 bouts
+    long_enough = ends - starts + 1 >= min_bouts
+    for sequence, (start, end) in enumerate(zip(starts[long_enough], ends[long_enough])):
+        sequences[start:end + 1] = sequence
+    return sequences
+
+
+def sprint_bouts_extractor(chunks, context: dict):
+    """Sprint bouts count and time, and repeated sprints sequences count, at the bout (sequence) start bin."""
+    n_bins = context['n_bins']
+    yield {"sprint_bouts": np.zeros(n_bins), "sprint_bouts_time": np.zeros(n_bins), "repeated_sprints": np.zeros(n_bins)}
+    player_bouts = _empty_bouts()
+    for bouts in iter_sprint_bouts(chunks, max_gap_s=context['max_gap'], resample_hz=context['resample_hz']):
+        # a player has a few hundred bouts at most, they are kept for the sequences and counted at the end
+        player_bouts = _concat(player_bouts, bouts)
+        yield {}
+    bins = context['to_bins'](player_bouts["start_ns"])
+    inside = bins >= 0
+    sequences = repeated_sprint_sequences(player_bouts["start_ns"], player_bouts["end_ns"])
+    sequence_firsts = inside & (sequences >= 0) & (np.r_[-1, sequences[:-1]] != sequences)
+    durations_s = (player_bouts["end_ns"] - player_bouts["start_ns"]) / time_parsing.NS_PER_SECOND
+    yield {"sprint_bouts": np.bincount(bins[inside], minlength=n_bins),
+           "sprint_bouts_time": np.bincount(bins[inside], weights=durations_s[inside], minlength=n_bins),
+           "repeated_sprints": np.bincount(bins[sequence_firsts], minlength=n_bins)}
+
+
+def get_game_sprint_bouts(metadata_file_path: str, game_folder_path: str, summation_interval: int = 5,
+                          store_path: str = None, threshold: float = ZONE_6_SPRINT_THRESHOLD,
+                          min_duration_s: float = SPRINT_MIN_DURATION_S, min_gap_s: float = SPRINT_MIN_GAP_S,
+                          max_gap: float = MAX_SAMPLE_GAP_S, resample_hz: float = None):
+    """
+    The sprint bouts table of a game, saved beside the features csv as "sprint_bouts_{game folder name}.csv".
+    Only the bouts starting inside the game halves are kept.
+
+    :return: DataFrame with one row per bout - player, role, start, end, duration (s), distance (m), max speed (m/s),
+             the summation interval it starts in and its repeated sprints sequence (-1 for none).
+    """
+    game_folder_name = os.path.basename(game_folder_path)
+    intervals = get_game_intervals(metadata_file_path, game_folder_name, summation_interval)
+    starts_ns, ends_ns = get_intervals_bounds_ns(intervals)
+    tables = []
+    for player_name, chunks in iter_game_player_chunks(game_folder_path, store_path, ["Time", "Speed (m/s)"],
+                                                       starts_ns[0], ends_ns[-1]):
+        player_bouts = _empty_bouts()
+        for bouts in iter_sprint_bouts(chunks, threshold, min_duration_s, min_gap_s, max_gap, resample_hz):
+            player_bouts = _concat(player_bouts, bouts)
+        bins = get_interval_bins(player_bouts["start_ns"], starts_ns, ends_ns)
+        player_bouts = _select(player_bouts, bins >= 0)
+        bins = bins[bins >= 0]
+        tables.append(pd.DataFrame({
+            "player": player_name,
+            "role": POSITIONS_MAPPING[player_name.split('_')[0]],
+            "start": time_parsing.ns_to_datetime(player_bouts["start_ns"]),
+            "end": time_parsing.ns_to_datetime(player_bouts["end_ns"]),
+            "duration": (player_bouts["end_ns"] - player_bouts["start_ns"]) / time_parsing.NS_PER_SECOND,
+            "distance": player_bouts["distance"],
+            "max_speed": player_bouts["max_speed"],
+            "interval_start": time_parsing.ns_to_datetime(starts_ns[bins]),
+            "sequence": repeated_sprint_sequences(player_bouts["start_ns"], player_bouts["end_ns"]),
+        }))
+    bouts_df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(
+        columns=["player", "role", "start", "end", "duration", "distance", "max_speed", "interval_start", "sequence"])
+    bouts_df.to_csv(os.path.join(game_folder_path, "sprint_bouts_{}.csv".format(game_folder_name)), index=False)
+    return bouts_df
@@ -17,17 +17,27 @@ def haversine(lon1, lat1, lon2, lat2):
     r = 6371 
     return c * r
 
+def load_game_frame(path, columns=('Time', 'Player', 'Lat', 'Lon')):
+    """
+    Load only the needed columns of a concat_frames output, either a ".parquet" file or a CSV file.
+    """
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path, columns=list(columns))
+    else:
+        df = pd.read_csv(path, usecols=list(columns))
+    df['Time'] = pd.to_datetime(df['Time'])
+    return df
+
 def time_range_stats(path,frequency):
     """
     Calculate KM-covered, average speed and average acceleration statistics for each player over time frequency.
 
-    :param path: Path to the CSV file containing player tracking data after concat_frames.
+    :param path: Path to the CSV or Parquet file containing player tracking data after concat_frames.
     :param frequency: Frequency of the time intervals for statistics, use Datatime frequencies format (https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html#offset-aliases)
     
     :return: DataFrame with statistics for each player at each time interval.
     """
-    df = pd.read_csv(path)
-    df['Time'] = pd.to_datetime(df['Time'])
+    df = load_game_frame(path)
     players = df['Player'].unique()
 
     stats = []
@@ -63,13 +73,12 @@ def find_lineup(path):
     """
     Calculate KM-covered, average speed and average acceleration statistics for each player over time frequency.
 
-    :param path: Path to the CSV file containing player tracking data after concat_frames.
+    :param path: Path to the CSV or Parquet file containing player tracking data after concat_frames.
     :param frequency: Frequency of the time intervals for statistics, use Datatime frequencies format (https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html#offset-aliases)
     
     :return: DataFrame with statistics for each player at each time interval.
     """
-    df = pd.read_csv(path)
-    df['Time'] = pd.to_datetime(df['Time'])
+    df = load_game_frame(path)
     players = df['Player'].unique()
 
     first_chunk = True
@@ -104,8 +113,7 @@ def find_subs(path, lineup):
     If a new player enters the top 10 and stays there for 3 consecutive minutes,
     replace the player who left the top 10 in the lineup.
     """
-    df = pd.read_csv(path)
-    df['Time'] = pd.to_datetime(df['Time'])
+    df = load_game_frame(path)
     players_names = df['Player'].unique()
     played = set(lineup)
     current_lineup = set(lineup)
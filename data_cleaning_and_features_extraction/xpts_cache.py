@@ -0,0 +1,102 @@
+import os
+import json
+import hashlib
+import pandas as pd
+import build_state
+
+"""
+On-disk cache of the matches expected points (see expected_points_montecarlo_simulator.simulate_match).
+An entry is keyed by the digest of the match shot data (the possessions, teams and xG of the OPTA csv, so editing
+other columns of the file doesn't invalidate it) and by the simulation settings (method, number of simulations,
+seed...). The exact method doesn't depend on the simulation settings, its entries are keyed by the shot data only.
+Every entry is a JSON file "{key}.json" in the cache folder holding the simulate_match result (both models).
+The keys include XPTS_CACHE_VERSION, bump it when the entry format or the simulation changes so old entries miss.
+A hit touches the entry file, when the cache grows over max_entries files or max_bytes the least recently used
+entries are deleted.
+"""
+
+SHOT_COLUMNS = ['PossNum', 'Team', 'xG']
+XPTS_CACHE_MAX_ENTRIES = 10_000
+XPTS_CACHE_MAX_BYTES = 64 << 20
+XPTS_CACHE_VERSION = 1
+XPTS_CACHE_DIR = "xpts_cache"  # default cache folder, beside the outputs in the working directory
+
+
+def shots_digest(df: pd.DataFrame):
+    """SHA-256 of the shot data of a match OPTA DataFrame, the possessions rows and the home and away teams."""
+    sha = hashlib.sha256()
+    sha.update(f"{df['homeTeam'].iloc[0]}|{df['awayTeam'].iloc[0]}\n".encode())
+    sha.update(df[SHOT_COLUMNS].to_csv(index=False).encode())
+    return sha.hexdigest()
+
+
+def cache_key(match_shots_digest: str, method: str, n_sim: int, seed: int, tol: float = None, chunk_size: int = None):
+    """Key of a match entry, the settings a method doesn't use are left out of the key."""
+    values = {'version': XPTS_CACHE_VERSION, 'shots': match_shots_digest, 'method': method}
+    if method != "exact":
+        values.update(n_sim=n_sim, seed=seed)
+    if method == "adaptive":
+        values.update(tol=tol, chunk_size=chunk_size)
+    return build_state.fingerprint(values=values)
+
+
+def _entry_path(cache_dir: str, key: str):
+    return os.path.join(cache_dir, f"{key}.json")
+
+
+def get_entry(cache_dir: str, key: str):
+    """The cached entry (dict) of a key, None on a miss (also when the entry is evicted while it is read)."""
+    path = _entry_path(cache_dir, key)
+    try:
+        with open(path, 'r') as f:
+            entry = json.load(f)
+        os.utime(path)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return entry
+
+
+def put_entry(cache_dir: str, key: str, entry: dict, evict: bool = True,
+              max_entries: int = XPTS_CACHE_MAX_ENTRIES, max_bytes: int = XPTS_CACHE_MAX_BYTES):
+    """
+    Save an entry, written to a temporary file first so a concurrent reader never sees a partial entry.
+
+    :param evict: Evict the least recently used entries right away, set to False when saving many entries at once
+                  and call evict_entries after.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _entry_path(cache_dir, key)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(entry, f)
+    os.replace(path + ".tmp", path)
+    if evict:
+        evict_entries(cache_dir, max_entries, max_bytes)
+
+
+def evict_entries(cache_dir: str, max_entries: int = XPTS_CACHE_MAX_ENTRIES, max_bytes: int = XPTS_CACHE_MAX_BYTES):
+    """
+    Delete the least recently used entries until the cache has at most max_entries files and max_bytes.
+    Entries deleted meanwhile by a concurrent eviction are skipped.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".json"):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+    entries.sort()
+    total_bytes = sum(size for _, size, _ in entries)
+    n_entries = len(entries)
+    for _, size, name in entries:
+        if n_entries <= max_entries and total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        n_entries -= 1
+        total_bytes -= size
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules import each other by name, both folders are on the path like when running the scripts
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ["2D_game_simulation", "data_cleaning_and_features_extraction"]:
+    sys.path.insert(0, os.path.join(ROOT, folder))
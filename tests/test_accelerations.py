@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+import feature_extraction_from_clean_games_csv as fe
+
+
+def _session(n_samples=3000, seed=0):
+    """A 100Hz player session with some samples sharing their time, like the raw STATSports files."""
+    rng = np.random.default_rng(seed)
+    steps_ms = rng.choice([0, 10, 10, 10, 20], size=n_samples)
+    times = pd.Timestamp("2024-03-16 19:00:00") + pd.to_timedelta(np.cumsum(steps_ms), unit='ms')
+    return pd.DataFrame({
+        'Time': times,
+        'Speed (m/s)': np.clip(rng.normal(4, 2, n_samples), 0, None),
+        'Accl X': rng.normal(0, 2, n_samples),
+        'Accl Y': rng.normal(0, 2, n_samples),
+        'Accl Z': rng.normal(0, 2, n_samples),
+    })
+
+
+def _intervals(session):
+    """Three intervals with a gap between the second and the third, like the half time."""
+    start = session['Time'].iloc[0]
+    bounds = [(start, start + pd.Timedelta(seconds=9)),
+              (start + pd.Timedelta(seconds=9), start + pd.Timedelta(seconds=15)),
+              (start + pd.Timedelta(seconds=18), session['Time'].iloc[-1] + pd.Timedelta(seconds=1))]
+    return fe.get_intervals_bounds_ns(bounds)
+
+
+def _reference_counts(session, starts_ns, ends_ns):
+    times_ns = session['Time'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    counts = [fe.count_accelerations_decelerations(session[(times_ns >= start) & (times_ns < end)])
+              for start, end in zip(starts_ns, ends_ns)]
+    return [a for a, _ in counts], [d for _, d in counts]
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 7, 64, 1000, 3000])
+def test_chunked_detector_matches_reference(chunk_rows):
+    session = _session()
+    starts_ns, ends_ns = _intervals(session)
+    chunks = [session.iloc[i:i + chunk_rows] for i in range(0, len(session), chunk_rows)]
+    accelerations, decelerations = fe.detect_accelerations_decelerations(chunks, starts_ns, ends_ns)
+    expected_accelerations, expected_decelerations = _reference_counts(session, starts_ns, ends_ns)
+    assert sum(expected_accelerations) > 0 and sum(expected_decelerations) > 0
+    assert accelerations.tolist() == expected_accelerations
+    assert decelerations.tolist() == expected_decelerations
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import feature_extraction_from_clean_games_csv as fe
+
+
+def _write_opta(path, rows):
+    pd.DataFrame(rows, columns=['TimeStamp', 'xG']).to_csv(path, index=False)
+
+
+def _bounds(*clocks):
+    return np.array([pd.Timestamp(f"2024-03-16 {clock}").value for clock in clocks], dtype=np.int64)
+
+
+def test_intervals_xg_skips_missing_xg(tmp_path):
+    opta_file = tmp_path / "game.csv"
+    _write_opta(opta_file, [
+        ("2024-03-16 19:01:00", 0.1),
+        ("2024-03-16 19:02:00", np.nan),  # an event without a shot
+        ("2024-03-16 19:03:00", 0.25),
+        ("2024-03-16 19:07:00", np.nan),
+    ])
+    starts_ns = _bounds("19:00:00", "19:05:00", "19:10:00")
+    ends_ns = _bounds("19:05:00", "19:10:00", "19:15:00")
+    assert fe.get_intervals_xg(str(opta_file), starts_ns, ends_ns) == [0.35, 0.0, 0.0]
+
+
+def test_intervals_xg_bounds_are_half_open(tmp_path):
+    opta_file = tmp_path / "game.csv"
+    _write_opta(opta_file, [("2024-03-16 19:05:00", 0.3), ("2024-03-16 19:00:00", 0.2)])
+    starts_ns = _bounds("19:00:00", "19:05:00")
+    ends_ns = _bounds("19:05:00", "19:10:00")
+    assert fe.get_intervals_xg(str(opta_file), starts_ns, ends_ns) == [0.2, 0.3]